@@ -17,6 +17,10 @@ fileConfig(config.config_file_name)
 # target_metadata = mymodel.Base.metadata
 from bcpc_build.db.migration_types import UUIDType
 from bcpc_build.db.models.build_unit import BuildUnitBase
+from bcpc_build.db.models.build_queue import BuildQueueEntryBase
+from bcpc_build.db.models.build_checkpoint import BuildCheckpointBase
+from bcpc_build.db.models.build_phase_event import BuildPhaseEventBase
+from bcpc_build.db.models.build_state_event import BuildStateEventBase
 target_metadata = [BuildUnitBase.metadata]
 
 # other values from the config, defined by the needs of env.py,
@@ -0,0 +1,61 @@
+"""Add build state event table.
+
+Revision ID: 2f9b6d4e8a13
+Revises: e1a6b93d5f20
+Create Date: 2026-10-18 18:40:27.658301+00:00
+
+"""
+from alembic import op
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+import bcpc_build.db.migration_types
+
+
+revision = '2f9b6d4e8a13'
+down_revision = 'e1a6b93d5f20'
+branch_labels = None
+depends_on = None
+
+
+STATES = (
+    'provisioned', 'provisioning',
+    'configuring', 'configured',
+    'building', 'done', 'failed',
+    'failed:provision', 'failed:build',
+    'pooled',
+)
+
+
+def state_type():
+    # build_unit.build_state already created the type on PostgreSQL
+    return sa.Enum(*STATES, name='buildstateenum').with_variant(
+        postgresql.ENUM(*STATES, name='buildstateenum', create_type=False),
+        'postgresql')
+
+
+def upgrade():
+    op.create_table('build_state_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('unit_id', bcpc_build.db.migration_types.UUIDType(),
+              nullable=False),
+    sa.Column('from_state', state_type(), nullable=True),
+    sa.Column('to_state', state_type(), nullable=True),
+    sa.Column('timestamp', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('pid', sa.Integer(), nullable=True),
+    sa.Column('host', sa.Unicode(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_build_state_event_unit_id_timestamp',
+                    'build_state_event', ['unit_id', 'timestamp'],
+                    unique=False)
+    op.create_index('ix_build_state_event_to_state_timestamp',
+                    'build_state_event', ['to_state', 'timestamp'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_build_state_event_to_state_timestamp',
+                  table_name='build_state_event')
+    op.drop_index('ix_build_state_event_unit_id_timestamp',
+                  table_name='build_state_event')
+    op.drop_table('build_state_event')
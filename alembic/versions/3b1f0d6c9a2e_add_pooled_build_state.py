@@ -0,0 +1,102 @@
+"""Add pooled build state.
+
+Revision ID: 3b1f0d6c9a2e
+Revises: 60a3f9fdb580
+Create Date: 2026-10-18 09:12:44.503117+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import bcpc_build.db.migration_types
+
+
+revision = '3b1f0d6c9a2e'
+down_revision = '60a3f9fdb580'
+branch_labels = None
+depends_on = None
+
+
+OLD_STATES = (
+    'provisioned', 'provisioning',
+    'configuring', 'configured',
+    'building', 'done', 'failed',
+    'failed_provision', 'failed_build',
+)
+# Values as persisted by the model (see BuildUnitBase.build_state)
+NEW_STATES = (
+    'provisioned', 'provisioning',
+    'configuring', 'configured',
+    'building', 'done', 'failed',
+    'failed:provision', 'failed:build',
+    'pooled',
+)
+
+
+# Renamed on the way up
+RENAMED = (
+    ('failed_provision', 'failed:provision'),
+    ('failed_build', 'failed:build'),
+)
+
+
+def _upgrade_postgresql():
+    for old, new in RENAMED:
+        op.execute("ALTER TYPE buildstateenum RENAME VALUE '%s' TO '%s'"
+                   "" % (old, new))
+    # Not allowed in a transaction block before PostgreSQL 12
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE buildstateenum ADD VALUE 'pooled'")
+
+
+def _downgrade_postgresql():
+    # Enum values cannot be dropped, so the type is rebuilt
+    op.execute('ALTER TYPE buildstateenum RENAME TO buildstateenum_old')
+    op.execute('CREATE TYPE buildstateenum AS ENUM (%s)'
+               '' % ', '.join("'%s'" % s for s in OLD_STATES))
+    cases = ' '.join("WHEN '%s' THEN '%s'" % (new, old)
+                     for old, new in RENAMED)
+    op.execute('ALTER TABLE build_unit ALTER COLUMN build_state'
+               ' TYPE buildstateenum USING (CASE build_state::text %s'
+               ' ELSE build_state::text END)::buildstateenum' % cases)
+    op.execute('DROP TYPE buildstateenum_old')
+
+
+def _rename(renames):
+    cases = ' '.join("WHEN '%s' THEN '%s'" % pair for pair in renames)
+    op.execute('UPDATE build_unit SET build_state = CASE build_state %s'
+               ' ELSE build_state END' % cases)
+
+
+def _alter_sqlite(from_states, to_states):
+    with op.batch_alter_table('build_unit', schema=None) as batch_op:
+        batch_op.alter_column(
+            'build_state',
+            existing_type=sa.Enum(*from_states, name='buildstateenum'),
+            type_=sa.Enum(*to_states, name='buildstateenum'),
+            existing_nullable=True)
+
+
+def _retype_sqlite(from_states, to_states, renames):
+    # The CHECK constraint is widened to both sets of values first, so
+    # that rows can be renamed, then narrowed
+    both = from_states + tuple(s for s in to_states if s not in from_states)
+    _alter_sqlite(from_states, both)
+    _rename(renames)
+    _alter_sqlite(both, to_states)
+
+
+def upgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        _upgrade_postgresql()
+        return
+    _retype_sqlite(OLD_STATES, NEW_STATES, RENAMED)
+
+
+def downgrade():
+    op.execute("UPDATE build_unit SET build_state = 'failed'"
+               " WHERE build_state = 'pooled'")
+    if op.get_context().dialect.name == 'postgresql':
+        _downgrade_postgresql()
+        return
+    _retype_sqlite(NEW_STATES, OLD_STATES,
+                   [(new, old) for old, new in RENAMED])
@@ -0,0 +1,63 @@
+"""Add build unit indexes and unique names.
+
+Revision ID: 4c8d2f7a1e95
+Revises: b7f3e2a9c614
+Create Date: 2026-10-18 17:21:09.204583+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import uuid
+import bcpc_build.db.migration_types
+
+
+revision = '4c8d2f7a1e95'
+down_revision = 'b7f3e2a9c614'
+branch_labels = None
+depends_on = None
+
+NAME_LENGTH = 128
+
+
+def _short_id(id_):
+    # UUIDType stores 16 raw bytes where the backend lacks a uuid type
+    if isinstance(id_, bytes):
+        return uuid.UUID(bytes=id_).hex[:8]
+    return uuid.UUID(str(id_)).hex[:8]
+
+
+def _rename_duplicates():
+    # Names were only checked before insert, so racing allocations may
+    # have left duplicates; all but the oldest get part of their id
+    # appended, the name shortened to keep within the column
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        'SELECT id, name FROM build_unit WHERE name IN ('
+        ' SELECT name FROM build_unit GROUP BY name HAVING COUNT(*) > 1)'
+        ' ORDER BY name, created_at, id'
+    )).fetchall()
+    seen = set()
+    for id_, name in rows:
+        if name in seen:
+            suffix = '-' + _short_id(id_)
+            renamed = name[:NAME_LENGTH - len(suffix)] + suffix
+            conn.execute(sa.text(
+                'UPDATE build_unit SET name = :name WHERE id = :id'
+            ), name=renamed, id=id_)
+        seen.add(name)
+
+
+def upgrade():
+    _rename_duplicates()
+    op.create_index(op.f('ix_build_unit_name'), 'build_unit', ['name'],
+                    unique=True)
+    op.create_index(op.f('ix_build_unit_build_user'), 'build_unit',
+                    ['build_user'], unique=False)
+    op.create_index(op.f('ix_build_unit_build_state'), 'build_unit',
+                    ['build_state'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_build_unit_build_state'), table_name='build_unit')
+    op.drop_index(op.f('ix_build_unit_build_user'), table_name='build_unit')
+    op.drop_index(op.f('ix_build_unit_name'), table_name='build_unit')
@@ -0,0 +1,34 @@
+"""Add build checkpoint table.
+
+Revision ID: 5e8a1f3c2d47
+Revises: 9d2c7e41b8a3
+Create Date: 2026-10-18 14:02:31.640912+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import bcpc_build.db.migration_types
+
+
+revision = '5e8a1f3c2d47'
+down_revision = '9d2c7e41b8a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('build_checkpoint',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('unit_id', bcpc_build.db.migration_types.UUIDType(),
+              nullable=False),
+    sa.Column('phase', sa.Unicode(length=128), nullable=False),
+    sa.Column('completed_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['unit_id'], ['build_unit.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('unit_id', 'phase',
+                        name='uq_build_checkpoint_unit_id_phase')
+    )
+
+
+def downgrade():
+    op.drop_table('build_checkpoint')
@@ -17,16 +17,26 @@ branch_labels = None
 depends_on = None
 
 
+STATES = (
+    'provisioned', 'provisioning',
+    'configuring', 'configured',
+    'building', 'done', 'failed',
+    'failed_provision', 'failed_build',
+)
+
+
 def upgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        # Unlike create_table, add_column leaves the type to us
+        op.execute('CREATE TYPE buildstateenum AS ENUM (%s)'
+                   '' % ', '.join("'%s'" % s for s in STATES))
     with op.batch_alter_table('build_unit', schema=None) as batch_op:
         batch_op.add_column(sa.Column('build_state', sa.Enum(
-            'provisioned', 'provisioning',
-            'configuring', 'configured',
-            'building', 'done', 'failed',
-            'failed_provision', 'failed_build',
-            name='buildstateenum'), nullable=True))
+            *STATES, name='buildstateenum'), nullable=True))
 
 
 def downgrade():
     with op.batch_alter_table('build_unit', schema=None) as batch_op:
         batch_op.drop_column('build_state')
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('DROP TYPE buildstateenum')
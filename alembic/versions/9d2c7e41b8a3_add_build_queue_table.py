@@ -0,0 +1,48 @@
+"""Add build queue table.
+
+Revision ID: 9d2c7e41b8a3
+Revises: 3b1f0d6c9a2e
+Create Date: 2026-10-18 13:20:05.118273+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import bcpc_build.db.migration_types
+
+
+revision = '9d2c7e41b8a3'
+down_revision = '3b1f0d6c9a2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('build_queue',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('unit_id', bcpc_build.db.migration_types.UUIDType(),
+              nullable=False),
+    sa.Column('strategy', sa.Unicode(length=16), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('state', sa.Enum('queued', 'running', 'done', 'failed',
+                               'cancelled', name='buildqueuestateenum'),
+              nullable=False),
+    sa.Column('host', sa.Unicode(length=255), nullable=True),
+    sa.Column('pid', sa.Integer(), nullable=True),
+    sa.Column('enqueued_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('started_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.Column('finished_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['unit_id'], ['build_unit.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_build_queue_state'), 'build_queue', ['state'],
+                    unique=False)
+    op.create_index(op.f('ix_build_queue_unit_id'), 'build_queue',
+                    ['unit_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_build_queue_unit_id'), table_name='build_queue')
+    op.drop_index(op.f('ix_build_queue_state'), table_name='build_queue')
+    op.drop_table('build_queue')
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('DROP TYPE buildqueuestateenum')
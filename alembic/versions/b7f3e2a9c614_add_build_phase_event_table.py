@@ -0,0 +1,43 @@
+"""Add build phase event table.
+
+Revision ID: b7f3e2a9c614
+Revises: 5e8a1f3c2d47
+Create Date: 2026-10-18 15:02:41.530912+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import bcpc_build.db.migration_types
+
+
+revision = 'b7f3e2a9c614'
+down_revision = '5e8a1f3c2d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('build_phase_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('unit_id', bcpc_build.db.migration_types.UUIDType(),
+              nullable=False),
+    sa.Column('phase', sa.Unicode(length=128), nullable=False),
+    sa.Column('host', sa.Unicode(length=255), nullable=True),
+    sa.Column('started_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('finished_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.Column('exit_status', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['unit_id'], ['build_unit.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_build_phase_event_phase'), 'build_phase_event',
+                    ['phase'], unique=False)
+    op.create_index(op.f('ix_build_phase_event_unit_id'),
+                    'build_phase_event', ['unit_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_build_phase_event_unit_id'),
+                  table_name='build_phase_event')
+    op.drop_index(op.f('ix_build_phase_event_phase'),
+                  table_name='build_phase_event')
+    op.drop_table('build_phase_event')
@@ -0,0 +1,47 @@
+"""Add build unit sort key.
+
+Revision ID: e1a6b93d5f20
+Revises: 4c8d2f7a1e95
+Create Date: 2026-10-18 18:03:52.117640+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import bcpc_build.db.migration_types
+import sys
+
+
+revision = 'e1a6b93d5f20'
+down_revision = '4c8d2f7a1e95'
+branch_labels = None
+depends_on = None
+
+
+def natural_sort_key(name):
+    # As bcpc_build.db.models.build_unit.natural_sort_key at this revision
+    try:
+        number = int(name.split('.')[-1])
+    except ValueError:
+        number = sys.maxsize
+    number = min(max(number, 0), sys.maxsize)
+    return '%019d%s' % (number, name)
+
+
+def upgrade():
+    op.add_column('build_unit',
+                  sa.Column('sort_key', sa.Unicode(length=160),
+                            nullable=True))
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, name FROM build_unit'))
+    for id_, name in rows.fetchall():
+        conn.execute(sa.text(
+            'UPDATE build_unit SET sort_key = :key WHERE id = :id'
+        ), key=natural_sort_key(name), id=id_)
+    op.create_index(op.f('ix_build_unit_sort_key'), 'build_unit',
+                    ['sort_key'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_build_unit_sort_key'), table_name='build_unit')
+    with op.batch_alter_table('build_unit') as batch_op:
+        batch_op.drop_column('sort_key')
@@ -0,0 +1,236 @@
+"""Live build output for any number of viewers over a Unix socket.
+
+A build publishes each line of output to its unit's broadcaster. Viewers
+connecting to the socket first receive the last few lines, then follow
+the output as it is produced. Sockets are serviced by a background
+thread that never blocks the build: a viewer that falls behind by more
+than ``max_pending`` bytes loses its oldest lines, and is told how many.
+"""
+from collections import deque
+import contextlib
+import os
+import selectors
+import socket
+import threading
+import time
+
+from bcpc_build.logstore import encode_line
+from bcpc_build.utils.stream import OutputRecord
+from bcpc_build.utils.stream import STDOUT
+from bcpc_build import config
+
+# Stream of lines generated by the broadcaster itself
+META = 'meta'
+
+
+class NotBroadcastingError(LookupError):
+    def __init__(self, path, message=None):
+        self.path = path
+        if not message:
+            message = 'No build is broadcasting on %s' % path
+        self.message = message
+        super().__init__(message)
+
+
+class _Subscriber(object):
+    def __init__(self, sock, max_pending):
+        self.sock = sock
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.dropped = 0
+        # Taken from pending, partially sent
+        self.out = b''
+
+    def queue(self, line):
+        self.pending.append(line)
+        self.pending_bytes += len(line)
+        while self.pending_bytes > self.max_pending:
+            self.pending_bytes -= len(self.pending.popleft())
+            self.dropped += 1
+
+    def take(self):
+        lines = list(self.pending)
+        if self.dropped:
+            marker = OutputRecord(time.time(), META,
+                                  '[%d lines skipped]' % self.dropped)
+            lines.insert(0, encode_line(marker).encode('utf-8'))
+        self.pending.clear()
+        self.pending_bytes = 0
+        self.dropped = 0
+        return b''.join(lines)
+
+
+class OutputBroadcaster(object):
+    # Seconds close() waits for viewers to receive the last lines
+    LINGER = 2.0
+
+    def __init__(self, path, history=None, max_pending=None):
+        self.path = path
+        if history is None:
+            history = config.attach.history
+        self.max_pending = max_pending or config.attach.max_pending
+        self._history = deque(maxlen=history)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        for s in (self._wake_r, self._wake_w):
+            s.setblocking(False)
+        self._woken = False
+        self._closing = False
+        self._sel = selectors.DefaultSelector()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Left behind by a build that died
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(16)
+        self._server.setblocking(False)
+        self._sel.register(self._server, selectors.EVENT_READ)
+        self._sel.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._serve,
+                                        name='broadcast', daemon=True)
+        self._thread.start()
+        return self
+
+    def publish(self, data):
+        """Queues an OutputRecord, or each line of a string, for viewers."""
+        if isinstance(data, OutputRecord):
+            records = [data]
+        else:
+            now = time.time()
+            records = [OutputRecord(now, STDOUT, line)
+                       for line in str(data).splitlines() if line]
+        with self._lock:
+            for record in records:
+                line = encode_line(record).encode('utf-8')
+                self._history.append(line)
+                for sub in self._subscribers.values():
+                    sub.queue(line)
+            wake = self._subscribers and not self._woken
+            if wake:
+                self._woken = True
+        if wake:
+            self._wake()
+
+    def _wake(self):
+        with contextlib.suppress(BlockingIOError, OSError):
+            self._wake_w.send(b'\0')
+
+    def close(self):
+        """Stops accepting viewers and ends their streams."""
+        if self._thread is None:
+            return
+        self._closing = True
+        self._wake()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _accept(self):
+        try:
+            sock, _ = self._server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        sub = _Subscriber(sock, self.max_pending)
+        with self._lock:
+            for line in self._history:
+                sub.queue(line)
+            self._subscribers[sock] = sub
+        self._sel.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _drop(self, sub):
+        with self._lock:
+            self._subscribers.pop(sub.sock, None)
+        self._sel.unregister(sub.sock)
+        sub.sock.close()
+
+    def _flush(self, sub):
+        """Sends what the socket takes; True if nothing is left."""
+        if not sub.out:
+            with self._lock:
+                sub.out = sub.take()
+        if sub.out:
+            try:
+                sent = sub.sock.send(sub.out)
+                sub.out = sub.out[sent:]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._drop(sub)
+                return True
+        with self._lock:
+            done = not sub.out and not sub.pending
+        events = selectors.EVENT_READ
+        if not done:
+            events |= selectors.EVENT_WRITE
+        self._sel.modify(sub.sock, events)
+        return done
+
+    def _serve(self):
+        deadline = None
+        try:
+            while True:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(deadline - time.time(), 0)
+                for key, mask in self._sel.select(timeout):
+                    if key.fileobj is self._server:
+                        self._accept()
+                    elif key.fileobj is self._wake_r:
+                        with contextlib.suppress(BlockingIOError):
+                            while self._wake_r.recv(4096):
+                                pass
+                    elif mask & selectors.EVENT_READ:
+                        # Viewers only ever hang up
+                        try:
+                            if not key.fileobj.recv(4096):
+                                self._drop(self._subscribers[key.fileobj])
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                        except OSError:
+                            self._drop(self._subscribers[key.fileobj])
+                with self._lock:
+                    self._woken = False
+                    subs = list(self._subscribers.values())
+                done = all([self._flush(sub) for sub in subs])
+                if self._closing:
+                    if deadline is None:
+                        deadline = time.time() + self.LINGER
+                    if done or time.time() >= deadline:
+                        break
+        finally:
+            for sub in list(self._subscribers.values()):
+                self._drop(sub)
+            self._sel.close()
+            self._server.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+            self._wake_r.close()
+            self._wake_w.close()
+
+
+def follow(path):
+    """Yields the OutputRecords broadcast on path until the build ends."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        sock.close()
+        raise NotBroadcastingError(path) from e
+    with sock, sock.makefile('rb') as f:
+        for raw in f:
+            ts, stream, line = raw.decode('utf-8', 'replace').rstrip(
+                '\n').split('\t', 2)
+            yield OutputRecord(float(ts), stream, line)
@@ -1,6 +1,7 @@
 from abc import ABC
 from abc import abstractmethod
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import total_ordering
 from itertools import chain
 from pwd import getpwnam
@@ -16,17 +17,32 @@ import sys
 
 from furl import furl
 from psutil import process_iter
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import reconstructor
+from sqlalchemy.orm.attributes import set_committed_value
 import shortuuid
 
+from bcpc_build.broadcast import OutputBroadcaster
+from bcpc_build.checkpoint import Checkpoints
+from bcpc_build.db import utils as dbutils
+from bcpc_build.db.models.build_checkpoint import BuildCheckpointBase
+from bcpc_build.db.models.build_phase_event import BuildPhaseEventBase
 from bcpc_build.db.models.build_unit import BuildStateEnum
 from bcpc_build.db.models.build_unit import BuildUnitBase
+from bcpc_build.db.models.build_queue import BuildQueueEntryBase
 from bcpc_build.exceptions import *
+from bcpc_build import checkpoint
 from bcpc_build import config
+from bcpc_build import history
+from bcpc_build import timing
 from bcpc_build import utils
+from bcpc_build.logstore import LogStore
+from bcpc_build.mirror import GitMirrorCache
+from bcpc_build.timing import PhaseTimer
 from bcpc_build.unit import V8ConfigHandler
 from bcpc_build.utils.credentials import impersonated_thread
+from bcpc_build.utils import fs
+from bcpc_build.utils.stream import iter_output
 
 try:
     import simplejson as json
@@ -59,6 +75,11 @@ class BuildUnit(BuildUnitBase):
         super().__init__(*args, **kwargs)
         self.logger = logging.getLogger(__name__)
 
+    @reconstructor
+    def _init_on_load(self):
+        # __init__ is bypassed for instances loaded from the database
+        self.logger = logging.getLogger(__name__)
+
     def __eq__(self, other):
         get_attrs = self.__class__.get_json_dict
         self_attrs = get_attrs(self)
@@ -66,19 +87,8 @@ class BuildUnit(BuildUnitBase):
         return self_attrs == other_attrs
 
     def __lt__(self, other):
-        def name_key(obj):
-            try:
-                name = obj.name
-                parts = name.split('.')
-                key = (int(parts[-1]), name)
-            except ValueError:
-                key = (sys.maxsize, name)
-            except NameError:
-                key = (obj,)
-            return key
-
-        lval = tuple([*name_key(self), self.build_user])
-        rval = tuple([*name_key(other), self.build_user])
+        lval = (self.sort_key, self.build_user)
+        rval = (other.sort_key, other.build_user)
         return lval < rval
 
     def populate(self, allocator, conf={}):
@@ -98,10 +108,15 @@ class BuildUnit(BuildUnitBase):
 
 
 class BuildLogger(object):
-    def __init__(self, filename=None, stream=None, func=None, **kwargs):
+    def __init__(self, filename=None, stream=None, func=None, mode='w',
+                 writer=None, broadcaster=None, **kwargs):
         self.filename = filename
         self.stream = stream
         self.func = func
+        # A logstore.LogWriter, which keeps records whole
+        self.writer = writer
+        # A started broadcast.OutputBroadcaster, for attached viewers
+        self.broadcaster = broadcaster
 
         def _prepare_dests():
             self._dests = []
@@ -110,8 +125,8 @@ class BuildLogger(object):
                 self._dests.append(stream)
             if filename:
                 # TODO(kmidzi): open files?
-                self._dests.append(open(filename, 'w'))
-            if not self._dests:
+                self._dests.append(open(filename, mode))
+            if not self._dests and not (writer or broadcaster):
                 raise ValueError('No valid destinations supplied.')
 
         _prepare_dests()
@@ -119,17 +134,33 @@ class BuildLogger(object):
     def echo(self, data):
         return self.write(data, raw=False)
 
+    def close(self):
+        # Only files opened here; streams belong to the caller
+        for d in self._dests:
+            if d is not self.stream:
+                d.close()
+        if self.writer:
+            self.writer.close()
+        if self.broadcaster:
+            self.broadcaster.close()
+
     def write(self, data, raw=True):
-        # Never mod input to supplied function
-        cooked_data = data if raw else data + '\n'
+        # Never mod input to supplied function; data may be an OutputRecord
+        cooked_data = str(data) if raw else str(data) + '\n'
         for d in self._dests:
             d.write(cooked_data)
+        if self.writer:
+            self.writer.write(data)
+        if self.broadcaster:
+            self.broadcaster.publish(data)
         if self.func:
             self.func(data)
 
     def flush(self):
         for d in self._dests:
             d.flush()
+        if self.writer:
+            self.writer.flush()
 
     def __repr__(self):
         attrs = ['filename', 'stream', 'func']
@@ -143,9 +174,24 @@ class BuildUnitAllocator(ABC):
     BUILD_STRATEGY_DEFAULT = 'v8'
     BUILD_STRATEGY_NAMES = ['v7', 'v8']
     DEFAULT_BUILD_HOME = '/build'
+    DEFAULT_POPULATE_CONCURRENCY = 4
     DEFAULT_SHELL = '/bin/bash'
     DEFAULT_SRC_URL = 'https://github.com/bloomberg/chef-bcpc'
     SRC_DEPENDS = None
+    # Per-unit state that must not be carried over to a clone
+    CLONE_IGNORE_TOP = ('build.log', 'logs', 'cacerts', 'bcpc-vms',
+                        'VirtualBox VMs', '.config', '.cache')
+    CLONE_IGNORE = ('.vagrant', '*.sock')
+    # Rows referring to a unit, removed along with it
+    UNIT_DEPENDENTS = (BuildQueueEntryBase, BuildCheckpointBase,
+                       BuildPhaseEventBase)
+    CLONE_SOURCE_STATES = (
+        BuildStateEnum.pooled,
+        BuildStateEnum.provisioned,
+        BuildStateEnum.configured,
+        BuildStateEnum.done,
+        BuildStateEnum.failed_build,
+    )
 
     def __init__(self, *args, **kwargs):
         self._conf = kwargs.get('conf', {})
@@ -169,18 +215,35 @@ class BuildUnitAllocator(ABC):
 
     @staticmethod
     def get_build_log(bunit):
+        """Plain log written by builds before the log store existed."""
         # TODO(kmidzi): simple
         LOGNAME = 'build.log'
         bpath = bunit.get_build_path()
         return os.path.join(bpath, LOGNAME)
 
+    @staticmethod
+    def get_log_store(bunit):
+        return LogStore(os.path.join(bunit.get_build_path(), 'logs'))
+
+    @staticmethod
+    def get_broadcast_path(bunit):
+        return os.path.join(config.attach.socket_dir, '%s.sock' % bunit.id)
+
+    def get_broadcaster(self, bunit):
+        """Starts broadcasting the unit's build output, where possible."""
+        path = self.get_broadcast_path(bunit)
+        try:
+            return OutputBroadcaster(path).start()
+        except OSError as e:
+            # Viewers are a convenience; never fail the build over them
+            self.logger.warning('Not broadcasting build of %s on %s: %s'
+                                '' % (bunit.id, path, e))
+            return None
+
     @property
     def session(self):
         if self._session is None:
-            engine = create_engine(config.db.url)
-            conn = engine.connect()
-            Session = sessionmaker(bind=conn)
-            self._session = Session()
+            self._session = dbutils.Session()
         return self._session
 
     @property
@@ -206,13 +269,43 @@ class BuildUnitAllocator(ABC):
             create_build_home()
 
     # @abstractmethod
-    def build(self, bunit):
+    def build(self, bunit, resume=False):
+        raise NotImplementedError
+
+    # @abstractmethod
+    def build_commands(self, bunit):
+        """The (target, command) pairs making up a build, in order."""
         raise NotImplementedError
 
+    def checkpoints(self, bunit):
+        return Checkpoints(self.session, bunit)
+
+    def timer(self, bunit=None):
+        return PhaseTimer(self.session, bunit.id if bunit else None)
+
+    def _build_targets(self, bunit, targets, resume=False):
+        """Runs (target, cmd) pairs in order, skipping completed ones."""
+        checkpoints = self.checkpoints(bunit)
+        timer = self.timer(bunit)
+        if not resume:
+            checkpoints.clear(checkpoint.BUILD)
+        for target, cmd in targets:
+            phase = checkpoint.phase_name(checkpoint.BUILD, target)
+            if checkpoints.done(phase):
+                self.logger.info('Skipping completed build target %s'
+                                 '' % target)
+                continue
+            self.logger.debug('Building with command `%s`' % cmd)
+            with timer.phase(phase):
+                yield from self._build_with_command(bunit, cmd)
+            checkpoints.mark(phase)
+
     def _build_with_command(self, bunit, cmd):
+        """Runs cmd, yielding OutputRecords of its stdout and stderr."""
         proc = subprocess.Popen(shlex.split(cmd),
+                                stdin=subprocess.DEVNULL,
                                 stdout=subprocess.PIPE,
-                                universal_newlines=True)
+                                stderr=subprocess.PIPE)
 
         # Need start_new_session to run in background?
         def exit_condition(status):
@@ -224,26 +317,89 @@ class BuildUnitAllocator(ABC):
                 raise NonZeroExit(status)
 
         try:
-            while True:
-                output = proc.stdout.readline().strip()
-                status = proc.poll()
-                if output == '' and status is not None:
-                    if exit_condition(status):
-                        break
-                if output:
-                    yield output
+            try:
+                yield from iter_output(proc)
+                status = proc.wait()
+            finally:
+                proc.stdout.close()
+                proc.stderr.close()
+            exit_condition(status)
         except NonZeroExit as e:
             self.set_build_state(bunit, BuildStateEnum.failed_build)
             raise BuildError(e) from e
 
-    def set_build_state(self, bunit, state):
+    def set_build_state(self, bunit, state, force=False):
+        """Moves bunit to state, unless another process moved it first.
+
+        The move is a compare-and-swap on the state bunit was loaded in,
+        so concurrent writers cannot overwrite each other: the loser gets
+        StateConflictError. Moves not allowed by
+        BuildStateEnum.can_transition raise IllegalTransitionError,
+        unless forced.
+        """
         if not isinstance(state, BuildStateEnum):
             raise ValueError('Incompatible build state.')
 
-        # TODO(kmidzi): re-using same session. Issues?
-        bunit.build_state = state
-        self.session.add(bunit)
+        from_state = bunit.build_state
+        if state == from_state:
+            return
+        if not force and not BuildStateEnum.can_transition(from_state,
+                                                           state):
+            raise IllegalTransitionError(from_state, state)
+        if not self._swap_state(bunit, state):
+            # Also reloads bunit with what the other process wrote
+            self.session.rollback()
+            raise StateConflictError(bunit.id, from_state)
+        dbutils.commit(self.session)
+
+    def set_build_states(self, bunits, state, force=False):
+        """Moves each of bunits to state, committing once.
+
+        Units that cannot be moved are left as they are. Returns
+        (bunit, error) pairs, the error being None for units moved.
+        """
+        results = []
+        for bunit in bunits:
+            from_state = bunit.build_state
+            error = None
+            if state == from_state:
+                pass
+            elif not force and not BuildStateEnum.can_transition(
+                    from_state, state):
+                error = IllegalTransitionError(from_state, state)
+            elif not self._swap_state(bunit, state):
+                error = StateConflictError(bunit.id, from_state)
+                self.session.expire(bunit, ['build_state'])
+            results.append((bunit, error))
         self.session.commit()
+        return results
+
+    def _swap_state(self, bunit, state):
+        """Compare-and-swap of the state; False if it changed meanwhile."""
+        from_state = bunit.build_state
+        table = BuildUnit.__table__
+        result = self.session.execute(
+            table.update().where(
+                (table.c.id == bunit.id) &
+                (table.c.build_state == from_state if from_state else
+                 table.c.build_state.is_(None))
+            ).values(build_state=state)
+        )
+        if result.rowcount != 1:
+            return False
+        # Written already; only the loaded copy needs updating
+        set_committed_value(bunit, 'build_state', state)
+        history.record(self.session, bunit.id, from_state, state)
+        return True
+
+    def batched_states(self):
+        """Commits what is written inside the block once, on exit.
+
+        State transitions, checkpoints and phase timings made through the
+        allocator's session are only flushed meanwhile, and all rolled
+        back together if the block raises.
+        """
+        return dbutils.batch(self.session)
 
     def install_certs(self, bunit):
         CERTS_DIR = '/var/tmp/bcpc-cacerts'
@@ -259,6 +415,9 @@ class BuildUnitAllocator(ABC):
             shutil.chown(dst, user=user, group=group)
 
         try:
+            if os.path.exists(dest):
+                # Left over from an interrupted install
+                shutil.rmtree(dest)
             bunit.logger.info('Installing certificates to %s' % dest)
             shutil.copytree(src=CERTS_DIR, dst=dest, symlinks=True,
                             copy_function=install_copy)
@@ -272,8 +431,24 @@ class BuildUnitAllocator(ABC):
         """Configures the build unit."""
         raise NotImplementedError()
 
+    @classmethod
+    def get_mirror_cache(cls, conf={}):
+        """Returns the shared source mirror cache, or None if disabled."""
+        if not conf.get('mirror', True):
+            return None
+        git_config = {}
+        for scheme in ('http', 'https'):
+            proxy = conf.get(scheme, {}).get('proxy')
+            if proxy:
+                git_config['%s.proxy' % scheme] = proxy
+        build_home = conf.get('build_home', cls.DEFAULT_BUILD_HOME)
+        return GitMirrorCache(build_home, git_config=git_config)
+
     @classmethod
     def populate(cls, bunit, conf={}, *args, **kwargs):
+        # Sources cloned by an earlier, interrupted run are skipped
+        checkpoints = kwargs.get('checkpoints')
+        timer = kwargs.get('timer') or PhaseTimer(session=None)
         src_depends = conf.get('src_depends') or cls.SRC_DEPENDS or {}
         src_url = bunit.source_url
         build_path = bunit.get_build_path()
@@ -281,6 +456,7 @@ class BuildUnitAllocator(ABC):
         log_level = conf.get('log_level')
         if log_level is not None:
             utils.set_log_level(logger, log_level)
+        mirrors = cls.get_mirror_cache(conf)
 
         # FIXME(kamidzi): git-credential helper?
         def git_args(url):
@@ -311,24 +487,38 @@ class BuildUnitAllocator(ABC):
                 logger.debug('Revision/branch detection error: %s' % e)
             return args
 
+        def get_mirror(url):
+            if mirrors is None:
+                return None
+            try:
+                return mirrors.refresh(url)
+            except subprocess.CalledProcessError as e:
+                logger.warning('Could not refresh mirror of %s, cloning'
+                               ' directly: %s' % (url, e))
+                return None
+
         def get_cmds(url, name):
             def _checkout_cmd(rev, dest):
                 cmd = (
                     "su -c"
-                    " 'git -C {dest} fetch -q origin {rev} &&"
+                    " 'git {safe_args} -C {dest} fetch -q {source} {rev} &&"
                     " git -C {dest} checkout -q FETCH_HEAD' "
                     " {username}"
-                ).format(rev=rev, username=bunit.build_user, dest=dest)
+                ).format(rev=rev, username=bunit.build_user, dest=dest,
+                         source=mirror or 'origin', safe_args=safe_args)
                 logger.debug('Checkout cmd `{}` from rev={}'.format(cmd, rev))
                 yield cmd
 
             def _clone_cmd(src_url, name=''):
+                clone_args = args.get('clone', '')
+                if mirror:
+                    clone_args += ' --reference %s' % mirror
                 cmd = (
                     "su -c 'git {git_args} clone {clone_args} {url} {name}' "
                     "{username}"
                 ).format(
                     git_args=args.get('git', ''),
-                    clone_args=args.get('clone', ''), url=args.get('url'),
+                    clone_args=clone_args, url=args.get('url'),
                     name=name, username=bunit.build_user
                 )
                 logger.debug(
@@ -337,6 +527,11 @@ class BuildUnitAllocator(ABC):
 
             cmds = []
             args = git_args(url)
+            mirror = get_mirror(args['url'])
+            # Mirrors are owned by the allocating user, not the build user
+            safe_args = '-c safe.directory=%s' % mirror if mirror else ''
+            if safe_args:
+                args['git'] += ' ' + safe_args
             cmds += _clone_cmd(url, name)
             rev = args.get('revision')
             if rev:
@@ -344,91 +539,237 @@ class BuildUnitAllocator(ABC):
                 cmds += _checkout_cmd(rev, dest)
             return chain(cmds)
 
-        def process_deps():
-            for name in src_depends:
-                url = src_depends[name]
-                # Suspect logger...
-                logger.debug('Processing dependency: {} => {}'
-                             ''.format(name, url))
+        def populate_source(name, url):
+            # Clone and checkout of one source must stay ordered
+            logger.debug('Processing dependency: {} => {}'.format(name, url))
+            dest = os.path.join(build_path, name)
+            if os.path.exists(dest):
+                logger.info('Removing incomplete source %s' % dest)
+                shutil.rmtree(dest)
+            with timer.phase(checkpoint.phase_name(timing.CLONE, name)):
                 for cmd in get_cmds(url, name):
-                    check_output(shlex.split(cmd))
+                    check_output(shlex.split(cmd), stderr=subprocess.STDOUT)
+
+        def process_sources(sources):
+            concurrency = int(conf.get('populate_concurrency') or
+                              cls.DEFAULT_POPULATE_CONCURRENCY)
+            errors = {}
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = {
+                    name: executor.submit(populate_source, name, url)
+                    for name, url in sources.items()
+                }
+                for name, future in futures.items():
+                    try:
+                        future.result()
+                        # The session is only used from this thread
+                        if checkpoints is not None:
+                            checkpoints.mark(phase(name))
+                    except subprocess.CalledProcessError as e:
+                        output = (e.output or b'').decode('utf-8', 'replace')
+                        errors[name] = '{} {}'.format(e, output.strip())
+                    except Exception as e:
+                        errors[name] = e
+            # Clones were timed in the worker threads
+            timer.flush()
+            if errors:
+                raise PopulateError(errors)
+
+        def phase(name):
+            return checkpoint.phase_name(checkpoint.POPULATE, name)
 
         logger.info('Populating build unit...')
-        process_deps()
-        for cmd in get_cmds(src_url, 'chef-bcpc'):
-            check_output(shlex.split(cmd))
+        sources = OrderedDict(src_depends)
+        sources['chef-bcpc'] = src_url
+        if checkpoints is not None:
+            for name in list(sources):
+                if checkpoints.done(phase(name)):
+                    logger.info('Skipping populated source %s' % name)
+                    del sources[name]
+        process_sources(sources)
 
     def provision(self, build, *args, **kwargs):
         conf = kwargs.get('conf', {}).copy()
         conf.setdefault('src_depends', self.SRC_DEPENDS)
+        # Units claimed from the pool have already been populated
+        populate = kwargs.get('populate', True)
+        # Resuming skips the phases completed by an earlier attempt
+        resume = kwargs.get('resume', False)
+        checkpoints = self.checkpoints(build)
+        timer = self.timer(build)
         try:
             self.logger.info('Provisioning build unit...')
             self.logger.debug({'conf': conf})
+            if not resume:
+                checkpoints.clear()
             self.set_build_state(build, BuildStateEnum.provisioning)
-            self.populate(build, conf=conf)
+            if populate:
+                self.populate(build, conf=conf, checkpoints=checkpoints,
+                              timer=timer)
             # FIXME(kmidzi): sus
-            if conf['configure']:
-                self.configure(build, src_depends=conf.get('src_depends'))
-            self.set_build_state(build, BuildStateEnum.provisioned)
+            configured = checkpoints.done(checkpoint.CONFIGURE)
+            configure = conf['configure'] and not configured
+            if configure:
+                self._reset_config(build)
+                with timer.phase(timing.CONFIGURE):
+                    self.configure(build,
+                                   src_depends=conf.get('src_depends'),
+                                   checkpoints=checkpoints, timer=timer)
+            # configure commits its own state changes as it goes. Its
+            # checkpoint is written along with the final state, so a
+            # failed configure leaves no trace and a resume redoes it
+            with self.batched_states():
+                if configure:
+                    checkpoints.mark(checkpoint.CONFIGURE)
+                self.set_build_state(build, BuildStateEnum.provisioned)
+        except StateConflictError:
+            # Whoever moved the unit owns it now
+            raise
         except Exception as e:
             self.set_build_state(build, BuildStateEnum.failed_provision)
             raise ProvisionError(e) from e
         return build
 
-    def destroy(self, bunit, commit=True):
-        # find processes
-        # kill processes
-        # userdel -r
-        def get_procs(user):
-            p_attrs = ['pid', 'username']
-            plist = list(filter(lambda p: p.info['username'] == user,
-                                process_iter(p_attrs)))
-            return plist
-
-        def kill_user_procs(user):
-            plist = get_procs(user)
-            for proc in plist:
-                # multiproc here?
-                utils.kill_proc_tree(proc.info['pid'])
-
-        def remove_user(user):
-            kill_user_procs(user)
-            try:
-                utils.userdel(user)
-            except subprocess.CalledProcessError as e:
-                # User does not exist - man(5) userdel
-                if e.returncode == 6:
-                    self.logger.info("Ignoring non-existent user '%s'" % user)
-                else:
-                    raise
+    def _reset_config(self, bunit):
+        """Restores configuration a cloned unit inherited from its template."""
+        pass
+
+    def clone(self, template, name='', conf={}):
+        """Allocates a new unit from a copy of template's build tree.
+
+        The copy uses reflinks where the filesystem supports them, and
+        hardlinks git objects otherwise. Only the unit-specific parts of
+        the configuration are regenerated.
+        """
+        if template.build_state not in self.CLONE_SOURCE_STATES:
+            raise AllocationError(
+                'Cannot clone unit {} in state {}'.format(
+                    template.id, template.build_state)
+            )
+        bunit = self.allocate(source_url=template.source_url, name=name)
+        try:
+            self.set_build_state(bunit, BuildStateEnum.provisioning)
+            src = template.get_build_path()
+            dst = bunit.get_build_path()
+            self.logger.info('Cloning build unit {} from {}'.format(dst, src))
+            copier = fs.clone_tree(
+                src, dst,
+                ignore=shutil.ignore_patterns(*self.CLONE_IGNORE),
+                top_ignore=self.CLONE_IGNORE_TOP
+            )
+            self.logger.debug('Clone statistics: {}'.format(copier.stats))
+            # Hardlinked objects share an inode with the template's
+            fs.chown_tree(dst, bunit.build_user, bunit.build_user,
+                          skip=copier.linked)
+            if conf.get('configure', True):
+                self._reset_config(bunit)
+                timer = self.timer(bunit)
+                with timer.phase(timing.CONFIGURE):
+                    self.configure(bunit,
+                                   src_depends=conf.get('src_depends'),
+                                   timer=timer)
+            self.set_build_state(bunit, BuildStateEnum.provisioned)
+        except Exception as e:
+            self.logger.error('Could not clone unit, rolling back: %s' % e)
+            self.destroy(bunit, commit=True)
+            raise ProvisionError(e) from e
+        return bunit
 
-        remove_user(bunit.build_user)
+    @staticmethod
+    def _user_procs(users):
+        """Pids of the processes of each of users, from one scan."""
+        users = set(users)
+        procs = {}
+        for proc in process_iter(['pid', 'username']):
+            if proc.info['username'] in users:
+                procs.setdefault(proc.info['username'], []).append(
+                    proc.info['pid'])
+        return procs
+
+    def _remove_user(self, user, pids):
+        for pid in pids:
+            utils.kill_proc_tree(pid)
+        try:
+            utils.userdel(user)
+        except subprocess.CalledProcessError as e:
+            # User does not exist - man(5) userdel
+            if e.returncode == 6:
+                self.logger.info("Ignoring non-existent user '%s'" % user)
+            else:
+                raise
+
+    def destroy(self, bunit, commit=True):
+        user = bunit.build_user
+        self._remove_user(user, self._user_procs([user]).get(user, []))
         if commit:
             self._deallocate(bunit)
 
-    def _deallocate(self, bunit):
-        self.session.delete(bunit)
+    def destroy_many(self, bunits, workers=None):
+        """Destroys bunits, tearing down up to workers of them at once.
+
+        Processes are found in one scan for all units, and the units torn
+        down are deallocated in one transaction. Returns (bunit, error)
+        pairs, the error being None for units destroyed.
+        """
+        workers = workers or config.unit.destroy_workers
+        procs = self._user_procs(b.build_user for b in bunits)
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(b, executor.submit(self._remove_user, b.build_user,
+                                           procs.get(b.build_user, [])))
+                       for b in bunits]
+            for bunit, future in futures:
+                try:
+                    future.result()
+                    results.append((bunit, None))
+                except Exception as e:
+                    results.append((bunit, e))
+        for bunit, error in results:
+            if error is None:
+                self._deallocate(bunit, commit=False)
         self.session.commit()
+        return results
+
+    def _deallocate(self, bunit, commit=True):
+        for model in self.UNIT_DEPENDENTS:
+            self.session.query(model).filter(
+                model.unit_id == bunit.id
+            ).delete(synchronize_session=False)
+        # State history is kept for fleet statistics
+        history.record(self.session, bunit.id, bunit.build_state, None)
+        self.session.delete(bunit)
+        if commit:
+            self.session.commit()
 
     def allocate(self, *args, **kwargs):
         kwargs = kwargs.copy()
         name = kwargs.pop('name')
         if name:
-            bunit = self.session.query(BuildUnit).filter(
-                BuildUnit.name == name
-            ).one_or_none()
-            if bunit:
-                raise DuplicateNameError(name)
             # FIXME(kmidzi): complicated by name='' default for optional arg
             kwargs['name'] = name
-        build_user = self.allocate_build_user(self.generate_build_user_name())
-        kwargs.setdefault('build_user', build_user)
-        kwargs.setdefault('name', build_user)
-        build_dir = self.allocate_build_dir(**kwargs)
-        kwargs.setdefault('build_dir', build_dir)
-        bunit = BuildUnit(**kwargs)
-        self.session.add(bunit)
-        self.session.commit()
+        # The unit only exists once allocated; timings are recorded then
+        timer = self.timer()
+        with timer.phase(timing.ALLOCATE):
+            with timer.phase(timing.USERADD):
+                build_user = self.allocate_build_user(
+                    self.generate_build_user_name()
+                )
+            kwargs.setdefault('build_user', build_user)
+            kwargs.setdefault('name', build_user)
+            build_dir = self.allocate_build_dir(**kwargs)
+            kwargs.setdefault('build_dir', build_dir)
+            bunit = BuildUnit(**kwargs)
+            self.session.add(bunit)
+            try:
+                self.session.commit()
+            except IntegrityError as e:
+                # Names are unique in the database; no check can race it
+                self.session.rollback()
+                self.destroy(bunit, commit=False)
+                if name:
+                    raise DuplicateNameError(name) from e
+                raise
+        timer.bind(bunit.id)
         return bunit
 
     def generate_build_user_name(self):
@@ -491,14 +832,17 @@ class V7BuildUnitAllocator(BuildUnitAllocator):
         export VM_SWAP_SIZE=8192
     """)
 
-    def build(self, bunit):
-        self.set_build_state(bunit, BuildStateEnum.building)
+    def build_commands(self, bunit):
         build_user = bunit.build_user
         cmd = ("su -c \"bash -c 'cd chef-bcpc/bootstrap/vagrant_scripts &&"
                " time ./BOOT_GO.sh'\" -"
                " {build_user}".format(build_user=build_user))
-        self.logger.debug('Building with command `%s`' % cmd)
-        return self._build_with_command(bunit, cmd)
+        return [('BOOT_GO', cmd)]
+
+    def build(self, bunit, resume=False):
+        self.set_build_state(bunit, BuildStateEnum.building)
+        return self._build_targets(bunit, self.build_commands(bunit),
+                                   resume=resume)
 
     def configure(self, bunit, *args, **kwargs):
         """Configures the build unit."""
@@ -532,22 +876,35 @@ class V7BuildUnitAllocator(BuildUnitAllocator):
                                                       filename=conffile))
             shutil.chown(conffile, **perms)
 
-        self.install_certs(bunit)
+        checkpoints = kwargs.get('checkpoints')
+        timer = kwargs.get('timer') or PhaseTimer(session=None)
+        if checkpoints is None or not checkpoints.done(
+                checkpoint.INSTALL_CERTS):
+            with timer.phase(timing.INSTALL_CERTS):
+                self.install_certs(bunit)
+            if checkpoints is not None:
+                checkpoints.mark(checkpoint.INSTALL_CERTS)
         self.set_build_state(bunit, BuildStateEnum.configured)
 
 
 class V8BuildUnitAllocator(BuildUnitAllocator):
     DEFAULT_BUILD_STRATEGY = 'v8'
+    # Run one at a time so each can be checkpointed
+    BUILD_TARGETS = ('create', 'all')
 
-    def _base_build(self, bunit):
+    def build_commands(self, bunit):
         build_user = bunit.build_user
-        cmd = ("su -c \"bash -c 'cd chef-bcpc && time make create all'\""
-               " - {build_user}".format(build_user=build_user))
-        self.logger.debug('Building with command `%s`' % cmd)
-        return self._build_with_command(bunit, cmd)
+        cmd = ("su -c \"bash -c 'cd chef-bcpc && time make {target}'\""
+               " - {build_user}")
+        return [(t, cmd.format(target=t, build_user=build_user))
+                for t in self.BUILD_TARGETS]
+
+    def _base_build(self, bunit, resume=False):
+        return self._build_targets(bunit, self.build_commands(bunit),
+                                   resume=resume)
 
-    def build(self, bunit):
-        base = self._base_build(bunit)
+    def build(self, bunit, resume=False):
+        base = self._base_build(bunit, resume=resume)
         self.set_build_state(bunit, BuildStateEnum.building)
         return base
 
@@ -555,8 +912,19 @@ class V8BuildUnitAllocator(BuildUnitAllocator):
         bconf = V8ConfigHandler(bunit)
         return bconf
 
+    def _reset_config(self, bunit):
+        # configure() backs up the pristine topology before rewriting the
+        # network names; start from that so ids are derived afresh.
+        topology = os.path.join(bunit.get_build_path(), 'chef-bcpc',
+                                'virtual', 'topology', 'topology.yml')
+        backup = topology + '.bak'
+        if os.path.exists(backup):
+            self.logger.debug('Restoring {} from {}'.format(topology, backup))
+            shutil.copy2(backup, topology)
+
     def configure(self, bunit, *args, **kwargs):
         logger = bunit.logger
+        timer = kwargs.get('timer') or PhaseTimer(session=None)
         bunit_config = self.get_build_config(bunit)
         self.set_build_state(bunit, BuildStateEnum.configuring)
 
@@ -569,10 +937,11 @@ class V8BuildUnitAllocator(BuildUnitAllocator):
         core_configs = config_handler.configs['chef-bcpc']
         cfg_prefix = 'topology/topology.yml'
         conf = core_configs.configs[cfg_prefix]
-        netmap = impersonated_thread(
-            bunit.build_user, utils.generate_netids_from_system, args=networks,
-            chdir=False
-        )
+        with timer.phase(timing.NETIDS):
+            netmap = impersonated_thread(
+                bunit.build_user, utils.generate_netids_from_system,
+                args=networks, chdir=False
+            )
 
         def update_cluster_networks(conf):
             logger.info('Updating cluster network configuration for %s'
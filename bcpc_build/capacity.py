@@ -0,0 +1,235 @@
+"""Resource footprints of build units and host admission control.
+
+A unit's footprint is the CPU, memory and disk its VMs ask for, read
+from the v7 shell configuration or the v8 topology. Host capacity is
+what psutil reports, less a reserve for the host itself and less the
+footprints of builds already running on it.
+"""
+from collections import namedtuple
+import logging
+import os
+import re
+import socket
+
+import psutil
+
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.build_unit import V7BuildUnitAllocator
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.db.migration_types import BuildQueueStateEnum
+from bcpc_build.db.models.build_queue import BuildQueueEntryBase
+from bcpc_build import config
+
+logger = logging.getLogger(__name__)
+
+
+class Footprint(namedtuple('Footprint', ['cpus', 'mem_mb', 'disk_mb'])):
+    """Resources requested by, or available to, build units."""
+    __slots__ = ()
+
+    def __add__(self, other):
+        return Footprint(*(a + b for a, b in zip(self, other)))
+
+    def __sub__(self, other):
+        return Footprint(*(a - b for a, b in zip(self, other)))
+
+    def __mul__(self, n):
+        return Footprint(*(a * n for a in self))
+
+    def fits(self, available):
+        return all(a <= b for a, b in zip(self, available))
+
+    def count_in(self, available):
+        """How many footprints of this size fit into available."""
+        counts = [int(b // a) for a, b in zip(self, available) if a > 0]
+        return max(min(counts), 0) if counts else 0
+
+
+Footprint.ZERO = Footprint(0, 0, 0)
+
+
+class InsufficientCapacityError(RuntimeError):
+    def __init__(self, footprint, available, message=None):
+        self.footprint = footprint
+        self.available = available
+        if not message:
+            message = ('Insufficient host capacity: unit needs {} but only'
+                       ' {} is available'.format(tuple(footprint),
+                                                 tuple(available)))
+        self.message = message
+        super().__init__(message)
+
+
+class ExceedsHostError(InsufficientCapacityError):
+    def __init__(self, footprint, total, message=None):
+        if not message:
+            message = ('Unit needs {} but the host only has {} in all; it'
+                       ' can never be built here'.format(tuple(footprint),
+                                                         tuple(total)))
+        super().__init__(footprint, total, message)
+
+
+# bootstrap VM plus vm1..vm3 in the v7 vagrant scripts
+V7_CLUSTER_VMS = 3
+# Used for v8 nodes without a known hardware profile
+V8_NODE_DEFAULT = Footprint(cpus=2, mem_mb=4096, disk_mb=20480)
+V8_DEFAULT_NODES = 4
+
+_EXPORT_RE = re.compile(r'^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)$')
+
+
+def parse_shell_exports(text):
+    env = {}
+    for line in text.splitlines():
+        m = _EXPORT_RE.match(line)
+        if m:
+            env[m.group(1)] = m.group(2).strip().strip('"\'')
+    return env
+
+
+def v7_footprint(env):
+    def vm(prefix):
+        return Footprint(int(env['%s_VM_CPUS' % prefix]),
+                         int(env['%s_VM_MEM' % prefix]),
+                         int(env['%s_VM_DRIVE_SIZE' % prefix]))
+
+    nodes = V7_CLUSTER_VMS + int(env.get('MONITORING_NODES') or 0)
+    return vm('BOOTSTRAP') + vm('CLUSTER') * nodes
+
+
+def v8_footprint(topology, hardware=None):
+    profiles = (hardware or {}).get('profiles', {})
+    total = Footprint.ZERO
+    for node in topology.get('nodes', []):
+        profile = profiles.get(node.get('hardware_profile'), {})
+        default = V8_NODE_DEFAULT
+        total += Footprint(
+            int(profile.get('cpus', default.cpus)),
+            int(profile['ram_gb'] * 1024) if 'ram_gb' in profile
+            else default.mem_mb,
+            int(profile['disk_gb'] * 1024) if 'disk_gb' in profile
+            else default.disk_mb,
+        )
+    return total
+
+
+def default_footprint(strategy):
+    if strategy == 'v7':
+        return v7_footprint(
+            parse_shell_exports(V7BuildUnitAllocator.CONF_TEMPLATE)
+        )
+    return V8_NODE_DEFAULT * V8_DEFAULT_NODES
+
+
+def detect_strategy(bunit):
+    base = os.path.join(bunit.get_build_path(), 'chef-bcpc')
+    if os.path.isdir(os.path.join(base, 'virtual', 'topology')):
+        return 'v8'
+    if os.path.isdir(os.path.join(base, 'bootstrap', 'config')):
+        return 'v7'
+    return BuildUnitAllocator.BUILD_STRATEGY_DEFAULT
+
+
+def estimate_footprint(bunit, strategy=None):
+    """Estimates the resources a unit's build will use."""
+    if strategy is None:
+        strategy = detect_strategy(bunit)
+    try:
+        if strategy == 'v7':
+            conffile = os.path.join(bunit.get_build_path(), 'chef-bcpc',
+                                    'bootstrap', 'config',
+                                    'bootstrap_config.sh.overrides')
+            with open(conffile) as f:
+                return v7_footprint(parse_shell_exports(f.read()))
+        handler = V8BuildUnitAllocator().get_build_config(bunit)
+        configs = handler.configs['chef-bcpc'].configs
+        topology = configs['topology/topology.yml'].contents
+        hardware = configs.get('topology/hardware.yml')
+        return v8_footprint(topology, hardware and hardware.contents)
+    except Exception as e:
+        logger.debug('Could not read footprint of %s (%s); using defaults'
+                     '' % (bunit.id, e))
+        return default_footprint(strategy)
+
+
+def committed_footprint(session, exclude=None, host=None):
+    """Sum of the footprints of builds running or about to run here.
+
+    Only builds this host's queue entries own are counted, as several
+    hosts may share the database.
+    """
+    host = host or socket.getfqdn()
+    entries = session.query(BuildQueueEntryBase.unit_id).filter(
+        BuildQueueEntryBase.host == host
+    )
+    running = entries.filter(
+        BuildQueueEntryBase.state == BuildQueueStateEnum.running
+    )
+    units = session.query(BuildUnit).filter(
+        ((BuildUnit.build_state == BuildStateEnum.building) &
+         BuildUnit.id.in_(entries.subquery())) |
+        BuildUnit.id.in_(running.subquery())
+    )
+    if exclude is not None:
+        units = units.filter(BuildUnit.id != exclude)
+    total = Footprint.ZERO
+    for bunit in units:
+        total += estimate_footprint(bunit)
+    return total
+
+
+class HostCapacity(object):
+    """Resources of this host available to new builds."""
+
+    def __init__(self, path=BuildUnitAllocator.DEFAULT_BUILD_HOME,
+                 committed=Footprint.ZERO):
+        self.path = path if os.path.exists(path) else '/'
+        self.committed = committed
+
+    def total(self):
+        mem = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.path)
+        mb = 1024 * 1024
+        return Footprint(
+            int(psutil.cpu_count() * config.capacity.cpu_overcommit),
+            mem.total // mb - config.capacity.mem_reserve_mb,
+            disk.total // mb - config.capacity.disk_reserve_mb,
+        )
+
+    def available(self):
+        # Running builds may not have started all their VMs yet, so count
+        # their full footprint as well as what is actually free now.
+        mem = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.path)
+        mb = 1024 * 1024
+        reserved = self.total() - self.committed
+        return Footprint(
+            reserved.cpus,
+            min(reserved.mem_mb,
+                mem.available // mb - config.capacity.mem_reserve_mb),
+            min(reserved.disk_mb,
+                disk.free // mb - config.capacity.disk_reserve_mb),
+        )
+
+    def check(self, footprint):
+        total = self.total()
+        if not footprint.fits(total):
+            raise ExceedsHostError(footprint, total)
+        available = self.available()
+        if not footprint.fits(available):
+            raise InsufficientCapacityError(footprint, available)
+        return available
+
+
+def check_admission(session, bunit, strategy=None):
+    """Raises InsufficientCapacityError if bunit's build cannot fit.
+
+    ExceedsHostError, a kind of it, is raised if the build would not fit
+    even with nothing else running.
+    """
+    footprint = estimate_footprint(bunit, strategy)
+    committed = committed_footprint(session, exclude=bunit.id)
+    host = HostCapacity(committed=committed)
+    return host.check(footprint)
@@ -0,0 +1,57 @@
+"""Completed build phases, recorded so failed units can be resumed."""
+import logging
+
+from bcpc_build.db.models.build_checkpoint import BuildCheckpointBase
+from bcpc_build.db import utils as dbutils
+
+# Phase names; per-item phases are '<prefix>:<item>'
+POPULATE = 'populate'
+CONFIGURE = 'configure'
+INSTALL_CERTS = 'install_certs'
+BUILD = 'build'
+
+
+def phase_name(prefix, item=None):
+    return prefix if item is None else '%s:%s' % (prefix, item)
+
+
+class Checkpoints(object):
+    """Completed phases of one build unit."""
+
+    def __init__(self, session, bunit):
+        self.session = session
+        self.bunit = bunit
+        self.logger = logging.getLogger(__name__)
+
+    def _query(self):
+        return self.session.query(BuildCheckpointBase).filter(
+            BuildCheckpointBase.unit_id == self.bunit.id
+        )
+
+    def completed(self):
+        q = self._query().order_by(BuildCheckpointBase.completed_at,
+                                   BuildCheckpointBase.id)
+        return [c.phase for c in q]
+
+    def done(self, phase):
+        q = self._query().filter(BuildCheckpointBase.phase == phase)
+        return self.session.query(q.exists()).scalar()
+
+    def mark(self, phase):
+        if self.done(phase):
+            return
+        self.logger.debug('Checkpoint %s for %s' % (phase, self.bunit.id))
+        self.session.add(BuildCheckpointBase(unit_id=self.bunit.id,
+                                             phase=phase))
+        dbutils.commit(self.session)
+
+    def clear(self, prefix=None):
+        """Forgets completed phases, those under prefix if given."""
+        q = self._query()
+        if prefix is not None:
+            q = q.filter(
+                (BuildCheckpointBase.phase == prefix) |
+                BuildCheckpointBase.phase.startswith(prefix + ':')
+            )
+        q.delete(synchronize_session=False)
+        dbutils.commit(self.session)
@@ -9,11 +9,16 @@ from bcpc_build.build_unit import BuildStateEnum
 from bcpc_build.build_unit import BuildUnitAllocator
 from bcpc_build.build_unit import DEFAULT_ALLOCATOR
 from bcpc_build.cmd.exceptions import CommandNotImplementedError
+from bcpc_build.cmd.unit import lookup_unit
 from bcpc_build.dec import *
 from bcpc_build.exceptions import AllocationError
 from bcpc_build.exceptions import BuildError
 from bcpc_build.exceptions import ConfigurationError
 from bcpc_build.exceptions import ProvisionError
+from bcpc_build.pool import BuildUnitPool
+from bcpc_build.pool import spawn_fill
+from bcpc_build.scheduler import BuildScheduler
+from bcpc_build.scheduler import spawn_scheduler
 from . import logger
 import click
 
@@ -44,6 +49,12 @@ class InvalidDependsError(ConfigurationError):
               help='Run the configuration phase.')
 @click.option('--build/--no-build', default=True,
               help='Run the build phase.')
+@click.option('--from-template', metavar='ID',
+              help='Clone the new unit from an existing unit.')
+@click.option('--mirror/--no-mirror', default=True,
+              help='Clone sources through the local mirror cache.')
+@click.option('--pool/--no-pool', default=True,
+              help='Claim a pooled unit if available.')
 @click.option('--wait/--no-wait', default=False,
               help='Wait for bootstrap to complete in foreground.')
 @click.option('--log-level', default='INFO',
@@ -51,7 +62,8 @@ class InvalidDependsError(ConfigurationError):
 @click.pass_context
 @click.argument('name', default='')
 def bootstrap(ctx, config_file, source_url, depends,
-              strategy, configure, build, wait, log_level, name):
+              strategy, configure, build, from_template, mirror, pool, wait,
+              log_level, name):
     logger.set_log_level(log_level)
     log = logger.LOG
     def _parse_conf(conffile):
@@ -94,26 +106,51 @@ def bootstrap(ctx, config_file, source_url, depends,
         try:
             if not source_url:
                 source_url = allocator.DEFAULT_SRC_URL
-            bunit = allocator.allocate(source_url=source_url, name=name)
-            allocator.provision(bunit, conf=conf)
+            if conf['from_template']:
+                template = lookup_unit(allocator.session,
+                                       conf['from_template'])
+                bunit = allocator.clone(template, name=name, conf=conf)
+            else:
+                # Pooled units only carry the default dependencies
+                if conf['pool'] and not conf.get('src_depends'):
+                    bunit = BuildUnitPool(allocator).claim(
+                        name=name, source_url=source_url
+                    )
+                if bunit:
+                    allocator.provision(bunit, conf=conf, populate=False)
+                    spawn_fill()
+                else:
+                    bunit = allocator.allocate(source_url=source_url,
+                                               name=name)
+                    allocator.provision(bunit, conf=conf)
             info = json.loads(bunit.to_json())
             click.echo(json.dumps(info, indent=2))
             # do the build
-            if conf['build']:
+            if conf['build'] and not wait:
+                # Detached bootstraps go through admission control
+                scheduler = BuildScheduler(session=allocator.session)
+                scheduler.enqueue(bunit, strategy)
+                spawn_scheduler()
+            elif conf['build']:
                 build_seq = allocator.build(bunit)
-                blog = allocator.get_build_log(bunit)
-                blogger = BuildLogger(filename=blog, func=click.echo)
+                writer = allocator.get_log_store(bunit).writer()
+                blogger = BuildLogger(
+                    writer=writer, func=click.echo,
+                    broadcaster=allocator.get_broadcaster(bunit))
                 try:
                     while True:
                         blogger.echo(next(build_seq))
                 except StopIteration:
                     allocator.set_build_state(bunit, BuildStateEnum.done)
                     click.echo('Bootstrap complete.')
+                finally:
+                    blogger.close()
         except (AllocationError, ProvisionError) as e:
             import traceback
             traceback.print_exc()
-            click.echo('Rolling back changes...')
-            allocator.destroy(bunit, commit=True)
+            if bunit:
+                click.echo('Rolling back changes...')
+                allocator.destroy(bunit, commit=True)
             raise click.ClickException(e)
         except (ConfigurationError, ) as e:
             allocator.set_build_state(bunit, BuildStateEnum.failed_build)
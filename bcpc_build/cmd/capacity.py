@@ -0,0 +1,55 @@
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.capacity import HostCapacity
+from bcpc_build.capacity import committed_footprint
+from bcpc_build.capacity import default_footprint
+from bcpc_build.capacity import estimate_footprint
+from bcpc_build.cmd.unit import lookup_unit
+from bcpc_build.db import utils
+from collections import OrderedDict
+from terminaltables import AsciiTable
+import click
+import sqlalchemy as sa
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+@click.command(help='Report how many more units fit on this host.')
+@click.option('--strategy', help='Build strategy of the unit profile.',
+              type=click.Choice(BuildUnitAllocator.BUILD_STRATEGY_NAMES),
+              default=BuildUnitAllocator.BUILD_STRATEGY_DEFAULT)
+@click.option('--like', metavar='ID',
+              help='Use the footprint of an existing unit as the profile.')
+@click.option('--format', '-f', help='Display format',
+              type=click.Choice(['json', 'table']), default='table')
+@click.pass_context
+def capacity(ctx, strategy, like, format):
+    session = utils.Session()
+    try:
+        if like:
+            footprint = estimate_footprint(lookup_unit(session, like))
+        else:
+            footprint = default_footprint(strategy)
+        host = HostCapacity(committed=committed_footprint(session))
+    except sa.exc.SQLAlchemyError as e:
+        click.echo('Something went wrong: %s' % e, err=True)
+        raise click.Abort
+    available = host.available()
+    report = OrderedDict([
+        ('profile', footprint._asdict()),
+        ('total', host.total()._asdict()),
+        ('committed', host.committed._asdict()),
+        ('available', available._asdict()),
+        ('fits', footprint.count_in(available)),
+    ])
+    if format == 'json':
+        click.echo(json.dumps(report, indent=2))
+        return
+    header = ('', ) + footprint._fields
+    rows = [header] + [
+        (k,) + tuple(str(v) for v in report[k].values())
+        for k in ('profile', 'total', 'committed', 'available')
+    ]
+    click.echo(AsciiTable(rows).table)
+    click.echo('Units of this profile that fit: %d' % report['fits'])
@@ -1,5 +1,6 @@
 from alembic.config import Config
 from alembic import command
+from bcpc_build.db import jsonl
 from bcpc_build.db import utils as dbutils
 from bcpc_build import config
 from .exceptions import CommandNotImplementedError
@@ -24,7 +25,9 @@ def setup(ctx, force):
     config_file = pkg_dir.joinpath('alembic.ini').as_posix()
     # TODO(kamidzi): check for file
     alembic_cfg = Config(config_file)
-    alembic_cfg.set_section_option('alembic', 'sqlalchemy.url', config.db.url)
+    # Escaped for the config parser's interpolation
+    alembic_cfg.set_section_option('alembic', 'sqlalchemy.url',
+                                   config.db.url.replace('%', '%%'))
     command.upgrade(alembic_cfg, 'head')
 
 
@@ -35,21 +38,64 @@ def migrate(ctx):
 
 
 @cli.command(help="Backup the database.")
-@click.option('--destination', help='URI for destination.', required=True)
+@click.option('--destination', help='URI for destination.')
+@click.option('--compress/--no-compress', default=False,
+              help='Compress the backup with gzip.')
+@click.option('--incremental', is_flag=True, default=False,
+              help='Snapshot into a rotating set if changed.')
+@click.option('--directory', metavar='DIR',
+              help='Snapshot directory for --incremental.')
+@click.option('--keep', type=click.IntRange(min=1), metavar='N',
+              help='Snapshots to keep with --incremental.')
 @click.pass_context
-def backup(ctx, destination):
+def backup(ctx, destination, compress, incremental, directory, keep):
+    if incremental == bool(destination):
+        raise click.UsageError(
+            'Give either --destination or --incremental.')
     try:
-        dbutils.backup(destination)
+        if incremental:
+            path = dbutils.rotate_backups(directory, keep=keep,
+                                          compress=compress)
+            if path is None:
+                click.echo('No changes since the last snapshot.')
+                return
+        else:
+            path = dbutils.backup(destination, compress=compress)
+        click.echo('Backed up to %s' % path)
     except dbutils.BackupError as e:
         click.echo(e, err=True)
+        ctx.exit(1)
+
+
+@cli.command(help="Export the build unit inventory.")
+@click.option('--format', 'format_', type=click.Choice(['jsonl']),
+              default='jsonl', help='Export format.')
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='File to write to; standard output by default.')
+@click.pass_context
+def export(ctx, format_, output):
+    engine = dbutils.get_engine()
+    with engine.connect() as conn:
+        count = jsonl.export(conn, output)
+    click.echo('Exported %d rows.' % count, err=True)
 
 
 @cli.command('import', help="Import the database.")
 @click.option('--backup/--no-backup', default=True,
               help="Backup current database during import.")
+@click.option('--format', 'format_',
+              type=click.Choice(['sqlite', 'pg_dump', 'jsonl']),
+              help='A backup of the configured database, by default, or a'
+              ' file from db export.')
+@click.option('--mode', type=click.Choice(jsonl.MODES), default=jsonl.MERGE,
+              help='Keep or update units already present (jsonl).')
 @click.argument('uri')
 @click.pass_context
-def import_db(ctx, backup, uri):
+def import_db(ctx, backup, format_, mode, uri):
+    if format_ not in (None, 'jsonl', dbutils.backup_format()):
+        raise click.UsageError(
+            'Cannot import %s into this database; use db export and'
+            ' --format jsonl.' % format_)
     dest = dbutils.get_backup_uri()
     try:
         try:
@@ -57,7 +103,23 @@ def import_db(ctx, backup, uri):
                 dbutils.backup(dest)
         except dbutils.NoBackupSource:
             pass
-        dbutils.import_db(uri)
+        if format_ == 'jsonl':
+            engine = dbutils.get_engine()
+
+            def conflict(table, row):
+                click.echo('Skipped unit %s: name "%s" is taken.' % (
+                    row['id'], row['name']), err=True)
+
+            with click.open_file(uri) as lines, engine.begin() as conn:
+                counts = jsonl.import_rows(conn, lines, mode=mode,
+                                           on_conflict=conflict)
+            for table, c in counts.items():
+                click.echo('%s: %d inserted, %d updated, %d skipped,'
+                           ' %d conflicting' % (
+                               table, c['inserted'], c['updated'],
+                               c['skipped'], c['conflicts']))
+        else:
+            dbutils.import_db(uri)
     except Exception as e:
         click.echo('Could not import database: %s' % e, err=True)
         raise click.Abort()
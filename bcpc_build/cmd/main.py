@@ -18,14 +18,22 @@ def cli(ctx):
 
 ### add some subcommands ###
 from bcpc_build.cmd.bootstrap import bootstrap
+from bcpc_build.cmd.capacity import capacity
 from bcpc_build.cmd.db import cli as db_cmds
+from bcpc_build.cmd.pool import cli as pool_cmds
 from bcpc_build.cmd.setup import init
 from bcpc_build.cmd.setup import setup
 from bcpc_build.cmd.unit import cli as unit_cmds
 
 cli.add_command(init)
 cli.add_command(bootstrap)
+cli.add_command(capacity)
 cli.add_command(unit_cmds, name='unit')
 cli.add_command(db_cmds, name='db')
+cli.add_command(pool_cmds, name='pool')
 
 logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+
+
+if __name__ == '__main__':
+    cli()
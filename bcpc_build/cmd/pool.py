@@ -0,0 +1,66 @@
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.pool import BuildUnitPool
+from bcpc_build.pool import PoolBusyError
+from bcpc_build.pool import spawn_fill
+from terminaltables import AsciiTable
+import click
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+@click.group(help='Manages the build unit pool.')
+@click.pass_context
+def cli(ctx):
+    pass
+
+
+@cli.command(help='Show pool status.')
+@click.option('--format', '-f', help='Display format',
+              type=click.Choice(['json', 'table']), default='table')
+@click.pass_context
+def status(ctx, format):
+    info = BuildUnitPool().status()
+    if format == 'json':
+        click.echo(json.dumps(info, indent=2))
+        return
+    tdata = [('Property', 'Value')] + [(k, str(v)) for k, v in info.items()]
+    click.echo(AsciiTable(tdata).table)
+
+
+@cli.command(help='Set the number of units kept in the pool.')
+@click.option('--source-url', help='URL for pooled build sources.')
+@click.option('--strategy', help='Build strategy.',
+              type=click.Choice(BuildUnitAllocator.BUILD_STRATEGY_NAMES))
+@click.option('--fill/--no-fill', default=True,
+              help='Top up the pool in the background.')
+@click.argument('size', type=click.IntRange(min=0))
+@click.pass_context
+def resize(ctx, source_url, strategy, fill, size):
+    pool = BuildUnitPool()
+    pool.resize(size, source_url=source_url, strategy=strategy)
+    if fill:
+        spawn_fill()
+
+
+@cli.command(help='Top up the pool to its size.')
+@click.option('--wait', is_flag=True, default=False,
+              help='Wait for a concurrent fill to finish.')
+@click.pass_context
+def fill(ctx, wait):
+    try:
+        added = BuildUnitPool().fill(blocking=wait)
+    except PoolBusyError as e:
+        raise click.ClickException(e)
+    for bunit in added:
+        click.echo(bunit.id)
+
+
+@cli.command(help='Destroy pooled build units.')
+@click.option('--count', type=click.IntRange(min=1),
+              help='Number of units to destroy; defaults to all.')
+@click.pass_context
+def drain(ctx, count):
+    for bunit_id in BuildUnitPool().drain(count=count):
+        click.echo(bunit_id)
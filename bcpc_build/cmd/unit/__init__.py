@@ -3,8 +3,31 @@ from bcpc_build.build_unit import BuildUnit
 from bcpc_build.build_unit import BuildUnitAllocator
 from bcpc_build.cmd.exceptions import CommandNotImplementedError
 from bcpc_build.db import utils
+from bcpc_build.db.models.build_unit import natural_sort_key
+from bcpc_build import broadcast
+from bcpc_build import capacity
+from bcpc_build import history as history_mod
+from bcpc_build import logsearch
+from bcpc_build import resolver
+from bcpc_build import runner
+from bcpc_build import timing
+from bcpc_build.logsearch import SearchCache
+from bcpc_build.logsearch import SearchJob
+from bcpc_build.logstore import LogNotFoundError
+from bcpc_build.runner import AsyncBuildRunner
+from bcpc_build.utils.stream import STDERR
 from bcpc_build.db.migration_types import BuildStateEnum
+from bcpc_build.exceptions import AllocationError
+from bcpc_build.exceptions import BuildError
+from bcpc_build.exceptions import IllegalTransitionError
+from bcpc_build.exceptions import ProvisionError
+from bcpc_build.exceptions import StateConflictError
+from bcpc_build.scheduler import BuildScheduler
+from bcpc_build.scheduler import spawn_scheduler
 from .config import cli as config_cli
+from .queue import cli as queue_cli
+from collections import OrderedDict
+from datetime import datetime
 from pathlib import Path
 from terminaltables import AsciiTable
 import abc
@@ -15,6 +38,7 @@ import shlex
 import sqlalchemy as sa
 import subprocess
 import sys
+import time
 try:
     import simplejson as json
 except ImportError:
@@ -22,9 +46,85 @@ except ImportError:
 from json import JSONEncoder
 
 
-class NotFoundError(click.ClickException):
-    def __init__(id, *args, **kwargs):
-        super().__init__("No such unit with id '%s'" % id)
+def lookup_unit(session, id):
+    """Finds the build unit by id, id prefix, name or glob; see
+    bcpc_build.resolver.
+    """
+    try:
+        return resolver.resolve_one(session, id)
+    except resolver.ResolveError as e:
+        raise click.ClickException(e.message) from e
+
+
+def lookup_units(session, ids, query=None):
+    """Finds the build units matching any of the identifiers, in one query."""
+    try:
+        return resolver.resolve(session, ids, query=query)
+    except resolver.ResolveError as e:
+        raise click.ClickException(e.message) from e
+
+
+def unit_selection(f):
+    """Adds the unit ids and filters of select_units() to a command."""
+    decorators = [
+        click.argument('ids', nargs=-1, metavar='[ID]...'),
+        click.option('--failed', is_flag=True, default=False,
+                     help='Only units in a failed state.'),
+        click.option('--build-state', type=BuildStateEnum,
+                     help='Only units in this state.'),
+        click.option('--build-user', help='Only units of this build user.'),
+        click.option('--older-than', metavar='AGE',
+                     help='Only units unchanged for AGE (2d) or since a'
+                     ' date.'),
+    ]
+    for decorator in reversed(decorators):
+        f = decorator(f)
+    return f
+
+
+def select_units(session, ids=(), failed=False, build_state=None,
+                 build_user=None, older_than=None):
+    """Units named by ids that match every filter.
+
+    Without ids, all units matching the filters. Everything is resolved
+    in one query; ids naming no unit are an error, while units named but
+    filtered out are skipped.
+    """
+    conds = []
+    if failed:
+        # PostgreSQL enums take no LIKE, their text does
+        conds.append(
+            sa.cast(BuildUnit.build_state, sa.Unicode).like('failed%'))
+    if build_state is not None:
+        conds.append(BuildUnit.build_state == BuildStateEnum(build_state))
+    if build_user is not None:
+        conds.append(BuildUnit.build_user == build_user)
+    if older_than is not None:
+        cutoff = datetime.utcfromtimestamp(parse_time(older_than))
+        conds.append(BuildUnit.updated_at < cutoff)
+    if not ids:
+        if not conds:
+            raise click.UsageError('Give unit ids or filters.')
+        return session.query(BuildUnit).filter(*conds).order_by(
+            BuildUnit.sort_key).all()
+
+    # Filters are selected as a column, to tell the units filtered out
+    # from ids naming no unit
+    selected = sa.and_(*conds) if conds else sa.true()
+    rows = lookup_units(session, ids, query=session.query(
+        BuildUnit, selected.label('selected')))
+    return [bunit for bunit, selected in rows if selected]
+
+
+def echo_results(results, done):
+    """Shows what became of each unit; False if anything failed."""
+    tdata = [('id', 'name', 'result')]
+    for bunit, error in results:
+        tdata.append((str(bunit.id), bunit.name,
+                      done if error is None else
+                      'error: %s' % getattr(error, 'message', error)))
+    click.echo(AsciiTable(tdata).table)
+    return all(error is None for _, error in results)
 
 
 ### formatters ###
@@ -37,11 +137,16 @@ class DisplayFormat(abc.ABC):
 
 
 class ListingFormat(DisplayFormat):
-    pass
+    @classmethod
+    def columns(cls, **kwargs):
+        """Names of the BuildUnit attributes the format shows."""
+        return BuildUnit._attrs_
 
 
 class ShowFormat(DisplayFormat):
-    pass
+    @classmethod
+    def format_many(cls, data, **kwargs):
+        return '\n'.join(cls.format(obj, **kwargs) for obj in data)
 
 
 class BuildUnitShowJSONFormat(ShowFormat):
@@ -49,6 +154,11 @@ class BuildUnitShowJSONFormat(ShowFormat):
     def format(cls, data, **kwargs):
         return data.to_json()
 
+    @classmethod
+    def format_many(cls, data, **kwargs):
+        return json.dumps([BuildUnit.get_json_dict(obj) for obj in data],
+                          indent=2)
+
 
 class BuildUnitShowTableFormat(ShowFormat):
     HEADER_ROW = ('Property', 'Value')
@@ -78,19 +188,20 @@ class BuildUnitListingTableFormat(ListingFormat):
     ]
 
     @classmethod
-    def format(cls, data, **kwargs):
+    def columns(cls, **kwargs):
         long = kwargs.get('long', False)
-        header = cls.LONG_HEADER_ROW if long else cls.SHORT_HEADER_ROW
+        return cls.LONG_HEADER_ROW if long else cls.SHORT_HEADER_ROW
+
+    @classmethod
+    def format(cls, data, **kwargs):
+        header = cls.columns(**kwargs)
 
         def render_row(obj):
             return tuple([str(getattr(obj, k)) for k in header])
 
         def generate_tdata(_data):
-            import builtins
-            rows = [header]
-            data_rows = builtins.list(map(lambda x: render_row(x), _data))
-            rows += sorted(data_rows, key=lambda r: r[-1])
-            return rows
+            # Rows come in the order of the query
+            return [header] + [render_row(x) for x in _data]
 
         tdata = generate_tdata(data)
         table = AsciiTable(tdata)
@@ -140,72 +251,458 @@ def cli(ctx):
 @click.option('--strategy', help='Build strategy.',
               type=click.Choice(BuildUnitAllocator.BUILD_STRATEGY_NAMES),
               required=True)
+@click.option('--priority', type=int, default=0,
+              help='Queue priority of a --no-wait build.')
+@click.option('--force', is_flag=True, default=False,
+              help='Skip the host capacity check.')
 @click.argument('id')
-def build(ctx, wait, strategy, id):
-    if not wait:
-        raise CommandNotImplementedError('build --no-wait')
-    sa_errors = (sa.orm.exc.NoResultFound,
-                 sa.orm.exc.NoResultFound)
+def build(ctx, wait, strategy, priority, force, id):
     conf = dict(strategy=strategy)
     try:
-        bunit = None
         allocator = BuildUnitAllocator.get_allocator(conf)
-        # use id or name
-        try:
-            md = BuildUnit.metadata
-            sa_type = type(md.tables[BuildUnit.__tablename__].c.id.type)
-            sa_type._coerce(id)
-            bunit = allocator.session.query(BuildUnit).get(id)
-        except ValueError as e:
-            allocator.logger.debug('Attempting BuildUnit lookup by name.')
-        except Exception:
-            allocator.logger.debug('Some error occurred: %s' % e)
-
-        if not bunit:
+        bunit = lookup_unit(allocator.session, id)
+
+        if not wait:
+            scheduler = BuildScheduler(session=allocator.session)
+            entry = scheduler.enqueue(bunit, strategy, priority=priority)
+            spawn_scheduler()
+            click.echo(entry.to_json())
+            return
+
+        if not force:
             try:
-                q = allocator.session.query(BuildUnit).filter_by(name=id)
-                bunit = q.one()
-            except sa_errors as e:
-                raise NotFoundError(id) from e
-
-        build_seq = allocator.build(bunit)
-        blog = allocator.get_build_log(bunit)
-        log_args = dict(filename=blog)
-        if wait:
-            log_args['func'] = click.echo
-
-        blogger = BuildLogger(**log_args)
-        try:
-            while True:
-                blogger.echo(next(build_seq))
-        except StopIteration:
-            allocator.set_build_state(bunit, BuildStateEnum.done)
-            click.echo('Build complete.')
+                capacity.check_admission(allocator.session, bunit, strategy)
+            except capacity.ExceedsHostError as e:
+                raise click.ClickException(e.message)
+            except capacity.InsufficientCapacityError as e:
+                raise click.ClickException(
+                    '%s. Use --no-wait to queue the build.' % e)
+
+        run_build(allocator, bunit)
     except click.ClickException:
         raise
 
 
-@cli.command(help='Show build unit information.')
+def run_build(allocator, bunit, resume=False):
+    """Runs the build in the foreground, echoing its output."""
+    try:
+        build_seq = allocator.build(bunit, resume=resume)
+    except (IllegalTransitionError, StateConflictError) as e:
+        click.echo(e.message, err=True)
+        raise click.Abort
+    # A resumed build continues the log of the failed one
+    writer = allocator.get_log_store(bunit).writer(append=resume)
+    blogger = BuildLogger(writer=writer, func=click.echo,
+                          broadcaster=allocator.get_broadcaster(bunit))
+    try:
+        for record in build_seq:
+            blogger.echo(record)
+        allocator.set_build_state(bunit, BuildStateEnum.done)
+        click.echo('Build complete.')
+    except BuildError as e:
+        raise click.ClickException(e)
+    except (IllegalTransitionError, StateConflictError) as e:
+        click.echo(e.message, err=True)
+        raise click.Abort
+    finally:
+        blogger.close()
+
+
+@cli.command(help='Resume a failed build.')
+@click.pass_context
+@click.option('--strategy', help='Build strategy.',
+              type=click.Choice(BuildUnitAllocator.BUILD_STRATEGY_NAMES),
+              required=True)
+@click.option('--configure/--no-configure', default=True,
+              help='Run the configuration phase if incomplete.')
+@click.argument('id')
+def resume(ctx, strategy, configure, id):
+    # States in which provisioning has not completed
+    provision_states = (
+        BuildStateEnum.provisioning,
+        BuildStateEnum.configuring,
+        BuildStateEnum.failed_provision,
+    )
+    conf = dict(strategy=strategy, configure=configure)
+    allocator = BuildUnitAllocator.get_allocator(conf)
+    bunit = lookup_unit(allocator.session, id)
+    if bunit.build_state in (BuildStateEnum.done, BuildStateEnum.pooled):
+        raise click.ClickException(
+            'Unit %s is %s; nothing to resume.' % (id, bunit.build_state))
+    completed = allocator.checkpoints(bunit).completed()
+    if completed:
+        click.echo('Completed phases: %s' % ', '.join(completed))
+    if bunit.build_state in provision_states:
+        try:
+            allocator.provision(bunit, conf=conf, resume=True)
+        except ProvisionError as e:
+            raise click.ClickException(e)
+        except StateConflictError as e:
+            click.echo(e.message, err=True)
+            raise click.Abort
+    run_build(allocator, bunit, resume=True)
+
+
+@cli.command(help='Build several units from one process.')
+@click.pass_context
+@click.option('--strategy', help='Build strategy.',
+              type=click.Choice(BuildUnitAllocator.BUILD_STRATEGY_NAMES),
+              required=True)
+@click.option('--max-concurrent', type=click.IntRange(min=1),
+              help='Maximum number of concurrent builds.')
+@click.option('--resume', is_flag=True, default=False,
+              help='Skip build targets completed earlier.')
+@click.argument('ids', nargs=-1, required=True)
+def supervise(ctx, strategy, max_concurrent, resume, ids):
+    session = utils.Session()
+    units = lookup_units(session, ids)
+
+    def echo(bunit, record):
+        click.echo('[%s] %s' % (bunit.name, record.line),
+                   err=record.stream == STDERR)
+
+    supervisor = AsyncBuildRunner(session=session,
+                                  max_concurrent=max_concurrent, echo=echo)
+    results = supervisor.run([(bunit, strategy) for bunit in units],
+                             resume=resume)
+    rows = [('name', 'id', 'result')]
+    rows += [(bunit.name, str(bunit.id), results[bunit.id])
+             for bunit in units]
+    click.echo(AsciiTable(rows).table)
+    if any(r != runner.DONE for r in results.values()):
+        ctx.exit(1)
+
+
+@cli.command(help='Clone a build unit.')
+@click.pass_context
+@click.option('--name', help='Name of the new unit.', default='')
+@click.option('--strategy', help='Build strategy.',
+              type=click.Choice(BuildUnitAllocator.BUILD_STRATEGY_NAMES),
+              default=BuildUnitAllocator.BUILD_STRATEGY_DEFAULT)
+@click.option('--configure/--no-configure', default=True,
+              help='Regenerate the unit configuration.')
+@click.argument('id')
+def clone(ctx, name, strategy, configure, id):
+    conf = dict(strategy=strategy, configure=configure)
+    allocator = BuildUnitAllocator.get_allocator(conf)
+    template = lookup_unit(allocator.session, id)
+    try:
+        bunit = allocator.clone(template, name=name, conf=conf)
+    except (AllocationError, ProvisionError) as e:
+        raise click.ClickException(e)
+    click.echo(bunit.to_json())
+
+
+@cli.command(help='Show phase timings of a build unit.')
+@click.pass_context
+@click.option('--format', '-f', help='Display format',
+              type=click.Choice(['table', 'json']), default='table')
+@click.argument('id')
+def timings(ctx, format, id):
+    session = utils.Session()
+    bunit = lookup_unit(session, id)
+    header = ('phase', 'started_at', 'duration', 'exit_status', 'host')
+    rows = []
+    for event in timing.unit_events(session, bunit.id):
+        duration = event.duration
+        rows.append(OrderedDict([
+            ('phase', event.phase),
+            ('started_at', str(event.started_at)),
+            ('duration', None if duration is None else round(duration, 3)),
+            ('exit_status', event.exit_status),
+            ('host', event.host),
+        ]))
+    if format == 'json':
+        click.echo(json.dumps(rows, indent=2))
+        return
+    tdata = [header] + [tuple(str(r[k]) for k in header) for r in rows]
+    click.echo(AsciiTable(tdata).table)
+
+
+@cli.command(help='Show build state changes of a unit.')
+@click.pass_context
+@click.option('--format', '-f', help='Display format',
+              type=click.Choice(['table', 'json']), default='table')
+@click.argument('id')
+def history(ctx, format, id):
+    session = utils.Session()
+    bunit = lookup_unit(session, id)
+    header = ('timestamp', 'from_state', 'to_state', 'duration', 'host',
+              'pid')
+    events = history_mod.unit_history(session, bunit.id).all()
+    rows = []
+    for event, following in zip(events, events[1:] + [None]):
+        # Time spent in to_state; the current state is still going
+        end = following.timestamp if following else datetime.utcnow()
+        duration = (end - event.timestamp).total_seconds()
+        rows.append(OrderedDict([
+            ('timestamp', str(event.timestamp)),
+            ('from_state', event.from_state and event.from_state.value),
+            ('to_state', event.to_state and event.to_state.value),
+            ('duration', round(duration, 3)),
+            ('host', event.host),
+            ('pid', event.pid),
+        ]))
+    if format == 'json':
+        click.echo(json.dumps(rows, indent=2))
+        return
+    tdata = [header] + [tuple(str(r[k]) for k in header) for r in rows]
+    click.echo(AsciiTable(tdata).table)
+
+
+@cli.command(help='Show phase duration percentiles across units.')
+@click.pass_context
+@click.option('--format', '-f', help='Display format',
+              type=click.Choice(['table', 'json']), default='table')
+@click.option('--all', 'all_', is_flag=True, default=False,
+              help='Include failed phases.')
+@click.option('--states', is_flag=True, default=False,
+              help='Show time spent in each build state instead.')
+@click.option('--since', metavar='TIME',
+              help='Only count since a date, epoch or age.')
+def stats(ctx, format, all_, states, since):
+    session = utils.Session()
+    if since is not None:
+        since = datetime.utcfromtimestamp(parse_time(since))
+    if states:
+        header = ('state', 'count', 'mean', 'max', 'total')
+        stats = history_mod.time_in_state(session, since=since)
+    else:
+        header = ('phase', 'count', 'p50', 'p95', 'max')
+        stats = timing.phase_stats(session, successful=not all_,
+                                   since=since)
+    if format == 'json':
+        click.echo(json.dumps(stats, indent=2))
+        return
+    tdata = [header]
+    for name, st in stats.items():
+        tdata.append((name, str(st['count'])) + tuple(
+            '%.3f' % st[k] for k in header[2:]))
+    click.echo(AsciiTable(tdata).table)
+
+
+def parse_time(value):
+    """Epoch seconds from a date, an epoch or an age such as 90m or 2h."""
+    m = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', value)
+    if m:
+        units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        return time.time() - float(m.group(1)) * units[m.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    raise click.BadParameter('Cannot parse time "%s"' % value)
+
+
+def parse_range(value):
+    """Inclusive (first, last) line numbers from A:B; either may be empty."""
+    try:
+        a, b = value.split(':')
+        return (int(a) if a else 1), (int(b) if b else None)
+    except ValueError:
+        raise click.BadParameter('Expected a line range A:B, not "%s"'
+                                 '' % value)
+
+
+class DefaultCommandGroup(click.Group):
+    """Group running default_command unless a subcommand is named."""
+
+    def __init__(self, *args, **kwargs):
+        self.default_command = kwargs.pop('default_command')
+        super().__init__(*args, **kwargs)
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and
+                         args[0] not in ctx.help_option_names):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+@cli.group(cls=DefaultCommandGroup, default_command='show',
+           help='Show or search build logs.')
+@click.pass_context
+def logs(ctx):
+    pass
+
+
+@logs.command(name='show', help='Show the build log of a unit.')
+@click.pass_context
+@click.option('--tail', type=click.IntRange(min=0), metavar='N',
+              help='Show the last N lines.')
+@click.option('--since', metavar='TIME',
+              help='Show lines logged since a date, epoch or age (2h).')
+@click.option('--range', 'range_', metavar='A:B',
+              help='Show lines A to B.')
+@click.option('--build', 'generation', type=int, metavar='N',
+              help='Show build N rather than the latest.')
+@click.option('--timestamps', is_flag=True, default=False,
+              help='Prefix lines with their time and stream.')
+@click.argument('id')
+def logs_show(ctx, tail, since, range_, generation, timestamps, id):
+    if sum(x is not None for x in (tail, since, range_)) > 1:
+        raise click.UsageError(
+            'Only one of --tail, --since and --range may be given.')
+    session = utils.Session()
+    bunit = lookup_unit(session, id)
+    store = BuildUnitAllocator.get_log_store(bunit)
+    try:
+        reader = store.reader(generation)
+    except LogNotFoundError as e:
+        legacy = BuildUnitAllocator.get_build_log(bunit)
+        if generation is not None or not os.path.exists(legacy):
+            raise click.ClickException(e)
+        # Logs of builds from before the log store are plain text
+        with open(legacy) as f:
+            lines = [line.rstrip('\n') for line in f]
+        if tail is not None:
+            lines = lines[len(lines) - tail:] if tail else []
+        elif range_ is not None:
+            first, last = parse_range(range_)
+            lines = lines[first - 1:last]
+        for line in lines:
+            click.echo(line)
+        return
+
+    if tail is not None:
+        lines = reader.tail(tail) if tail else []
+    elif since is not None:
+        lines = reader.since(parse_time(since))
+    elif range_ is not None:
+        lines = reader.lines(*parse_range(range_))
+    else:
+        lines = reader.lines()
+    for line in lines:
+        if timestamps:
+            stamp = datetime.fromtimestamp(line.timestamp).isoformat()
+            click.echo('%s %s %s' % (stamp, line.stream, line.line))
+        else:
+            click.echo(line.line)
+
+
+@cli.command(help='Follow the output of a running build.')
 @click.pass_context
+@click.option('--timestamps', is_flag=True, default=False,
+              help='Prefix lines with their time and stream.')
 @click.argument('id')
+def attach(ctx, timestamps, id):
+    session = utils.Session()
+    bunit = lookup_unit(session, id)
+    path = BuildUnitAllocator.get_broadcast_path(bunit)
+    try:
+        for record in broadcast.follow(path):
+            if record.stream == broadcast.META:
+                click.echo(record.line, err=True)
+            elif timestamps:
+                stamp = datetime.fromtimestamp(record.timestamp).isoformat()
+                click.echo('%s %s %s' % (stamp, record.stream, record.line))
+            else:
+                click.echo(record.line)
+    except broadcast.NotBroadcastingError:
+        raise click.ClickException(
+            'Unit %s is not building (state %s).' % (bunit.id,
+                                                     bunit.build_state))
+    except KeyboardInterrupt:
+        # Detaching leaves the build running
+        pass
+
+
+def failed_states():
+    return [state for state in BuildStateEnum.__members__.values()
+            if re.match('^failed(:[^ ]+)?$', state.value)]
+
+
+@logs.command(name='grep', help='Search the build logs of many units.')
+@click.pass_context
+@click.option('--state', 'states', multiple=True, metavar='STATE',
+              type=click.Choice(['failed'] +
+                                [s.value for s in BuildStateEnum]),
+              help='Only units in this state; "failed" means any failure.')
+@click.option('--since', metavar='TIME',
+              help='Only lines logged since a date, epoch or age (2h).')
+@click.option('--ignore-case', '-i', is_flag=True, default=False,
+              help='Match case-insensitively.')
+@click.option('--max-count', '-m', type=click.IntRange(min=1), metavar='N',
+              help='Stop after N matches per unit.')
+@click.option('--workers', type=click.IntRange(min=1),
+              help='Number of search processes.')
+@click.option('--cache/--no-cache', default=True,
+              help='Reuse results for unchanged logs.')
+@click.argument('pattern')
+def logs_grep(ctx, states, since, ignore_case, max_count, workers, cache,
+              pattern):
+    session = utils.Session()
+    units = session.query(BuildUnit)
+    if states:
+        wanted = set()
+        for state in states:
+            if state == 'failed':
+                wanted.update(failed_states())
+            else:
+                wanted.add(BuildStateEnum(state))
+        units = units.filter(BuildUnit.build_state.in_(wanted))
+
+    jobs = []
+    for bunit in units.order_by(BuildUnit.name):
+        store = BuildUnitAllocator.get_log_store(bunit)
+        try:
+            reader = store.reader()
+            jobs.append(SearchJob(bunit.name, reader.log_path,
+                                  reader.index_path))
+        except LogNotFoundError:
+            legacy = BuildUnitAllocator.get_build_log(bunit)
+            if os.path.exists(legacy):
+                jobs.append(SearchJob(bunit.name, legacy, None))
+
+    try:
+        results = logsearch.search(
+            jobs, pattern, ignore_case=ignore_case,
+            since=parse_time(since) if since else None,
+            max_count=max_count, workers=workers,
+            cache=SearchCache() if cache else None
+        )
+        found = False
+        for job, matches, error in results:
+            if error:
+                click.echo('%s: %s' % (job.name, error), err=True)
+                continue
+            for match in matches:
+                found = True
+                click.echo('%s:%d:%s' % (job.name, match.lineno, match.line))
+    except re.error as e:
+        raise click.BadParameter('Invalid pattern: %s' % e)
+    # Like grep, exit 1 if nothing matched
+    ctx.exit(0 if found else 1)
+
+
+@cli.command(help='Show build unit information.')
+@click.pass_context
+@unit_selection
 @click.option('--format', help='Display format', default='table')
-def show(ctx, id, format):
+def show(ctx, ids, failed, build_state, build_user, older_than, format):
     formatters = {
         'json': BuildUnitShowJSONFormat,
         'table': BuildUnitShowTableFormat,
     }
     session = utils.Session()
     try:
-        bunit = session.query(BuildUnit).get(id)
-        if bunit is None:
-            msg = "No such unit with id '%s'" % id
-            raise click.ClickException(msg)
         formatter = formatters[format]
-        click.echo(formatter.format(bunit))
-    except sa.exc.SQLAlchemyError as e:
-        raise click.ClickException(e)
     except KeyError:
         raise NotImplementedError('%s format' % format)
+    try:
+        units = select_units(session, ids, failed=failed,
+                             build_state=build_state, build_user=build_user,
+                             older_than=older_than)
+    except sa.exc.SQLAlchemyError as e:
+        raise click.ClickException(e)
+    if len(units) == 1 and len(ids) == 1:
+        click.echo(formatter.format(units[0]))
+    elif units:
+        click.echo(formatter.format_many(units))
 
 
 @cli.command(help='Start a shell in the build unit.')
@@ -228,56 +725,39 @@ def shell(ctx, id):
         "env {envargs} sudo -p 'Password for %u' -u {user} -",
     ]
     session = utils.Session()
-    try:
-        bunit = session.query(BuildUnit).get(id)
-        user = bunit.build_user
-        for c in cmdlist:
-            r = 0
-            cmd = shlex.split(c.format(user=user, envargs=_envargs()))
-            r = subprocess.call(cmd)
-            if r == 0:
-                break
-        if r != 0:
-            msg = ('Could not spawn shell:'
-                   ' "{cmd}" returned with non-zero status {ret}'.format(
-                       cmd=' '.join(cmd), ret=r))
-            click.echo(msg, err=True)
-    except sa.exc.SQLAlchemyError:
-        click.echo("No such unit with id '%s'" % id, err=True)
-
-
-@cli.command(help='Destroy build unit.')
+    user = lookup_unit(session, id).build_user
+    for c in cmdlist:
+        r = 0
+        cmd = shlex.split(c.format(user=user, envargs=_envargs()))
+        r = subprocess.call(cmd)
+        if r == 0:
+            break
+    if r != 0:
+        msg = ('Could not spawn shell:'
+               ' "{cmd}" returned with non-zero status {ret}'.format(
+                   cmd=' '.join(cmd), ret=r))
+        click.echo(msg, err=True)
+
+
+@cli.command(help='Destroy build units.')
 @click.pass_context
-@click.argument('id')
-def destroy(ctx, id):
-    sa_errors = (sa.orm.exc.NoResultFound,
-                 sa.orm.exc.NoResultFound)
+@unit_selection
+@click.option('--workers', type=click.IntRange(min=1),
+              help='Number of units torn down at once.')
+def destroy(ctx, ids, failed, build_state, build_user, older_than, workers):
+    allocator = BuildUnitAllocator()
+    units = select_units(allocator.session, ids, failed=failed,
+                         build_state=build_state, build_user=build_user,
+                         older_than=older_than)
+    if not units:
+        return
     try:
-        bunit = None
-        allocator = BuildUnitAllocator()
-        # use id or name
-        try:
-            md = BuildUnit.metadata
-            sa_type = type(md.tables[BuildUnit.__tablename__].c.id.type)
-            sa_type._coerce(id)
-            bunit = allocator.session.query(BuildUnit).get(id)
-        except ValueError as e:
-            allocator.logger.debug('Attempting BuildUnit lookup by name.')
-        except Exception:
-            allocator.logger.debug('Some error occurred: %s' % e)
-
-        if not bunit:
-            try:
-                q = allocator.session.query(BuildUnit).filter_by(name=id)
-                bunit = q.one()
-            except sa_errors as e:
-                raise NotFoundError(id) from e
-        allocator.destroy(bunit)
-    except click.ClickException:
-        raise
-    except Exception as e:
-        click.echo(e)
+        results = allocator.destroy_many(units, workers=workers)
+    except sa.exc.SQLAlchemyError as e:
+        click.echo(e, err=True)
         raise click.Abort
+    if not echo_results(results, 'destroyed'):
+        ctx.exit(1)
 
 
 @cli.command(help='List build units.')
@@ -289,80 +769,80 @@ def destroy(ctx, id):
 @click.option('--build-user', help='Filter by build user.')
 @click.option('--build-state', help='Filter by build state.',
               type=BuildStateEnum)
-def list(ctx, format, failed, long, build_user, build_state):
-    import builtins
+@click.option('--limit', type=click.IntRange(min=1), metavar='N',
+              help='List at most N units.')
+@click.option('--offset', type=click.IntRange(min=0), default=0,
+              metavar='N', help='Skip the first N units.')
+@click.option('--after', metavar='NAME',
+              help='List units sorting after NAME, as next page.')
+def list(ctx, format, failed, long, build_user, build_state, limit, offset,
+         after):
     formatters = {
         'json': BuildUnitListingJSONFormat,
         'table': BuildUnitListingTableFormat,
         'value': BuildUnitListingValueFormat,
     }
+    try:
+        formatter = formatters[format]
+    except KeyError:
+        raise NotImplementedError('%s format' % format)
     session = utils.Session()
     try:
-        builds = session.query(BuildUnit)
+        columns = [getattr(BuildUnit, c)
+                   for c in formatter.columns(long=long)]
+        builds = session.query(BuildUnit).options(sa.orm.load_only(*columns))
         if build_user is not None:
             builds = builds.filter(BuildUnit.build_user == build_user)
 
         # Check for any "failed" states
         if failed:
-            def failure_state(estate):
-                m = re.match('^failed(:[^ ]+)?$', estate.value)
-                return m
-
-            failed_states = filter(failure_state,
-                                   BuildStateEnum.__members__.values())
-            q = [BuildUnit.build_state == state for state in failed_states]
-            builds = builds.filter(sa.or_(*q))
+            # PostgreSQL enums take no LIKE, their text does
+            builds = builds.filter(
+                sa.cast(BuildUnit.build_state, sa.Unicode).like('failed%'))
         elif build_state is not None:
             builds = builds.filter(
                 BuildUnit.build_state == BuildStateEnum(build_state)
             )
+        # Keyset pagination: seeks through the sort key index
+        if after is not None:
+            builds = builds.filter(
+                BuildUnit.sort_key > natural_sort_key(after))
+        builds = builds.order_by(BuildUnit.sort_key).offset(offset)
+        if limit is not None:
+            builds = builds.limit(limit)
 
-        if not builtins.list(builds):
+        units = builds.all()
+        if not units:
             return
-        formatter = formatters[format]
-        click.echo(formatter.format(sorted(builds), long=long))
+        click.echo(formatter.format(units, long=long))
     except sa.exc.SQLAlchemyError as e:
         click.echo('Something went wrong: %s' % e, err=True)
         raise click.Abort
-    except KeyError:
-        raise NotImplementedError('%s format' % format)
 
 
 @cli.command(help='Modify build unit metadata')
 @click.pass_context
-@click.argument('id')
+@unit_selection
 @click.option('--set-state', help='Set build unit state.',
               type=click.Choice(BuildStateEnum.__members__.keys()),
               metavar='BUILDSTATE')
-def modify(ctx, set_state, id):
-    sa_errors = (sa.orm.exc.NoResultFound,
-                 sa.orm.exc.NoResultFound)
-    try:
-        bunit = None
-        allocator = BuildUnitAllocator()
-        # use id or name
-        try:
-            md = BuildUnit.metadata
-            sa_type = type(md.tables[BuildUnit.__tablename__].c.id.type)
-            sa_type._coerce(id)
-            bunit = allocator.session.query(BuildUnit).get(id)
-        except ValueError as e:
-            allocator.logger.debug('Attempting BuildUnit lookup by name.')
-        except Exception:
-            allocator.logger.debug('Some error occurred: %s' % e)
-
-        if not bunit:
-            try:
-                q = allocator.session.query(BuildUnit).filter_by(name=id)
-                bunit = q.one()
-            except sa_errors as e:
-                raise NotFoundError(id) from e
-
-        if set_state:
-            state_obj = getattr(BuildStateEnum, set_state)
-            allocator.set_build_state(bunit, state_obj)
-    except click.ClickException:
-        raise
+@click.option('--force', is_flag=True, default=False,
+              help='Allow moves the state machine does not.')
+def modify(ctx, ids, failed, build_state, build_user, older_than, set_state,
+           force):
+    allocator = BuildUnitAllocator()
+    units = select_units(allocator.session, ids, failed=failed,
+                         build_state=build_state, build_user=build_user,
+                         older_than=older_than)
+    if not units or not set_state:
+        return
+    state = getattr(BuildStateEnum, set_state)
+    results = allocator.set_build_states(units, state, force=force)
+    if not echo_results(results, str(state)):
+        if any(isinstance(e, IllegalTransitionError) for _, e in results):
+            click.echo('Use --force to override.', err=True)
+        ctx.exit(1)
 
 
 cli.add_command(config_cli, name='config')
+cli.add_command(queue_cli, name='queue')
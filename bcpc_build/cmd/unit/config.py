@@ -1,6 +1,6 @@
-from bcpc_build.build_unit import BuildUnit
 from bcpc_build.cmd.exceptions import CommandNotImplementedError
 from bcpc_build.db import utils
+from bcpc_build import resolver
 from pathlib import Path
 import click
 import sqlalchemy as sa
@@ -22,7 +22,7 @@ def cli(ctx):
 
 @cli.command(help='Synchronizes configuration.')
 @click.pass_context
-@click.argument('id', type=click.UUID)
+@click.argument('id')
 def sync(ctx, id):
     raise CommandNotImplementedError('sync')
 
@@ -31,7 +31,7 @@ def sync(ctx, id):
 @click.option('--format', help='Format to display data',
               type=click.Choice(CONFIG_SHOW_FMTS), default='shell')
 @click.pass_context
-@click.argument('id', type=click.UUID)
+@click.argument('id')
 def show(ctx, format, id):
     def _get_script_dir(bunit):
         bdir = Path(bunit.build_dir)
@@ -39,9 +39,10 @@ def show(ctx, format, id):
 
     session = utils.Session()
     try:
-        bunit = session.query(BuildUnit).get(id)
-        if not bunit:
-            raise NotFoundError(id)
+        bunit = resolver.resolve_one(session, id)
+    except resolver.ResolveError as e:
+        raise click.ClickException(e.message) from e
+    try:
         sdir = _get_script_dir(bunit)
         out = subprocess.check_output('./dump_config.sh', cwd=sdir,
                                       universal_newlines=True)
@@ -72,7 +73,7 @@ def show(ctx, format, id):
 @click.option('--set', help='Set an option', is_flag=True)
 @click.option('--delete', help='Delete an option', is_flag=True)
 @click.pass_context
-@click.argument('id', type=click.UUID)
+@click.argument('id')
 def edit(ctx, set, delete, id):
     if set:
         raise CommandNotImplementedError('--set')
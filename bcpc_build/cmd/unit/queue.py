@@ -0,0 +1,84 @@
+from bcpc_build.db.migration_types import BuildQueueStateEnum
+from bcpc_build.scheduler import BuildQueueEntry
+from bcpc_build.scheduler import BuildScheduler
+from bcpc_build.scheduler import NoSuchEntryError
+from bcpc_build.scheduler import SchedulerBusyError
+from terminaltables import AsciiTable
+import click
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+QUEUE_LIST_FMTS = ['table', 'json']
+
+
+@click.group(help='Manages the build queue.')
+@click.pass_context
+def cli(ctx):
+    pass
+
+
+@cli.command(help='List queued and running builds.')
+@click.option('--format', '-f', help='Listing format',
+              type=click.Choice(QUEUE_LIST_FMTS), default='table')
+@click.option('--all', 'all_', help='Include finished entries.',
+              is_flag=True, default=False)
+@click.option('--policy', help='Ordering policy.',
+              type=click.Choice(BuildScheduler.POLICIES))
+@click.pass_context
+def list(ctx, format, all_, policy):
+    scheduler = BuildScheduler(policy=policy)
+    entries = scheduler.entries(states=None if all_ else
+                                BuildScheduler.ACTIVE_STATES).all()
+    if format == 'json':
+        click.echo(json.dumps([BuildQueueEntry.get_json_dict(e)
+                               for e in entries], indent=2))
+        return
+    header = BuildQueueEntry._attrs_
+    rows = [header] + [tuple(str(getattr(e, k)) for k in header)
+                       for e in entries]
+    click.echo(AsciiTable(rows).table)
+
+
+@cli.command(help='Cancel a queued or running build.')
+@click.argument('entry_id', type=int)
+@click.pass_context
+def cancel(ctx, entry_id):
+    try:
+        if not BuildScheduler().cancel(entry_id):
+            raise click.ClickException(
+                'Queue entry %d is no longer active.' % entry_id)
+    except NoSuchEntryError as e:
+        raise click.ClickException(e)
+
+
+@cli.command(help='Change the priority of a queued build.')
+@click.argument('entry_id', type=int)
+@click.argument('priority', type=int)
+@click.pass_context
+def reprioritize(ctx, entry_id, priority):
+    try:
+        if not BuildScheduler().reprioritize(entry_id, priority):
+            raise click.ClickException(
+                'Queue entry %d is not queued.' % entry_id)
+    except NoSuchEntryError as e:
+        raise click.ClickException(e)
+
+
+@cli.command(help='Run the scheduler until the queue is empty.')
+@click.option('--max-concurrent', type=click.IntRange(min=1),
+              help='Maximum number of concurrent builds.')
+@click.option('--policy', help='Scheduling policy.',
+              type=click.Choice(BuildScheduler.POLICIES))
+@click.option('--interval', type=float,
+              help='Seconds between scheduling passes.')
+@click.pass_context
+def run(ctx, max_concurrent, policy, interval):
+    scheduler = BuildScheduler(max_concurrent=max_concurrent, policy=policy)
+    try:
+        scheduler.run(interval=interval)
+    except SchedulerBusyError as e:
+        # The running scheduler will pick up the queue
+        click.echo(e, err=True)
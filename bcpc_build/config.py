@@ -1,4 +1,5 @@
 from pathlib import Path
+import os
 
 USER_CONF_DIRNAME = '.bcpc-build'
 USER_CONF_FILENAME = 'config.py'
@@ -13,7 +14,58 @@ def get_user_conf_file():
 
 userdir = get_user_conf_dir()
 db = lambda: None
-db.url = 'sqlite:///%s' % Path(userdir).joinpath('master.db').as_posix()
+# Any SQLAlchemy URL; postgresql:// lets several build hosts share one
+# inventory
+db.url = os.environ.get(
+    'BCPC_BUILD_DB_URL',
+    'sqlite:///%s' % Path(userdir).joinpath('master.db').as_posix())
+# Seconds to wait for a lock held by another process
+db.busy_timeout = 30
+# SQLite only
+db.journal_mode = 'wal'
+db.synchronous = 'normal'
+# Connection pool of server databases, per process
+db.pool_size = 5
+db.max_overflow = 10
+# Seconds before a pooled connection is replaced
+db.pool_recycle = 3600
+db.backup_dir = Path(userdir).joinpath('backups').as_posix()
+db.backup_keep = 24
+# Pages copied per step when not in WAL mode, and the pause between
+db.backup_pages = 1024
+db.backup_sleep = 0.005
+# Rows per statement in db export and import
+db.batch_size = 1000
+pool = lambda: None
+pool.conf_file = Path(userdir).joinpath('pool.json').as_posix()
+pool.lock_file = Path(userdir).joinpath('pool.lock').as_posix()
+pool.size = 0
+scheduler = lambda: None
+scheduler.lock_file = Path(userdir).joinpath('scheduler.lock').as_posix()
+scheduler.max_concurrent = 4
+scheduler.policy = 'fifo'
+scheduler.interval = 10
+scheduler.admission = True
+capacity = lambda: None
+capacity.cpu_overcommit = 2.0
+capacity.mem_reserve_mb = 2048
+capacity.disk_reserve_mb = 10240
+logs = lambda: None
+logs.keep = 10
+logs.frame_bytes = 256 * 1024
+logs.flush_interval = 5
+logs.search_cache_dir = Path(userdir).joinpath('log-search-cache').as_posix()
+unit = lambda: None
+# Units torn down at once by unit destroy
+unit.destroy_workers = 8
+# Parsed configuration files kept in memory, per process
+unit.config_cache_size = 512
+# Threads parsing configuration files ahead of use
+unit.config_prefetch_workers = 4
+attach = lambda: None
+attach.socket_dir = Path(userdir).joinpath('attach').as_posix()
+attach.history = 1000
+attach.max_pending = 1024 * 1024
 
 # This file is included as a module, so...
 del userdir
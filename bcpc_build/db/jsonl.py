@@ -0,0 +1,277 @@
+"""Exporting and importing the unit inventory as JSON lines.
+
+Each line holds one row as ``{"table": <name>, "row": {<column>: ...}}``.
+Build units come first, then their state and phase history. Rows are
+streamed in batches both ways, so memory use does not grow with the
+database, and an import runs in a single transaction.
+
+Units are matched by id. History rows are matched on what they record
+rather than on their ids, which are only unique within one database, so
+inventories from many hosts can be merged into one. A unit whose name
+another unit already holds is skipped with its history, and reported,
+rather than failing the whole import.
+"""
+from collections import namedtuple
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import re
+import uuid
+
+import sqlalchemy as sa
+
+from bcpc_build.db.migration_types import UUIDType
+from bcpc_build.db.models.build_phase_event import BuildPhaseEventBase
+from bcpc_build.db.models.build_state_event import BuildStateEventBase
+from bcpc_build.db.models.build_unit import BuildUnitBase
+from bcpc_build import config
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+# Rows already present are left alone, or updated
+MERGE = 'merge'
+UPSERT = 'upsert'
+MODES = (MERGE, UPSERT)
+
+# The UTC offset isoformat() appends to aware datetimes
+_OFFSET_RE = re.compile(r'([+-])(\d\d):(\d\d)$')
+
+
+class TableSpec(namedtuple('TableSpec', ['table', 'key', 'skip',
+                                         'updatable', 'unique'])):
+    """key columns identify a row across databases; skip are not copied.
+
+    unique columns hold values no two rows may share.
+    """
+    __slots__ = ()
+
+
+TABLES = (
+    TableSpec(BuildUnitBase.__table__, ('id',), (), True, ('name',)),
+    # History never changes once written
+    TableSpec(BuildStateEventBase.__table__,
+              ('unit_id', 'timestamp', 'to_state'), ('id',), False, ()),
+    TableSpec(BuildPhaseEventBase.__table__,
+              ('unit_id', 'phase', 'started_at'), ('id',), False, ()),
+)
+
+
+class InvalidRecordError(ValueError):
+    def __init__(self, lineno, message=None):
+        self.lineno = lineno
+        if not message:
+            message = 'Invalid record'
+        self.message = 'line %d: %s' % (lineno, message)
+        super().__init__(self.message)
+
+
+def _dump_value(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # Enum members
+    return getattr(value, 'value', value)
+
+
+def _parse_datetime(text):
+    # The inverse of isoformat(), which datetime lacks before Python 3.7
+    tz = None
+    m = _OFFSET_RE.search(text)
+    if m:
+        text = text[:m.start()]
+        offset = timedelta(hours=int(m.group(2)), minutes=int(m.group(3)))
+        tz = timezone(-offset if m.group(1) == '-' else offset)
+    try:
+        value = datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f')
+    except ValueError:
+        # isoformat() leaves out the microseconds when they are zero
+        value = datetime.strptime(text, '%Y-%m-%dT%H:%M:%S')
+    return value.replace(tzinfo=tz) if tz else value
+
+
+def _loader(column):
+    if isinstance(column.type, UUIDType):
+        return uuid.UUID
+    if isinstance(column.type, (sa.DateTime, sa.TIMESTAMP)):
+        return _parse_datetime
+    enum_class = getattr(column.type, 'enum_class', None)
+    if enum_class is not None:
+        return enum_class
+    return None
+
+
+def export_rows(conn, batch_size=None):
+    """Yields (table name, row dict) for every exported row."""
+    batch_size = batch_size or config.db.batch_size
+    for spec in TABLES:
+        table = spec.table
+        columns = [c for c in table.c if c.name not in spec.skip]
+        query = sa.select(columns).order_by(
+            *[table.c[k] for k in spec.key])
+        result = conn.execution_options(stream_results=True).execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield table.name, dict(
+                        (c.name, _dump_value(row[c])) for c in columns)
+        finally:
+            result.close()
+
+
+def export(conn, out, batch_size=None):
+    """Writes every exported row to out; returns the number written."""
+    count = 0
+    for name, row in export_rows(conn, batch_size):
+        out.write(json.dumps({'table': name, 'row': row}) + '\n')
+        count += 1
+    return count
+
+
+class _Importer(object):
+    def __init__(self, conn, mode, on_conflict=None):
+        self.conn = conn
+        self.mode = mode
+        self.on_conflict = on_conflict
+        self.specs = dict((s.table.name, s) for s in TABLES)
+        self.counts = dict((s.table.name, dict(inserted=0, updated=0,
+                                               skipped=0, conflicts=0))
+                           for s in TABLES)
+        # Ids of units skipped for a name clash; their history goes too
+        self.conflicting = set()
+
+    def load(self, name, row):
+        spec = self.specs[name]
+        values = {}
+        for column in spec.table.c:
+            if column.name in spec.skip or column.name not in row:
+                continue
+            value = row[column.name]
+            load = _loader(column)
+            values[column.name] = (load(value)
+                                   if load and value is not None else value)
+        return values
+
+    def _existing(self, spec, rows):
+        """Keys of rows in the batch already in the database."""
+        table = spec.table
+        key_cols = [table.c[k] for k in spec.key]
+        first = key_cols[0]
+        # Narrow by the first key column, then match whole keys here
+        firsts = set(r[first.name] for r in rows)
+        query = sa.select(key_cols).where(first.in_(firsts))
+        return set(tuple(r) for r in self.conn.execute(query))
+
+    def _holders(self, spec, column, rows):
+        """Keys of the rows in the database holding column's values."""
+        table = spec.table
+        values = set(r[column] for r in rows if r.get(column) is not None)
+        if not values:
+            return {}
+        query = sa.select([table.c[column]] +
+                          [table.c[k] for k in spec.key]).where(
+            table.c[column].in_(values))
+        return dict((r[0], tuple(r[1:])) for r in self.conn.execute(query))
+
+    def _clashes(self, spec, rows, existing):
+        """Rows to be written with a unique value another row holds.
+
+        Rows earlier in the batch win over later ones.
+        """
+        writes = self.mode == UPSERT and spec.updatable
+        holders = dict((c, self._holders(spec, c, rows))
+                       for c in spec.unique)
+        clashes = []
+        for r in rows:
+            key = tuple(r[k] for k in spec.key)
+            if key in existing and not writes:
+                continue
+            held = [c for c in spec.unique if r.get(c) is not None and
+                    holders[c].get(r[c], key) != key]
+            if held:
+                clashes.append(r)
+                continue
+            for c in spec.unique:
+                if r.get(c) is not None:
+                    holders[c][r[c]] = key
+        return clashes
+
+    def flush(self, name, rows):
+        if not rows:
+            return
+        spec = self.specs[name]
+        table = spec.table
+        counts = self.counts[name]
+        if self.conflicting and 'unit_id' in table.c:
+            kept = [r for r in rows if r['unit_id'] not in self.conflicting]
+            counts['conflicts'] += len(rows) - len(kept)
+            rows = kept
+        existing = self._existing(spec, rows)
+        clashes = self._clashes(spec, rows, existing)
+        if clashes:
+            counts['conflicts'] += len(clashes)
+            for r in clashes:
+                if table.name == BuildUnitBase.__tablename__:
+                    self.conflicting.add(r['id'])
+                if self.on_conflict is not None:
+                    self.on_conflict(name, r)
+            clashed = set(map(id, clashes))
+            rows = [r for r in rows if id(r) not in clashed]
+        new, old = [], []
+        for r in rows:
+            key = tuple(r[k] for k in spec.key)
+            (old if key in existing else new).append(r)
+        if new:
+            self.conn.execute(table.insert(), new)
+        counts['inserted'] += len(new)
+        if old and self.mode == UPSERT and spec.updatable:
+            where = sa.and_(*[table.c[k] == sa.bindparam('_key_' + k)
+                              for k in spec.key])
+            columns = [c.name for c in table.c if c.name not in spec.key]
+            stmt = table.update().where(where).values(
+                dict((c, sa.bindparam(c)) for c in columns))
+            params = []
+            for r in old:
+                p = dict((c, r.get(c)) for c in columns)
+                p.update(('_key_' + k, r[k]) for k in spec.key)
+                params.append(p)
+            self.conn.execute(stmt, params)
+            counts['updated'] += len(old)
+        else:
+            counts['skipped'] += len(old)
+
+
+def import_rows(conn, lines, mode=MERGE, batch_size=None, on_conflict=None):
+    """Imports JSON lines into the database behind conn.
+
+    conn should be in a transaction, so a failed import changes nothing.
+    Rows whose unique values other rows hold are left out; on_conflict,
+    if given, is called with the table name and each such row. Returns
+    inserted, updated, skipped and conflicting row counts by table.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown import mode "%s"' % mode)
+    batch_size = batch_size or config.db.batch_size
+    importer = _Importer(conn, mode, on_conflict)
+    batch, batch_table = [], None
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            name = record['table']
+            row = importer.load(name, record['row'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise InvalidRecordError(lineno, str(e)) from e
+        if name != batch_table or len(batch) >= batch_size:
+            importer.flush(batch_table, batch)
+            batch, batch_table = [], name
+        batch.append(row)
+    importer.flush(batch_table, batch)
+    return importer.counts
@@ -13,6 +13,52 @@ class BuildStateEnum(Enum):
     failed = 'failed'
     failed_provision = 'failed:provision'
     failed_build = 'failed:build'
+    pooled = 'pooled'
+
+    def __str__(self):
+        return self.value
+
+    @classmethod
+    def can_transition(cls, from_state, to_state):
+        """Whether a unit may move from from_state, or None, to to_state.
+
+        Staying in the same state is always allowed, as is failing.
+        """
+        if from_state == to_state or to_state is cls.failed:
+            return True
+        return to_state in _TRANSITIONS[from_state]
+
+
+_S = BuildStateEnum
+# Legal moves from each state, besides into failed. None is a unit just
+# allocated.
+_TRANSITIONS = {
+    None: {_S.provisioning},
+    _S.pooled: {_S.provisioning},
+    _S.provisioning: {_S.configuring, _S.provisioned, _S.pooled,
+                      _S.failed_provision},
+    _S.configuring: {_S.configured, _S.provisioning, _S.failed_provision,
+                     _S.failed_build},
+    _S.configured: {_S.provisioned, _S.configuring, _S.building,
+                    _S.failed_provision, _S.failed_build},
+    _S.provisioned: {_S.configuring, _S.building, _S.failed_build},
+    _S.building: {_S.done, _S.failed_build},
+    _S.done: {_S.configuring, _S.building},
+    # Retried or resumed
+    _S.failed: {_S.provisioning, _S.configuring, _S.building},
+    _S.failed_provision: {_S.provisioning, _S.configuring},
+    _S.failed_build: {_S.provisioning, _S.configuring, _S.building},
+}
+del _S
+
+
+@unique
+class BuildQueueStateEnum(Enum):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+    cancelled = 'cancelled'
 
     def __str__(self):
         return self.value
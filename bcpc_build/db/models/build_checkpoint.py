@@ -0,0 +1,23 @@
+from bcpc_build.db.migration_types import UUIDType
+from bcpc_build.db.models.build_unit import Base
+from datetime import datetime
+from sqlalchemy import Column, ForeignKey, Integer, UniqueConstraint
+import sqlalchemy as sa
+
+
+class BuildCheckpointBase(Base):
+    __tablename__ = 'build_checkpoint'
+    __table_args__ = (
+        UniqueConstraint('unit_id', 'phase',
+                         name='uq_build_checkpoint_unit_id_phase'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    unit_id = Column(UUIDType(), ForeignKey('build_unit.id'), nullable=False)
+    phase = Column(sa.Unicode(128), nullable=False)
+    completed_at = Column(sa.TIMESTAMP(True), nullable=False,
+                          default=datetime.utcnow)
+
+    def __repr__(self):
+        return ("<BuildCheckpoint(unit_id={unit_id}, phase='{phase}',"
+                " completed_at={completed_at})>".format(**self.__dict__))
@@ -0,0 +1,27 @@
+from bcpc_build.db.migration_types import UUIDType
+from bcpc_build.db.models.build_unit import Base
+from sqlalchemy import Column, ForeignKey, Integer
+import sqlalchemy as sa
+
+
+class BuildPhaseEventBase(Base):
+    __tablename__ = 'build_phase_event'
+
+    id = Column(Integer, primary_key=True)
+    unit_id = Column(UUIDType(), ForeignKey('build_unit.id'), nullable=False,
+                     index=True)
+    phase = Column(sa.Unicode(128), nullable=False, index=True)
+    host = Column(sa.Unicode(255), nullable=True)
+    started_at = Column(sa.TIMESTAMP(True), nullable=False)
+    finished_at = Column(sa.TIMESTAMP(True), nullable=True)
+    exit_status = Column(Integer, nullable=True)
+
+    @property
+    def duration(self):
+        if self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def __repr__(self):
+        return ("<BuildPhaseEvent(unit_id={unit_id}, phase='{phase}',"
+                " exit_status={exit_status})>".format(**self.__dict__))
@@ -0,0 +1,32 @@
+from bcpc_build.db.migration_types import BuildQueueStateEnum
+from bcpc_build.db.migration_types import UUIDType
+from bcpc_build.db.models.build_unit import Base
+from datetime import datetime
+from sqlalchemy import Column, Enum, ForeignKey, Integer
+import sqlalchemy as sa
+
+
+class BuildQueueEntryBase(Base):
+    __tablename__ = 'build_queue'
+
+    id = Column(Integer, primary_key=True)
+    unit_id = Column(UUIDType(), ForeignKey('build_unit.id'), nullable=False,
+                     index=True)
+    strategy = Column(sa.Unicode(16), nullable=False)
+    priority = Column(Integer, nullable=False, default=0)
+    state = Column(
+        Enum(BuildQueueStateEnum, name='buildqueuestateenum',
+             values_callable=lambda x: [e.value for e in x]),
+        nullable=False, default=BuildQueueStateEnum.queued, index=True
+    )
+    host = Column(sa.Unicode(255), nullable=True)
+    pid = Column(Integer, nullable=True)
+    enqueued_at = Column(sa.TIMESTAMP(True), nullable=False,
+                         default=datetime.utcnow)
+    started_at = Column(sa.TIMESTAMP(True), nullable=True)
+    finished_at = Column(sa.TIMESTAMP(True), nullable=True)
+
+    def __repr__(self):
+        return ("<BuildQueueEntry(id={id}, unit_id={unit_id},"
+                " priority={priority}, state='{state}')>"
+                "".format(**self.__dict__))
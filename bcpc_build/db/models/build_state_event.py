@@ -0,0 +1,40 @@
+from bcpc_build.db.migration_types import BuildStateEnum
+from bcpc_build.db.migration_types import UUIDType
+from bcpc_build.db.models.build_unit import Base
+from datetime import datetime
+from sqlalchemy import Column, Enum, Index, Integer
+import sqlalchemy as sa
+
+
+def _state_type():
+    return Enum(BuildStateEnum,
+                values_callable=lambda x: [e.value for e in x])
+
+
+class BuildStateEventBase(Base):
+    """A change of a unit's build state; rows are never updated.
+
+    Events outlive their unit, so fleet-wide statistics include destroyed
+    units: destroying a unit records a final event with no to_state.
+    """
+    __tablename__ = 'build_state_event'
+    __table_args__ = (
+        Index('ix_build_state_event_unit_id_timestamp', 'unit_id',
+              'timestamp'),
+        Index('ix_build_state_event_to_state_timestamp', 'to_state',
+              'timestamp'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    unit_id = Column(UUIDType(), nullable=False)
+    from_state = Column(_state_type(), nullable=True)
+    to_state = Column(_state_type(), nullable=True)
+    timestamp = Column(sa.TIMESTAMP(True), nullable=False,
+                       default=datetime.utcnow)
+    pid = Column(Integer, nullable=True)
+    host = Column(sa.Unicode(255), nullable=True)
+
+    def __repr__(self):
+        return ("<BuildStateEvent(unit_id={unit_id},"
+                " from_state='{from_state}', to_state='{to_state}',"
+                " timestamp={timestamp})>".format(**self.__dict__))
@@ -2,24 +2,45 @@ from bcpc_build.db.migration_types import BuildStateEnum
 from bcpc_build.db.migration_types import UUIDType
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import validates
 from sqlalchemy import Column, Enum, Integer, String
 import sqlalchemy as sa
+import sys
 import uuid
 
 Base = declarative_base()
 
+
+def natural_sort_key(name):
+    """Orders names by their numeric last dotted part, then by name.
+
+    Names without one sort after all others. The key compares as
+    (number, name) does, so 'chef-bcpc.9' sorts before 'chef-bcpc.10'.
+    """
+    try:
+        number = int(name.split('.')[-1])
+    except ValueError:
+        number = sys.maxsize
+    number = min(max(number, 0), sys.maxsize)
+    return '%019d%s' % (number, name)
+
+
 class BuildUnitBase(Base):
     __tablename__ = 'build_unit'
 
     id = Column(UUIDType(), primary_key=True, default=uuid.uuid4)
     build_dir = Column(sa.Unicode(200), nullable=False)
-    build_user = Column(sa.Unicode(64), nullable=False)
+    build_user = Column(sa.Unicode(64), nullable=False, index=True)
     description = Column(sa.Unicode(200))
-    name = Column(sa.Unicode(128), nullable=False)
+    name = Column(sa.Unicode(128), nullable=False, index=True, unique=True)
+    # Set with name; see natural_sort_key
+    sort_key = Column(sa.Unicode(160), index=True)
     source_url = Column(sa.Unicode(200), nullable=False)
     build_state = Column(
         'build_state',
-        Enum(BuildStateEnum, values_callable=lambda x: [e.value for e in x])
+        Enum(BuildStateEnum,
+             values_callable=lambda x: [e.value for e in x]),
+        index=True
     )
     created_at = Column(sa.TIMESTAMP(True), nullable=True,
                                             default=datetime.utcnow)
@@ -27,6 +48,11 @@ class BuildUnitBase(Base):
                                             onupdate=datetime.utcnow,
                                             default=datetime.utcnow)
 
+    @validates('name')
+    def _set_sort_key(self, key, name):
+        self.sort_key = natural_sort_key(name)
+        return name
+
     def __repr__(self):
         return ("<BuildUnit(name='{name}', build_dir={build_dir},"
                 " build_user={build_user}, source_url='{source_url}',"
@@ -2,28 +2,147 @@ from bcpc_build import config
 from datetime import datetime
 from furl import furl
 from pathlib import Path
-from shutil import copy2
-from shutil import copyfile
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
 from subprocess import call
+import contextlib
+import gzip
 import os.path
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
 
 
-# TODO: make configurable
-engine = create_engine(config.db.url)
-Session = sessionmaker(bind=engine)
+# One engine, and so one connection pool, per database per process
+_engines = {}
+_Session = sessionmaker()
+
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL lets builders read while another writes; with it NORMAL sync
+    # is safe against corruption and skips an fsync per commit
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=%s' % config.db.journal_mode)
+    cursor.execute('PRAGMA synchronous=%s' % config.db.synchronous)
+    cursor.execute('PRAGMA busy_timeout=%d'
+                   '' % (config.db.busy_timeout * 1000))
+    cursor.close()
+
+
+def get_engine(url=None):
+    """The shared engine for url, by default the configured database."""
+    url = url or config.db.url
+    engine = _engines.get(url)
+    if engine is None:
+        kwargs = {}
+        if url.startswith('sqlite'):
+            # Wait on locks held by concurrent builders, not fail
+            kwargs['connect_args'] = dict(timeout=config.db.busy_timeout)
+        else:
+            # Connections to a server outlive a build; the server may
+            # have dropped them in the meantime
+            kwargs.update(pool_size=config.db.pool_size,
+                          max_overflow=config.db.max_overflow,
+                          pool_recycle=config.db.pool_recycle,
+                          pool_pre_ping=True)
+        engine = create_engine(url, **kwargs)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _set_sqlite_pragmas)
+        _engines[url] = engine
+    return engine
+
+
+def Session(**kwargs):
+    """A new session bound to the shared engine."""
+    kwargs.setdefault('bind', get_engine())
+    return _Session(**kwargs)
+
+
+def commit(session):
+    """Commits session, or only flushes it inside batch()."""
+    if session.info.get('batch'):
+        session.flush()
+    else:
+        session.commit()
+
+
+@contextlib.contextmanager
+def batch(session):
+    """Makes the commit()s of the block one commit, made on exit.
+
+    Everything written in the block is rolled back if it raises. Nested
+    blocks join the outermost one.
+    """
+    if session.info.get('batch'):
+        yield
+        return
+    session.info['batch'] = True
+    try:
+        yield
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info['batch'] = False
+    session.commit()
+
+
+def _is_postgresql(url):
+    return make_url(url).get_backend_name() == 'postgresql'
+
+
+def backup_format(url=None):
+    """Kind of backup db backup writes for url."""
+    url = url or config.db.url
+    return 'pg_dump' if _is_postgresql(url) else 'sqlite'
+
+
+def _pg_command(command, url, *args):
+    """Arguments and environment to run a PostgreSQL client on url."""
+    argv = [command]
+    env = None
+    if url is not None:
+        u = make_url(url)
+        for option, value in (('--host', u.host), ('--port', u.port),
+                              ('--username', u.username),
+                              ('--dbname', u.database)):
+            if value:
+                argv.append('%s=%s' % (option, value))
+        if u.password:
+            # Kept off the command line, where other users can see it
+            env = dict(os.environ, PGPASSWORD=u.password)
+    return argv + list(args), env
+
+
+def _run_pg(command, url, *args):
+    argv, env = _pg_command(command, url, *args)
+    try:
+        subprocess.run(argv, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    except subprocess.CalledProcessError as e:
+        raise BackupError('%s: %s' % (command, e.stderr.strip() or e)) from e
+    except OSError as e:
+        raise BackupError('%s: %s' % (command, e)) from e
+
 
 def start_console(url):
     """Starts a db-specific console."""
     uri = furl(url)
     scheme = uri.scheme
+    env = None
 
     if scheme == 'sqlite':
         args = ['sqlite3', '-bail', str(uri.path.normalize())]
+    elif _is_postgresql(url):
+        args, env = _pg_command('psql', url)
     else:
         raise NotImplementedError('db console for %s' % scheme)
-    call(args)
+    call(args, env=env)
 
 
 def get_backup_uri():
@@ -33,30 +152,37 @@ def get_backup_uri():
     if scheme == 'sqlite':
         suffix = '.bak.%s' % datetime.utcnow().timestamp()
         uri = config.db.url + suffix
+    elif _is_postgresql(config.db.url):
+        name = make_url(config.db.url).database
+        uri = os.path.join(config.db.backup_dir, '%s.bak.%s.dump' % (
+            name, datetime.utcnow().timestamp()))
     else:
         raise NotImplementedError('get_backup_uri() for %s' % scheme)
     return uri
 
 
+def _url_path(url):
+    return str(furl(url).path.normalize())
+
+
 def import_db(uri):
     dest_url = furl(config.db.url)
     src_url = furl(uri)
     dest_scheme = dest_url.scheme
     src_scheme = src_url.scheme
-    # slqalchemy db urls
-    def normalize_url_path(p):
-        c = p.segments
-        return os.path.sep.join(c)
 
     if dest_scheme == src_scheme == 'sqlite':
-        a = normalize_url_path(src_url.path)
-        src = Path(normalize_url_path(src_url.path))
-        dest = Path(normalize_url_path(dest_url.path))
-        copyfile(src.as_posix(), dest.as_posix())
+        src = _url_path(uri)
+        with _uncompressed(src) as path:
+            check_integrity(path)
+            # Writes through SQLite's locking, not over the live file
+            _copy_database(path, _url_path(config.db.url))
+    elif _is_postgresql(config.db.url):
+        _import_postgresql(uri)
     elif any([dest_scheme is None, src_scheme is None]):
         raise ValueError('scheme required in url string')
     else:
-        raise NotImplementedError('import_db for %s' % scheme)
+        raise NotImplementedError('import_db for %s' % src_scheme)
 
 
 class BackupError(RuntimeError):
@@ -65,21 +191,188 @@ class BackupError(RuntimeError):
 class NoBackupSource(BackupError):
     pass
 
-def backup(dest):
-    """Backs up a database."""
+
+def _import_postgresql(uri):
+    """Restores a pg_dump archive, or a copy of another database."""
+    if uri.startswith('postgresql'):
+        fd, archive = tempfile.mkstemp(suffix='.dump')
+        os.close(fd)
+        try:
+            _run_pg('pg_dump', uri, '--format=custom',
+                    '--file=%s' % archive)
+            _restore_postgresql(archive)
+        finally:
+            os.unlink(archive)
+    elif furl(uri).scheme in (None, 'file'):
+        _restore_postgresql(_url_path(uri))
+    else:
+        raise NotImplementedError(
+            'import_db from %s; use db export and db import --format jsonl'
+            '' % furl(uri).scheme)
+
+
+def _restore_postgresql(archive):
+    if not os.path.exists(archive):
+        raise BackupError('%s: no such archive' % archive)
+    # Reads the whole table of contents, so a damaged archive fails here
+    _run_pg('pg_restore', None, '--list', archive)
+    # Replaces what the archive holds in one transaction
+    _run_pg('pg_restore', config.db.url, '--clean', '--if-exists',
+            '--no-owner', '--single-transaction', archive)
+
+
+def _copy_database(src, dest, standalone=False):
+    """Copies a consistent snapshot of SQLite database src into dest.
+
+    In WAL mode a reader never blocks writers, so the copy is done in one
+    step from a single snapshot. Otherwise it is copied a few pages at a
+    time, letting writers commit in between; SQLite restarts the copy if
+    the source changes meanwhile. A standalone copy is left in rollback
+    journal mode.
+    """
+    src_conn = sqlite3.connect('file:%s?mode=ro' % src, uri=True,
+                               timeout=config.db.busy_timeout)
+    try:
+        dest_conn = sqlite3.connect(dest, timeout=config.db.busy_timeout)
+        try:
+            mode = src_conn.execute('PRAGMA journal_mode').fetchone()[0]
+            pages = -1 if mode == 'wal' else config.db.backup_pages
+            src_conn.backup(dest_conn, pages=pages,
+                            sleep=config.db.backup_sleep)
+            if standalone:
+                # A backup is one file, without -wal and -shm companions
+                dest_conn.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            dest_conn.close()
+    finally:
+        src_conn.close()
+
+
+def check_integrity(path):
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    try:
+        result = [r[0] for r in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        raise BackupError('%s: %s' % (path, e)) from e
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise BackupError('%s failed integrity check: %s'
+                          '' % (path, '; '.join(result)))
+
+
+@contextlib.contextmanager
+def _uncompressed(path):
+    if not path.endswith('.gz'):
+        yield path
+        return
+    fd, tmp = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as out, gzip.open(path, 'rb') as f:
+            shutil.copyfileobj(f, out)
+        yield tmp
+    finally:
+        os.unlink(tmp)
+
+
+def backup(dest, compress=False):
+    """Backs up a database; compressed with gzip if compress is set.
+
+    The backup is written next to dest and only renamed into place once
+    it passes an integrity check. Returns the path written.
+    """
     uri = furl(config.db.url)
-    dest = furl(dest)
     scheme = uri.scheme
 
     if scheme == 'sqlite':
+        src = _url_path(config.db.url)
+        dest = _url_path(dest)
+        if compress and not dest.endswith('.gz'):
+            dest += '.gz'
+        if not os.path.exists(src):
+            # No source database to backup
+            raise NoBackupSource(src)
+        tmp = '%s.tmp.%d' % (dest, os.getpid())
         try:
-            src = str(uri.path.normalize())
-            dest = str(dest.path.normalize())
-            copy2(src, dest)
-        except FileNotFoundError as e:
-            if e.filename == src:
-                # No source database to backup
-                raise NoBackupSource(src)
-            raise BackupError(e)
+            _copy_database(src, tmp, standalone=True)
+            check_integrity(tmp)
+            if dest.endswith('.gz'):
+                with open(tmp, 'rb') as f:
+                    with gzip.open(tmp + '.gz', 'wb') as out:
+                        shutil.copyfileobj(f, out)
+                os.unlink(tmp)
+                tmp += '.gz'
+            os.replace(tmp, dest)
+        except (OSError, sqlite3.Error) as e:
+            raise BackupError(e) from e
+        finally:
+            for path in (tmp, tmp + '.gz'):
+                if os.path.exists(path):
+                    os.unlink(path)
+    elif _is_postgresql(config.db.url):
+        dest = _url_path(dest)
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        tmp = '%s.tmp.%d' % (dest, os.getpid())
+        try:
+            # pg_dump archives are compressed themselves
+            _run_pg('pg_dump', config.db.url, '--format=custom',
+                    '--compress=%d' % (6 if compress else 0),
+                    '--file=%s' % tmp)
+            _run_pg('pg_restore', None, '--list', tmp)
+            os.replace(tmp, dest)
+        except OSError as e:
+            raise BackupError(e) from e
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
     else:
         raise NotImplementedError('db backup for %s' % scheme)
+    return dest
+
+
+_SNAPSHOT_RE = re.compile(
+    r'^master\.(\d{8}T\d{6}(?:\.\d+)?Z)\.(?:db(\.gz)?|dump)$')
+
+
+def snapshots(directory):
+    """Snapshot paths in directory, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, n)
+            for n in sorted(n for n in names if _SNAPSHOT_RE.match(n))]
+
+
+def rotate_backups(directory=None, keep=None, compress=False):
+    """Snapshots the database into directory, keeping the newest few.
+
+    For SQLite, nothing is done if the database has not been written to
+    since the latest snapshot, so this is cheap to run often; a
+    PostgreSQL database is always dumped. Returns the path of the new
+    snapshot, or None.
+    """
+    directory = directory or config.db.backup_dir
+    keep = max(config.db.backup_keep if keep is None else keep, 1)
+    existing = snapshots(directory)
+    postgresql = _is_postgresql(config.db.url)
+    if not postgresql:
+        src = _url_path(config.db.url)
+        # Commits touch the WAL in WAL mode, the database otherwise;
+        # readers may create an empty WAL
+        stats = [os.stat(p) for p in (src, src + '-wal')
+                 if os.path.exists(p)]
+        written = max([st.st_mtime_ns for st in stats if st.st_size] or [0])
+        # Snapshots carry the time the database was last written before
+        # them
+        if existing and written <= os.stat(existing[-1]).st_mtime_ns:
+            return None
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S.%fZ')
+    path = backup(os.path.join(directory, 'master.%s.%s' % (
+        stamp, 'dump' if postgresql else 'db')), compress=compress)
+    if not postgresql:
+        os.utime(path, ns=(written, written))
+    for old in snapshots(directory)[:-keep]:
+        os.unlink(old)
+    return path
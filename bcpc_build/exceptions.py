@@ -11,10 +11,44 @@ class AllocationError(RuntimeError):
     pass
 
 
+class IllegalTransitionError(ValueError):
+    def __init__(self, from_state, to_state, message=None):
+        self.from_state = from_state
+        self.to_state = to_state
+        if not message:
+            message = 'Cannot move a build unit from %s to %s.' % (
+                from_state or 'allocated', to_state)
+        self.message = message
+        super().__init__(message)
+
+
+class StateConflictError(RuntimeError):
+    def __init__(self, unit_id, expected, message=None):
+        self.unit_id = unit_id
+        self.expected = expected
+        if not message:
+            message = ('Build unit %s is no longer %s; it was changed by'
+                       ' another process.' % (unit_id, expected or
+                                              'allocated'))
+        self.message = message
+        super().__init__(message)
+
+
 class ProvisionError(RuntimeError):
     pass
 
 
+class PopulateError(ProvisionError):
+    def __init__(self, errors, message=None):
+        self.errors = errors
+        if not message:
+            message = 'Could not populate sources: %s' % '; '.join(
+                '%s: %s' % (k, errors[k]) for k in sorted(errors)
+            )
+        self.message = message
+        super().__init__(message)
+
+
 class ConfigurationError(RuntimeError):
     pass
 
@@ -0,0 +1,84 @@
+"""History of build state changes, in the ``build_state_event`` table.
+
+Each change is added to the session making it, so it is committed in
+the same transaction. The time a unit spent in a state is the time from
+the event entering it to the next event of that unit; aggregates use
+window functions, which need SQLite 3.25 or later.
+"""
+from collections import OrderedDict
+import os
+import socket
+
+import sqlalchemy as sa
+
+from bcpc_build.db.models.build_state_event import BuildStateEventBase
+
+_host = None
+
+
+def _hostname():
+    global _host
+    if _host is None:
+        _host = socket.getfqdn()
+    return _host
+
+
+def record(session, unit_id, from_state, to_state):
+    """Adds a state change to session; to_state is None on destruction."""
+    event = BuildStateEventBase(unit_id=unit_id, from_state=from_state,
+                                to_state=to_state, pid=os.getpid(),
+                                host=_hostname())
+    session.add(event)
+    return event
+
+
+def unit_history(session, unit_id):
+    return session.query(BuildStateEventBase).filter(
+        BuildStateEventBase.unit_id == unit_id
+    ).order_by(BuildStateEventBase.timestamp, BuildStateEventBase.id)
+
+
+def _seconds_between(dialect, start, end):
+    if dialect == 'postgresql':
+        return sa.extract('epoch', end - start)
+    # SQLite keeps timestamps as text
+    return (sa.func.julianday(end) - sa.func.julianday(start)) * 86400.0
+
+
+def stays(session, since=None):
+    """Subquery of the states units entered and when they left them.
+
+    left_at is NULL for the state a unit is still in.
+    """
+    E = BuildStateEventBase
+    left_at = sa.func.lead(E.timestamp).over(partition_by=E.unit_id,
+                                             order_by=(E.timestamp, E.id))
+    q = session.query(E.unit_id.label('unit_id'),
+                      E.to_state.label('state'),
+                      E.timestamp.label('entered_at'),
+                      left_at.label('left_at'))
+    if since is not None:
+        q = q.filter(E.timestamp >= since)
+    return q.subquery()
+
+
+def time_in_state(session, since=None):
+    """Seconds spent in each state by units that have since left it."""
+    s = stays(session, since)
+    seconds = _seconds_between(session.bind.dialect.name, s.c.entered_at,
+                               s.c.left_at)
+    q = session.query(
+        s.c.state, sa.func.count(), sa.func.avg(seconds),
+        sa.func.max(seconds), sa.func.sum(seconds)
+    ).filter(
+        s.c.state.isnot(None), s.c.left_at.isnot(None)
+    ).group_by(s.c.state).order_by(s.c.state)
+    stats = OrderedDict()
+    for state, count, mean, longest, total in q:
+        stats[state.value] = OrderedDict([
+            ('count', count),
+            ('mean', float(mean)),
+            ('max', float(longest)),
+            ('total', float(total)),
+        ])
+    return stats
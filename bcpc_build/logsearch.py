@@ -0,0 +1,214 @@
+"""Searching the build logs of many units at once.
+
+Each unit's latest log is scanned in a worker process. Logs are memory
+mapped rather than read: compressed frames are inflated straight from
+the mapping, and only frames containing a match are split into lines.
+Plain build.log files from before the log store are searched in place.
+Results for logs that have not changed since are served from a cache.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+import hashlib
+import logging
+import mmap
+import os
+import re
+import zlib
+
+from bcpc_build.logstore import read_index
+from bcpc_build import config
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+logger = logging.getLogger(__name__)
+
+# zlib window bits accepting a gzip header
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class LogMatch(namedtuple('LogMatch', ['lineno', 'timestamp', 'line'])):
+    """A matching line; timestamp is None for plain logs."""
+    __slots__ = ()
+
+
+class SearchJob(namedtuple('SearchJob', ['name', 'log_path', 'index_path'])):
+    """The log of one unit; index_path is None for plain logs."""
+    __slots__ = ()
+
+    def stat_key(self):
+        """Changes whenever the log is written to."""
+        paths = [self.log_path, self.index_path]
+        stats = [os.stat(p) for p in paths if p]
+        return [(s.st_size, s.st_mtime_ns) for s in stats]
+
+
+def compile_pattern(pattern, ignore_case=False):
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    return re.compile(pattern.encode('utf-8'), flags)
+
+
+def _mapped(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def search_store(regex, log_path, index_path, since=None, max_count=None):
+    matches = []
+    # Stored lines start with a timestamp, which would hide anchored
+    # matches from a search of the whole frame
+    prefilter = not re.search(rb'\^|\\A|\(\?<', regex.pattern)
+    entries = read_index(index_path)
+    mm = _mapped(log_path)
+    if mm is None:
+        return matches
+    try:
+        view = memoryview(mm)
+        try:
+            for entry in entries:
+                if since is not None and entry.last_ts < since:
+                    continue
+                end = entry.offset + entry.length
+                with view[entry.offset:end] as frame:
+                    data = zlib.decompress(frame, GZIP_WBITS)
+                # Most frames have no match; skip splitting those
+                if prefilter and not regex.search(data):
+                    continue
+                for i, raw in enumerate(data.split(b'\n')[:-1]):
+                    ts, _, text = raw.split(b'\t', 2)
+                    if since is not None and float(ts) < since:
+                        continue
+                    if regex.search(text):
+                        matches.append(LogMatch(
+                            entry.first_line + i, float(ts),
+                            text.decode('utf-8', 'replace')))
+                        if max_count and len(matches) >= max_count:
+                            return matches
+        finally:
+            view.release()
+    finally:
+        mm.close()
+    return matches
+
+
+def search_plain(regex, log_path, since=None, max_count=None):
+    matches = []
+    if since is not None and os.stat(log_path).st_mtime < since:
+        return matches
+    mm = _mapped(log_path)
+    if mm is None:
+        return matches
+    try:
+        pos = lineno_pos = 0
+        lineno = 1
+        while True:
+            m = regex.search(mm, pos)
+            if m is None:
+                break
+            start = mm.rfind(b'\n', 0, m.start()) + 1
+            end = mm.find(b'\n', m.end())
+            if end < 0:
+                end = len(mm)
+            lineno += mm[lineno_pos:start].count(b'\n')
+            lineno_pos = start
+            matches.append(LogMatch(
+                lineno, None, mm[start:end].decode('utf-8', 'replace')))
+            if max_count and len(matches) >= max_count:
+                break
+            # One match per line
+            pos = end + 1
+    finally:
+        mm.close()
+    return matches
+
+
+def search_job(job, pattern, ignore_case=False, since=None, max_count=None):
+    regex = compile_pattern(pattern, ignore_case)
+    if job.index_path:
+        return search_store(regex, job.log_path, job.index_path, since,
+                            max_count)
+    return search_plain(regex, job.log_path, since, max_count)
+
+
+def _search_worker(args):
+    job, query = args
+    try:
+        return job, search_job(job, **query), None
+    except Exception as e:
+        return job, None, '%s: %s' % (e.__class__.__name__, e)
+
+
+def _narrow(job, matches, since=None, max_count=None):
+    """Restricts all the matches of a pattern in job's log to a query."""
+    if since is not None:
+        if job.index_path:
+            matches = [m for m in matches if m.timestamp >= since]
+        elif os.stat(job.log_path).st_mtime < since:
+            matches = []
+    return matches[:max_count] if max_count else matches
+
+
+class SearchCache(object):
+    """All matches by pattern and log state, one JSON file each.
+
+    since and max_count are applied to the cached matches, so searches
+    of the same log going back further, or wanting more, are hits too.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.logs.search_cache_dir
+
+    def _file(self, job, query):
+        key = json.dumps([list(job), job.stat_key(),
+                          sorted(query.items())])
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.json')
+
+    def get(self, job, query):
+        try:
+            with open(self._file(job, query)) as f:
+                return [LogMatch(*m) for m in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+    def put(self, job, query, matches):
+        path = self._file(job, query)
+        os.makedirs(self.path, exist_ok=True)
+        tmp = path + '.tmp.%d' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump([list(m) for m in matches], f)
+        os.replace(tmp, path)
+
+
+def search(jobs, pattern, ignore_case=False, since=None, max_count=None,
+           workers=None, cache=None):
+    """Yields (job, matches, error) per log, in completion order."""
+    query = dict(pattern=pattern, ignore_case=ignore_case)
+    limits = dict(since=since, max_count=max_count)
+    # Fail early, in this process, on a bad pattern
+    compile_pattern(pattern, ignore_case)
+    pending = []
+    for job in jobs:
+        matches = cache.get(job, query) if cache else None
+        if matches is not None:
+            yield job, _narrow(job, matches, **limits), None
+        else:
+            pending.append(job)
+    if not pending:
+        return
+    # Without a cache to fill, logs are searched only as far as needed
+    worker_query = query if cache else dict(query, **limits)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_search_worker, (job, worker_query))
+                   for job in pending]
+        for future in as_completed(futures):
+            job, matches, error = future.result()
+            if cache and error is None:
+                cache.put(job, query, matches)
+                matches = _narrow(job, matches, **limits)
+            yield job, matches, error
@@ -0,0 +1,273 @@
+"""Compressed build logs with an index for random access.
+
+Each build of a unit writes a new generation of its log, numbered from 1,
+as ``build.<n>.log.gz`` plus a sidecar index ``build.<n>.idx``. The log
+is a series of gzip members ("frames") of a few hundred KB of output
+each, so ``zcat`` reads it as usual. Every line is stored as::
+
+    <epoch timestamp>\t<stream>\t<text>
+
+The index holds one fixed-size entry per frame: its first line number,
+line count, byte offset, compressed length and first and last
+timestamps. Readers locate lines by line number or time through the
+index and decompress only the frames they need. Frames are indexed
+only once fully written, so logs of running builds can be read safely.
+"""
+from collections import namedtuple
+import bisect
+import gzip
+import os
+import re
+import struct
+import time
+
+from bcpc_build.utils.stream import OutputRecord
+from bcpc_build.utils.stream import STDOUT
+from bcpc_build import config
+
+INDEX_MAGIC = b'BCPCLOG1'
+INDEX_ENTRY = struct.Struct('<QIQIdd')
+
+_NAME_RE = re.compile(r'^build\.(\d+)\.log\.gz$')
+
+
+class LogNotFoundError(LookupError):
+    def __init__(self, path, message=None):
+        self.path = path
+        if not message:
+            message = 'No build logs in %s' % path
+        self.message = message
+        super().__init__(message)
+
+
+class IndexEntry(namedtuple('IndexEntry', ['first_line', 'count', 'offset',
+                                           'length', 'first_ts',
+                                           'last_ts'])):
+    __slots__ = ()
+
+    @property
+    def end_line(self):
+        return self.first_line + self.count
+
+
+class LogLine(namedtuple('LogLine', ['lineno', 'timestamp', 'stream',
+                                     'line'])):
+    """A stored line; line numbers start at 1."""
+    __slots__ = ()
+
+    def __str__(self):
+        return self.line
+
+
+def encode_line(record):
+    return '%.6f\t%s\t%s\n' % (record.timestamp, record.stream, record.line)
+
+
+def decode_line(lineno, text):
+    ts, stream, line = text.split('\t', 2)
+    return LogLine(lineno, float(ts), stream, line)
+
+
+def read_index(path):
+    """Reads the complete entries of an index file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError('%s is not a build log index' % path)
+    size = INDEX_ENTRY.size
+    body = data[len(INDEX_MAGIC):]
+    # A trailing partial entry is one still being written
+    usable = len(body) - len(body) % size
+    return [IndexEntry(*INDEX_ENTRY.unpack_from(body, i))
+            for i in range(0, usable, size)]
+
+
+class LogWriter(object):
+    """Appends lines to one generation, a frame at a time."""
+
+    def __init__(self, log_path, index_path, frame_bytes=None,
+                 flush_interval=None):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.frame_bytes = frame_bytes or config.logs.frame_bytes
+        self.flush_interval = (config.logs.flush_interval
+                               if flush_interval is None else flush_interval)
+        self._buf = []
+        self._buf_bytes = 0
+        self._first_ts = self._last_ts = None
+        self._flushed_at = time.time()
+        self._open()
+
+    def _open(self):
+        entries = []
+        if os.path.exists(self.index_path):
+            entries = read_index(self.index_path)
+        self.next_line = entries[-1].end_line if entries else 1
+        end = entries[-1].offset + entries[-1].length if entries else 0
+        self._log = open(self.log_path, 'ab')
+        # Drop a frame whose index entry was never written
+        self._log.truncate(end)
+        self._log.seek(end)
+        new_index = not os.path.exists(self.index_path)
+        self._index = open(self.index_path, 'ab')
+        if new_index:
+            self._index.write(INDEX_MAGIC)
+            self._index.flush()
+        else:
+            size = len(INDEX_MAGIC) + len(entries) * INDEX_ENTRY.size
+            self._index.truncate(size)
+            self._index.seek(size)
+
+    def write(self, data):
+        """Stores an OutputRecord, or each line of a string."""
+        if isinstance(data, OutputRecord):
+            records = [data]
+        else:
+            now = time.time()
+            records = [OutputRecord(now, STDOUT, line)
+                       for line in str(data).splitlines() if line]
+        for record in records:
+            text = encode_line(record).encode('utf-8')
+            self._buf.append(text)
+            self._buf_bytes += len(text)
+            if self._first_ts is None:
+                self._first_ts = record.timestamp
+            self._last_ts = record.timestamp
+        if (self._buf_bytes >= self.frame_bytes or
+                time.time() - self._flushed_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.time()
+        if not self._buf:
+            return
+        frame = gzip.compress(b''.join(self._buf))
+        offset = self._log.tell()
+        self._log.write(frame)
+        self._log.flush()
+        entry = IndexEntry(self.next_line, len(self._buf), offset,
+                           len(frame), self._first_ts, self._last_ts)
+        self._index.write(INDEX_ENTRY.pack(*entry))
+        self._index.flush()
+        self.next_line += len(self._buf)
+        self._buf = []
+        self._buf_bytes = 0
+        self._first_ts = self._last_ts = None
+
+    def close(self):
+        self.flush()
+        self._log.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LogReader(object):
+    """Reads lines of one generation through its index."""
+
+    def __init__(self, log_path, index_path):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.entries = read_index(index_path)
+
+    @property
+    def line_count(self):
+        return self.entries[-1].end_line - 1 if self.entries else 0
+
+    def _frame(self, f, entry):
+        f.seek(entry.offset)
+        data = gzip.decompress(f.read(entry.length)).decode('utf-8')
+        # Only '\n' ends a stored line
+        for i, text in enumerate(data.split('\n')[:-1]):
+            yield decode_line(entry.first_line + i, text)
+
+    def _lines_from(self, first):
+        with open(self.log_path, 'rb') as f:
+            for entry in self.entries[first:]:
+                yield from self._frame(f, entry)
+
+    def lines(self, start=1, stop=None):
+        """Lines numbered start up to and including stop."""
+        firsts = [e.first_line for e in self.entries]
+        i = max(bisect.bisect_right(firsts, start) - 1, 0)
+        for line in self._lines_from(i):
+            if stop is not None and line.lineno > stop:
+                break
+            if line.lineno >= start:
+                yield line
+
+    def tail(self, n):
+        """The last n lines."""
+        return self.lines(start=max(self.line_count - n + 1, 1))
+
+    def since(self, timestamp):
+        """Lines logged at or after timestamp."""
+        lasts = [e.last_ts for e in self.entries]
+        i = bisect.bisect_left(lasts, timestamp)
+        for line in self._lines_from(i):
+            if line.timestamp >= timestamp:
+                yield line
+
+
+class LogStore(object):
+    """The log generations of one build unit."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _paths(self, generation):
+        base = os.path.join(self.path, 'build.%d' % generation)
+        return base + '.log.gz', base + '.idx'
+
+    def generations(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(int(m.group(1)) for m in map(_NAME_RE.match, names)
+                      if m)
+
+    def latest(self):
+        generations = self.generations()
+        return generations[-1] if generations else None
+
+    def writer(self, append=False):
+        """Opens a new generation, or the latest if append is set.
+
+        Generations beyond the configured number to keep are removed.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        latest = self.latest()
+        if append and latest is not None:
+            generation = latest
+        else:
+            generation = (latest or 0) + 1
+        log_path, index_path = self._paths(generation)
+        writer = LogWriter(log_path, index_path)
+        self.prune()
+        return writer
+
+    def reader(self, generation=None):
+        if generation is None:
+            generation = self.latest()
+        if generation is None:
+            raise LogNotFoundError(self.path)
+        log_path, index_path = self._paths(generation)
+        if not os.path.exists(index_path):
+            raise LogNotFoundError(self.path,
+                                   'No build log generation %d' % generation)
+        return LogReader(log_path, index_path)
+
+    def prune(self, keep=None):
+        keep = max(config.logs.keep if keep is None else keep, 1)
+        removed = []
+        for generation in self.generations()[:-keep]:
+            for p in self._paths(generation):
+                if os.path.exists(p):
+                    os.unlink(p)
+            removed.append(generation)
+        return removed
@@ -0,0 +1,89 @@
+"""Local bare mirrors of build sources, shared by all build units."""
+from hashlib import sha1
+from subprocess import check_output
+import contextlib
+import fcntl
+import logging
+import os
+import shlex
+import time
+
+from furl import furl
+
+
+class GitMirrorCache(object):
+    """Keeps one bare mirror per source URL under the build home.
+
+    Mirrors are refreshed under an exclusive per-mirror lock, so that
+    concurrent populates of the same source wait for a single fetch.
+    Build units borrow objects from the mirrors through alternates
+    (``git clone --reference``), so a mirror must never be pruned by gc.
+    """
+    MIRROR_DIRNAME = '.mirrors'
+    DEFAULT_TTL = 300
+
+    def __init__(self, build_home, git_config=None, ttl=DEFAULT_TTL):
+        self.root = os.path.join(build_home, self.MIRROR_DIRNAME)
+        self.git_config = git_config or {}
+        self.ttl = ttl
+        self.logger = logging.getLogger(__name__)
+
+    def path_for(self, url):
+        """Mirror location for url, readable by humans and unique."""
+        url = furl(url)
+        basename = os.path.basename(str(url.path).rstrip('/')) or 'repo'
+        if basename.endswith('.git'):
+            basename = basename[:-len('.git')]
+        digest = sha1(url.url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.root, '{}-{}.git'.format(basename, digest))
+
+    def _git(self, *args, cwd=None):
+        config = ' '.join(
+            '-c %s=%s' % (k, shlex.quote(v))
+            for k, v in sorted(self.git_config.items())
+        )
+        cmd = 'git {config} {args}'.format(
+            config=config, args=' '.join(shlex.quote(a) for a in args)
+        )
+        self.logger.debug('Mirror cmd `%s`' % cmd)
+        return check_output(shlex.split(cmd), cwd=cwd)
+
+    @contextlib.contextmanager
+    def lock(self, url):
+        os.makedirs(self.root, mode=0o755, exist_ok=True)
+        with open(self.path_for(url) + '.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stamp(self, path):
+        return os.path.join(path, 'bcpc-build.refreshed')
+
+    def is_fresh(self, url):
+        try:
+            mtime = os.stat(self._stamp(self.path_for(url))).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - mtime < self.ttl
+
+    def refresh(self, url, force=False):
+        """Creates or updates the mirror for url; returns its path."""
+        path = self.path_for(url)
+        with self.lock(url):
+            if not force and self.is_fresh(url):
+                return path
+            if os.path.isdir(path):
+                self.logger.info('Refreshing mirror of %s' % url)
+                # No --prune: units may still reference removed refs
+                self._git('-C', path, 'fetch', '-q', 'origin',
+                          '+refs/*:refs/*')
+            else:
+                self.logger.info('Creating mirror of %s at %s' % (url, path))
+                self._git('clone', '-q', '--mirror', url, path)
+                # Objects are shared with unit clones through alternates
+                self._git('-C', path, 'config', 'gc.auto', '0')
+            with open(self._stamp(path), 'w'):
+                pass
+        return path
@@ -0,0 +1,206 @@
+"""Pool of pre-allocated, pre-populated build units.
+
+Pooled units have a build user, a build directory and cloned sources, but
+have not been configured. They sit in the ``pooled`` state until claimed
+by ``bootstrap``, which then only has to configure and build.
+"""
+from pathlib import Path
+import logging
+import os
+
+from sqlalchemy.exc import IntegrityError
+
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.db.models.build_unit import natural_sort_key
+from bcpc_build.exceptions import DuplicateNameError
+from bcpc_build.exceptions import ProvisionError
+from bcpc_build import config
+from bcpc_build import history
+from bcpc_build import utils
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+class PoolBusyError(RuntimeError):
+    DEFAULT_MSG = 'Another process is filling the pool.'
+
+    def __init__(self, message=DEFAULT_MSG):
+        super().__init__(message)
+
+
+def spawn_fill():
+    """Tops up the pool from a detached process."""
+    return utils.spawn_cli('pool', 'fill')
+
+
+class BuildUnitPool(object):
+    """Keeps a number of warm build units ready to be claimed."""
+    CLAIM_ATTEMPTS = 5
+
+    def __init__(self, allocator=None, conf=None):
+        self._conf = self.load_conf()
+        self._conf.update(conf or {})
+        if allocator is None:
+            allocator = BuildUnitAllocator.get_allocator(
+                conf={'strategy': self._conf['strategy']}
+            )
+        self.allocator = allocator
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def load_conf():
+        conf = {
+            'size': config.pool.size,
+            'source_url': BuildUnitAllocator.DEFAULT_SRC_URL,
+            'strategy': BuildUnitAllocator.BUILD_STRATEGY_DEFAULT,
+        }
+        try:
+            with open(config.pool.conf_file) as f:
+                conf.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        return conf
+
+    def save_conf(self):
+        path = Path(config.pool.conf_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(self._conf, f, indent=2)
+        os.replace(tmp.as_posix(), path.as_posix())
+
+    @property
+    def conf(self):
+        return self._conf
+
+    @property
+    def size(self):
+        return int(self._conf['size'])
+
+    @property
+    def session(self):
+        return self.allocator.session
+
+    def units(self, source_url=None):
+        q = self.session.query(BuildUnit).filter(
+            BuildUnit.build_state == BuildStateEnum.pooled
+        )
+        if source_url is not None:
+            q = q.filter(BuildUnit.source_url == source_url)
+        return q.order_by(BuildUnit.created_at)
+
+    def status(self):
+        pooled = self.units().count()
+        return {
+            'size': self.size,
+            'pooled': pooled,
+            'deficit': max(self.size - pooled, 0),
+            'source_url': self._conf['source_url'],
+            'strategy': self._conf['strategy'],
+        }
+
+    def resize(self, size, source_url=None, strategy=None):
+        if size < 0:
+            raise ValueError('Pool size must be non-negative.')
+        self._conf['size'] = size
+        if source_url:
+            self._conf['source_url'] = source_url
+        if strategy:
+            self._conf['strategy'] = strategy
+        self.save_conf()
+
+    def _take(self, bunit_id, values):
+        """Moves a pooled unit out of the pool if nobody else has."""
+        try:
+            updated = self.session.query(BuildUnit).filter(
+                BuildUnit.id == bunit_id,
+                BuildUnit.build_state == BuildStateEnum.pooled
+            ).update(values, synchronize_session=False)
+            if updated == 1:
+                history.record(self.session, bunit_id, BuildStateEnum.pooled,
+                               values[BuildUnit.build_state])
+            self.session.commit()
+        except IntegrityError as e:
+            # The name was taken since claim() checked it
+            self.session.rollback()
+            raise DuplicateNameError(values[BuildUnit.name]) from e
+        return updated == 1
+
+    def claim(self, name=None, source_url=None):
+        """Atomically claims a warm unit; returns None if none is available.
+
+        The claimed unit is left in the ``provisioning`` state.
+        """
+        if source_url is None:
+            source_url = self._conf['source_url']
+        if name:
+            exists = self.session.query(BuildUnit.id).filter(
+                BuildUnit.name == name
+            ).first()
+            if exists:
+                raise DuplicateNameError(name)
+
+        candidates = self.units(source_url).with_entities(BuildUnit.id)
+        for (bunit_id,) in candidates.limit(self.CLAIM_ATTEMPTS):
+            values = {BuildUnit.build_state: BuildStateEnum.provisioning}
+            if name:
+                values[BuildUnit.name] = name
+                values[BuildUnit.sort_key] = natural_sort_key(name)
+            if self._take(bunit_id, values):
+                self.logger.info('Claimed pooled build unit %s' % bunit_id)
+                bunit = self.session.query(BuildUnit).get(bunit_id)
+                self.session.refresh(bunit)
+                return bunit
+        return None
+
+    def _add_unit(self):
+        allocator = self.allocator
+        bunit = allocator.allocate(source_url=self._conf['source_url'],
+                                   name='')
+        try:
+            allocator.set_build_state(bunit, BuildStateEnum.provisioning)
+            allocator.populate(bunit, conf=self._conf,
+                               timer=allocator.timer(bunit))
+            allocator.set_build_state(bunit, BuildStateEnum.pooled)
+        except Exception as e:
+            self.logger.error('Could not populate pooled unit: %s' % e)
+            allocator.destroy(bunit, commit=True)
+            raise ProvisionError(e) from e
+        return bunit
+
+    def fill(self, blocking=False):
+        """Allocates and populates units until the pool is full."""
+        added = []
+        try:
+            with utils.file_lock(config.pool.lock_file, blocking=blocking):
+                self.allocator.setup()
+                source_url = self._conf['source_url']
+                while self.units(source_url).count() < self.size:
+                    added.append(self._add_unit())
+                    self.logger.info('Pooled build unit %s (%d/%d)' % (
+                        added[-1].id, len(added), self.size))
+        except utils.LockBusyError as e:
+            raise PoolBusyError() from e
+        return added
+
+    def drain(self, count=None):
+        """Destroys pooled units, all of them unless count is given."""
+        drained = []
+        candidates = self.units().with_entities(BuildUnit.id)
+        if count is not None:
+            candidates = candidates.limit(count)
+        for (bunit_id,) in candidates.all():
+            # Claim before destroying so concurrent claimers skip it
+            if not self._take(bunit_id, {
+                BuildUnit.build_state: BuildStateEnum.failed
+            }):
+                continue
+            bunit = self.session.query(BuildUnit).get(bunit_id)
+            self.allocator.destroy(bunit, commit=True)
+            drained.append(bunit_id)
+        return drained
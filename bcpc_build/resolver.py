@@ -0,0 +1,165 @@
+"""Finding build units from what operators type.
+
+An identifier is any of:
+
+- a full unit id;
+- a unique prefix of one, of at least MIN_PREFIX hex digits, like git's
+  short commit ids;
+- an exact unit name;
+- a shell-style glob of names, such as ``chef-bcpc.*``.
+
+Any number of identifiers are resolved in one query. Id prefixes become
+range conditions on the primary key. Globs become SQLite's GLOB, or a
+LIKE on their literal start elsewhere, either of which the name index
+can serve.
+"""
+from fnmatch import fnmatchcase
+import re
+import uuid
+
+import sqlalchemy as sa
+
+from bcpc_build.build_unit import BuildUnit
+
+MIN_PREFIX = 4
+
+_PREFIX_RE = re.compile(r'^[0-9a-fA-F-]+$')
+_GLOB_CHARS = '*?['
+
+
+class ResolveError(LookupError):
+    def __init__(self, identifier, message):
+        self.identifier = identifier
+        self.message = message
+        super().__init__(message)
+
+
+class UnitNotFoundError(ResolveError):
+    def __init__(self, identifier, message=None):
+        if not message:
+            message = "No such unit with id '%s'" % identifier
+        super().__init__(identifier, message)
+
+
+class AmbiguousUnitError(ResolveError):
+    def __init__(self, identifier, candidates, message=None):
+        self.candidates = candidates
+        if not message:
+            message = "'%s' matches several units: %s" % (
+                identifier, ', '.join(sorted(candidates)))
+        super().__init__(identifier, message)
+
+
+def _as_uuid(identifier):
+    try:
+        return uuid.UUID(identifier)
+    except ValueError:
+        return None
+
+
+def _id_prefix(identifier):
+    """Hex digits of identifier if it may be an id prefix, or None."""
+    if not _PREFIX_RE.match(identifier):
+        return None
+    digits = identifier.replace('-', '').lower()
+    if not MIN_PREFIX <= len(digits) < 32:
+        return None
+    return digits
+
+
+def _literal_start(glob):
+    for i, c in enumerate(glob):
+        if c in _GLOB_CHARS:
+            return glob[:i]
+    return glob
+
+
+class _Identifier(object):
+    def __init__(self, text):
+        self.text = text
+        self.glob = any(c in text for c in _GLOB_CHARS)
+        self.uuid = None if self.glob else _as_uuid(text)
+        self.prefix = None
+        if not self.glob and self.uuid is None:
+            self.prefix = _id_prefix(text)
+
+    def condition(self, dialect):
+        if self.glob:
+            if dialect == 'sqlite':
+                # Negated sets are written [^...] in GLOB
+                return BuildUnit.name.op('GLOB')(
+                    self.text.replace('[!', '[^'))
+            # Narrowed down to the exact glob by matches()
+            return BuildUnit.name.startswith(_literal_start(self.text),
+                                             autoescape=True)
+        conds = [BuildUnit.name == self.text]
+        if self.uuid is not None:
+            conds.append(BuildUnit.id == self.uuid)
+        if self.prefix is not None:
+            conds.append(BuildUnit.id.between(
+                uuid.UUID(self.prefix.ljust(32, '0')),
+                uuid.UUID(self.prefix.ljust(32, 'f'))))
+        return sa.or_(*conds)
+
+    def matches(self, unit):
+        """Ranks how unit matches: 2 exactly, 1 by id prefix, else 0."""
+        if self.glob:
+            return 2 if fnmatchcase(unit.name, self.text) else 0
+        if unit.name == self.text or unit.id == self.uuid:
+            return 2
+        if self.prefix is not None and unit.id.hex.startswith(self.prefix):
+            return 1
+        return 0
+
+
+def resolve(session, identifiers, query=None):
+    """Rows of query for the units named by identifiers, in one query.
+
+    query defaults to all units; its first entity must be BuildUnit.
+    Rows come in the order of the identifiers, globs matching in
+    name order, and each unit only once. An identifier other than a glob
+    must name exactly one unit: an exact name or id is preferred to id
+    prefixes, and a prefix shared by several units is ambiguous. Globs
+    may match nothing.
+    """
+    idents = [_Identifier(text) for text in identifiers]
+    if not idents:
+        return []
+    if query is None:
+        query = session.query(BuildUnit)
+    dialect = session.get_bind().dialect.name
+    rows = query.filter(
+        sa.or_(*[i.condition(dialect) for i in idents])
+    ).order_by(BuildUnit.sort_key).all()
+
+    def unit_of(row):
+        return row if isinstance(row, BuildUnit) else row[0]
+
+    resolved, seen = [], set()
+    for ident in idents:
+        ranked = [(ident.matches(unit_of(row)), row) for row in rows]
+        best = max([rank for rank, _ in ranked] or [0])
+        matched = [row for rank, row in ranked if rank and rank == best]
+        if not ident.glob:
+            if not matched:
+                raise UnitNotFoundError(ident.text)
+            if len(matched) > 1:
+                raise AmbiguousUnitError(
+                    ident.text, [str(unit_of(r).id) for r in matched])
+        for row in matched:
+            unit_id = unit_of(row).id
+            if unit_id not in seen:
+                seen.add(unit_id)
+                resolved.append(row)
+    return resolved
+
+
+def resolve_one(session, identifier):
+    """The one unit identifier names; a glob must match exactly one."""
+    units = resolve(session, [identifier])
+    if not units:
+        raise UnitNotFoundError(identifier)
+    if len(units) > 1:
+        raise AmbiguousUnitError(identifier,
+                                 [str(u.id) for u in units])
+    return units[0]
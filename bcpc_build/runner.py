@@ -0,0 +1,200 @@
+"""Drives the builds of many units from one process with asyncio.
+
+Each build runs the (target, command) pairs of its allocator as
+subprocesses of a single event loop, at most ``max_concurrent`` units at
+a time. Build states, checkpoints and phase timings are recorded exactly
+as for a build run with ``unit build --wait``.
+"""
+from collections import OrderedDict
+import asyncio
+import contextlib
+import logging
+import shlex
+import signal
+import subprocess
+import time
+
+import psutil
+
+from bcpc_build.build_unit import BuildLogger
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.db import utils as dbutils
+from bcpc_build.exceptions import BuildError
+from bcpc_build.exceptions import NonZeroExit
+from bcpc_build.exceptions import SignalException
+from bcpc_build.utils.stream import OutputRecord
+from bcpc_build.utils.stream import STDERR
+from bcpc_build.utils.stream import STDOUT
+from bcpc_build import checkpoint
+from bcpc_build import config
+
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def terminate_tree(pid):
+    """Sends SIGTERM to pid and its descendants without reaping them."""
+    try:
+        parent = psutil.Process(pid)
+        procs = parent.children(recursive=True) + [parent]
+    except psutil.NoSuchProcess:
+        return
+    for p in procs:
+        with contextlib.suppress(psutil.NoSuchProcess):
+            p.terminate()
+
+
+class AsyncBuildRunner(object):
+    # Builds print long lines; asyncio's default limit is 64 KiB
+    LINE_LIMIT = 1024 * 1024
+    KILL_TIMEOUT = 10
+
+    def __init__(self, session=None, max_concurrent=None, echo=None):
+        self._session = session
+        if max_concurrent is None:
+            max_concurrent = config.scheduler.max_concurrent
+        self.max_concurrent = int(max_concurrent)
+        # Called with (bunit, record) for every line of output
+        self.echo = echo
+        self.results = OrderedDict()
+        self._tasks = OrderedDict()
+        self._semaphore = None
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = dbutils.Session()
+        return self._session
+
+    def get_allocator(self, strategy):
+        return BuildUnitAllocator.get_allocator(
+            {'strategy': strategy}, session=self.session
+        )
+
+    async def _read(self, bunit, reader, stream, blogger):
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                break
+            line = raw.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+            record = OutputRecord(time.time(), stream, line)
+            blogger.echo(record)
+            if self.echo:
+                self.echo(bunit, record)
+
+    async def _run_command(self, bunit, cmd, blogger):
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(cmd), stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            limit=self.LINE_LIMIT
+        )
+        try:
+            await asyncio.gather(
+                self._read(bunit, proc.stdout, STDOUT, blogger),
+                self._read(bunit, proc.stderr, STDERR, blogger),
+            )
+            status = await proc.wait()
+        except asyncio.CancelledError:
+            self.logger.info('Stopping build of %s' % bunit.id)
+            terminate_tree(proc.pid)
+            try:
+                await asyncio.wait_for(proc.wait(), self.KILL_TIMEOUT)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+            raise
+        if status < 0:
+            raise SignalException(status)
+        elif status > 0:
+            raise NonZeroExit(status)
+
+    async def build(self, bunit, strategy, resume=False):
+        """Builds one unit; returns its outcome."""
+        async with self._semaphore:
+            allocator = self.get_allocator(strategy)
+            checkpoints = allocator.checkpoints(bunit)
+            timer = allocator.timer(bunit)
+            if not resume:
+                checkpoints.clear(checkpoint.BUILD)
+            allocator.set_build_state(bunit, BuildStateEnum.building)
+            store = allocator.get_log_store(bunit)
+            blogger = BuildLogger(
+                writer=store.writer(append=resume),
+                broadcaster=allocator.get_broadcaster(bunit))
+            try:
+                for target, cmd in allocator.build_commands(bunit):
+                    phase = checkpoint.phase_name(checkpoint.BUILD, target)
+                    if checkpoints.done(phase):
+                        continue
+                    self.logger.debug('Building %s with command `%s`'
+                                      '' % (bunit.id, cmd))
+                    with timer.phase(phase):
+                        await self._run_command(bunit, cmd, blogger)
+                    checkpoints.mark(phase)
+            except asyncio.CancelledError:
+                # Checkpoints are kept, so the build can be resumed
+                allocator.set_build_state(bunit, BuildStateEnum.failed_build)
+                raise
+            except BuildError as e:
+                self.logger.error('Build of %s failed: %s' % (bunit.id, e))
+                allocator.set_build_state(bunit, BuildStateEnum.failed_build)
+                return FAILED
+            except Exception:
+                allocator.set_build_state(bunit, BuildStateEnum.failed)
+                raise
+            finally:
+                blogger.close()
+            allocator.set_build_state(bunit, BuildStateEnum.done)
+            return DONE
+
+    async def _run(self, jobs, resume):
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        for bunit, strategy in jobs:
+            self._tasks[bunit.id] = asyncio.ensure_future(
+                self.build(bunit, strategy, resume=resume)
+            )
+        outcomes = await asyncio.gather(*self._tasks.values(),
+                                        return_exceptions=True)
+        for unit_id, outcome in zip(self._tasks, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                outcome = CANCELLED
+            elif isinstance(outcome, BaseException):
+                self.logger.error('Build of %s failed: %s'
+                                  '' % (unit_id, outcome))
+                outcome = FAILED
+            self.results[unit_id] = outcome
+        return self.results
+
+    def cancel(self, unit_id):
+        """Cancels a unit's build, whether waiting or running."""
+        task = self._tasks.get(unit_id)
+        if task is None or task.done():
+            return False
+        return task.cancel()
+
+    def cancel_all(self):
+        for unit_id in self._tasks:
+            self.cancel(unit_id)
+
+    def run(self, jobs, resume=False):
+        """Builds (bunit, strategy) jobs; returns outcomes by unit id.
+
+        SIGINT and SIGTERM cancel all builds.
+        """
+        loop = asyncio.new_event_loop()
+        # Attaches the child watcher on older Pythons
+        asyncio.set_event_loop(loop)
+        try:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self.cancel_all)
+            return loop.run_until_complete(self._run(jobs, resume))
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            asyncio.set_event_loop(None)
+            loop.close()
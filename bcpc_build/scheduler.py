@@ -0,0 +1,334 @@
+"""Persistent build queue and admission scheduler.
+
+Builds requested without ``--wait`` are recorded in the ``build_queue``
+table. A single scheduler process per host starts queued builds, in FIFO
+or priority order, while fewer than ``max_concurrent`` are running.
+Entries belong to the host that queued them, where the unit lives; other
+hosts sharing the database leave them alone.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import socket
+import time
+
+import psutil
+
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.db.migration_types import BuildQueueStateEnum
+from bcpc_build.db.models.build_queue import BuildQueueEntryBase
+from bcpc_build.db import utils as dbutils
+from bcpc_build.exceptions import StateConflictError
+from bcpc_build import capacity
+from bcpc_build import config
+from bcpc_build import utils
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+class SchedulerBusyError(RuntimeError):
+    DEFAULT_MSG = 'Another scheduler is running.'
+
+    def __init__(self, message=DEFAULT_MSG):
+        super().__init__(message)
+
+
+class NoSuchEntryError(ValueError):
+    def __init__(self, entry_id, message=None):
+        self.entry_id = entry_id
+        if not message:
+            message = 'No such queue entry %s' % entry_id
+        self.message = message
+        super().__init__(message)
+
+
+class BuildQueueEntry(BuildQueueEntryBase):
+    _attrs_ = (
+        'id',
+        'unit_id',
+        'strategy',
+        'priority',
+        'state',
+        'host',
+        'pid',
+        'enqueued_at',
+        'started_at',
+        'finished_at',
+    )
+
+    @classmethod
+    def get_json_dict(cls, entry):
+        return OrderedDict(
+            map(lambda k: (k, str(getattr(entry, k))), cls._attrs_)
+        )
+
+    def to_json(self):
+        return json.dumps(self.get_json_dict(self), indent=2)
+
+
+def spawn_scheduler():
+    """Runs the scheduler in a detached process."""
+    return utils.spawn_cli('unit', 'queue', 'run')
+
+
+class BuildScheduler(object):
+    POLICIES = ('fifo', 'priority')
+    ACTIVE_STATES = (BuildQueueStateEnum.queued, BuildQueueStateEnum.running)
+
+    def __init__(self, session=None, max_concurrent=None, policy=None,
+                 admission=None):
+        self._session = session
+        if admission is None:
+            admission = config.scheduler.admission
+        self.admission = admission
+        if max_concurrent is None:
+            max_concurrent = config.scheduler.max_concurrent
+        self.max_concurrent = int(max_concurrent)
+        self.policy = policy or config.scheduler.policy
+        if self.policy not in self.POLICIES:
+            raise ValueError('Unknown scheduling policy %s' % self.policy)
+        self.host = socket.getfqdn()
+        # Builds started by this process, by queue entry id
+        self._procs = {}
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = dbutils.Session()
+        return self._session
+
+    def get(self, entry_id):
+        entry = self.session.query(BuildQueueEntry).get(entry_id)
+        if entry is None:
+            raise NoSuchEntryError(entry_id)
+        return entry
+
+    def enqueue(self, bunit, strategy, priority=0):
+        entry = BuildQueueEntry(unit_id=bunit.id, strategy=strategy,
+                                priority=priority, host=self.host,
+                                state=BuildQueueStateEnum.queued)
+        self.session.add(entry)
+        self.session.commit()
+        self.logger.info('Queued build of %s as entry %d' % (bunit.id,
+                                                             entry.id))
+        return entry
+
+    def entries(self, states=ACTIVE_STATES):
+        q = self.session.query(BuildQueueEntry)
+        if states:
+            q = q.filter(BuildQueueEntry.state.in_(states))
+        return self._order(q)
+
+    def _order(self, q):
+        if self.policy == 'priority':
+            q = q.order_by(BuildQueueEntry.priority.desc())
+        return q.order_by(BuildQueueEntry.enqueued_at, BuildQueueEntry.id)
+
+    def pending(self):
+        """Entries queued on this host."""
+        return self.entries(states=(BuildQueueStateEnum.queued,)).filter(
+            BuildQueueEntry.host == self.host
+        )
+
+    def running(self, host=None):
+        q = self.entries(states=(BuildQueueStateEnum.running,))
+        if host is not None:
+            q = q.filter(BuildQueueEntry.host == host)
+        return q
+
+    def _transition(self, entry_id, from_state, values):
+        """Compare-and-swap on the entry state; True if it applied."""
+        updated = self.session.query(BuildQueueEntry).filter(
+            BuildQueueEntry.id == entry_id,
+            BuildQueueEntry.state == from_state,
+        ).update(values, synchronize_session=False)
+        self.session.commit()
+        return updated == 1
+
+    def cancel(self, entry_id):
+        entry = self.get(entry_id)
+        state = entry.state
+        if state not in self.ACTIVE_STATES:
+            return False
+        values = {
+            BuildQueueEntry.state: BuildQueueStateEnum.cancelled,
+            BuildQueueEntry.finished_at: datetime.utcnow(),
+        }
+        if not self._transition(entry_id, state, values):
+            return False
+        if state == BuildQueueStateEnum.running and entry.pid:
+            if entry.host != self.host:
+                self.logger.warning('Build of entry %d runs on %s; not'
+                                    ' killing it' % (entry_id, entry.host))
+            else:
+                utils.kill_proc_tree(entry.pid)
+                self._fail_build(entry.unit_id)
+        return True
+
+    def _fail_build(self, unit_id):
+        """Marks the unit of a killed build as failed."""
+        bunit = self.session.query(BuildUnit).get(unit_id)
+        if bunit is None or bunit.build_state != BuildStateEnum.building:
+            return
+        allocator = BuildUnitAllocator(session=self.session)
+        try:
+            allocator.set_build_state(bunit, BuildStateEnum.failed_build)
+        except StateConflictError as e:
+            # The build ended on its own meanwhile
+            self.logger.warning(e.message)
+
+    def reprioritize(self, entry_id, priority):
+        self.get(entry_id)
+        return self._transition(entry_id, BuildQueueStateEnum.queued, {
+            BuildQueueEntry.priority: priority
+        })
+
+    def _is_alive(self, entry):
+        proc = self._procs.get(entry.id)
+        if proc is not None:
+            return proc.poll() is None
+        if not entry.pid:
+            return False
+        try:
+            p = psutil.Process(entry.pid)
+            return p.status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def reap(self):
+        """Marks running entries whose build process has exited."""
+        finished = []
+        # Only this host can tell whether its build processes are alive
+        for entry in self.running(host=self.host).all():
+            if self._is_alive(entry):
+                continue
+            proc = self._procs.pop(entry.id, None)
+            if proc is not None:
+                ok = proc.returncode == 0
+            else:
+                bunit = self.session.query(BuildUnit).get(entry.unit_id)
+                ok = (bunit is not None and
+                      bunit.build_state == BuildStateEnum.done)
+            state = (BuildQueueStateEnum.done if ok
+                     else BuildQueueStateEnum.failed)
+            if self._transition(entry.id, BuildQueueStateEnum.running, {
+                BuildQueueEntry.state: state,
+                BuildQueueEntry.finished_at: datetime.utcnow(),
+            }):
+                self.logger.info('Queue entry %d finished: %s'
+                                 '' % (entry.id, state))
+                finished.append(entry)
+        # Collect builds that were cancelled and killed meanwhile
+        for entry_id, proc in list(self._procs.items()):
+            if proc.poll() is not None:
+                del self._procs[entry_id]
+        return finished
+
+    def admit(self, entry):
+        """Whether the host has room for entry's build right now.
+
+        Raises capacity.ExceedsHostError if it never will.
+        """
+        if not self.admission:
+            return True
+        bunit = self.session.query(BuildUnit).get(entry.unit_id)
+        if bunit is None:
+            return True
+        try:
+            capacity.check_admission(self.session, bunit, entry.strategy)
+        except capacity.ExceedsHostError:
+            raise
+        except capacity.InsufficientCapacityError as e:
+            self.logger.info('Deferring queue entry %d: %s' % (entry.id, e))
+            return False
+        return True
+
+    def reject(self, entry, reason):
+        """Fails a queued entry that cannot be built."""
+        if self._transition(entry.id, BuildQueueStateEnum.queued, {
+            BuildQueueEntry.state: BuildQueueStateEnum.failed,
+            BuildQueueEntry.finished_at: datetime.utcnow(),
+        }):
+            self.logger.error('Failed queue entry %d: %s' % (entry.id,
+                                                             reason))
+
+    def start(self, entry):
+        if not self._transition(entry.id, BuildQueueStateEnum.queued, {
+            BuildQueueEntry.state: BuildQueueStateEnum.running,
+            BuildQueueEntry.started_at: datetime.utcnow(),
+            BuildQueueEntry.host: self.host,
+        }):
+            # Cancelled, or taken by another scheduler
+            return None
+        # Admission was checked here; the build must not check again
+        proc = utils.spawn_cli('unit', 'build', '--wait', '--force',
+                               '--strategy', entry.strategy,
+                               str(entry.unit_id))
+        self._procs[entry.id] = proc
+        self._transition(entry.id, BuildQueueStateEnum.running, {
+            BuildQueueEntry.pid: proc.pid
+        })
+        self.logger.info('Started queue entry %d (pid %d)'
+                         '' % (entry.id, proc.pid))
+        return proc
+
+    def schedule(self):
+        """Reaps finished builds and starts queued ones up to the limit."""
+        self.reap()
+        slots = self.max_concurrent - self.running(host=self.host).count()
+        started = []
+        for entry in self.pending().all():
+            if slots <= 0:
+                break
+            try:
+                admitted = self.admit(entry)
+            except capacity.ExceedsHostError as e:
+                # Waiting would hold up every entry behind it forever
+                self.reject(entry, e)
+                continue
+            if not admitted:
+                # Keep ordering: later entries must not overtake
+                break
+            if self.start(entry):
+                started.append(entry)
+                slots -= 1
+        return started
+
+    def busy(self):
+        """Whether builds are queued or running on this host."""
+        return bool(self.pending().count() or
+                    self.running(host=self.host).count())
+
+    def run(self, interval=None):
+        """Schedules until nothing is queued and this host's builds ended.
+
+        Raises SchedulerBusyError if another scheduler is running.
+        """
+        if interval is None:
+            interval = config.scheduler.interval
+        first = True
+        while True:
+            try:
+                with utils.file_lock(config.scheduler.lock_file,
+                                     blocking=False):
+                    while True:
+                        self.schedule()
+                        if not self.busy():
+                            break
+                        time.sleep(interval)
+            except utils.LockBusyError as e:
+                if first:
+                    raise SchedulerBusyError() from e
+                # The scheduler that took the lock runs the queue now
+                return
+            first = False
+            # A scheduler spawned for an entry queued while the lock was
+            # still held gave up; that entry is ours to run
+            if not self.pending().count():
+                return
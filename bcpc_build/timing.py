@@ -0,0 +1,121 @@
+"""Timings of build phases, recorded in the ``build_phase_event`` table."""
+from collections import OrderedDict
+from datetime import datetime
+import contextlib
+import logging
+import math
+import socket
+import threading
+
+from bcpc_build.db.models.build_phase_event import BuildPhaseEventBase
+from bcpc_build.db import utils as dbutils
+
+# Phase names; per-item phases are '<prefix>:<item>'
+ALLOCATE = 'allocate'
+USERADD = 'useradd'
+CLONE = 'clone'
+CONFIGURE = 'configure'
+NETIDS = 'netids'
+INSTALL_CERTS = 'install_certs'
+BUILD = 'build'
+
+
+def exit_status(exc):
+    """Best guess at the exit status a failed phase corresponds to."""
+    if isinstance(exc, SystemExit):
+        return exc.code if isinstance(exc.code, int) else 1
+    for attr in ('returncode', 'code', 'signal'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return 1
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted, non-empty list."""
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class PhaseTimer(object):
+    """Times phases of one build unit.
+
+    Events are buffered until the unit is known (allocation creates it
+    only at the end) and are only written from the thread that created
+    the timer, as sessions are not thread-safe. Phases timed in other
+    threads are written by the next flush().
+    """
+
+    def __init__(self, session, unit_id=None):
+        self.session = session
+        self.unit_id = unit_id
+        self.host = socket.getfqdn()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._owner = threading.current_thread()
+        self.logger = logging.getLogger(__name__)
+
+    def bind(self, unit_id):
+        self.unit_id = unit_id
+        self.flush()
+
+    def flush(self):
+        if self.unit_id is None:
+            return
+        with self._lock:
+            events, self._pending = self._pending, []
+        if not events:
+            return
+        for event in events:
+            event.unit_id = self.unit_id
+            self.session.add(event)
+        dbutils.commit(self.session)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        event = BuildPhaseEventBase(phase=name, host=self.host,
+                                    started_at=datetime.utcnow())
+        try:
+            yield event
+            event.exit_status = 0
+        except BaseException as e:
+            event.exit_status = exit_status(e)
+            raise
+        finally:
+            event.finished_at = datetime.utcnow()
+            self.logger.debug('Phase %s took %.3fs (status %s)' % (
+                name, event.duration, event.exit_status))
+            with self._lock:
+                self._pending.append(event)
+            if threading.current_thread() is self._owner:
+                self.flush()
+
+
+def unit_events(session, unit_id):
+    return session.query(BuildPhaseEventBase).filter(
+        BuildPhaseEventBase.unit_id == unit_id
+    ).order_by(BuildPhaseEventBase.started_at, BuildPhaseEventBase.id)
+
+
+def phase_stats(session, successful=True, since=None):
+    """Duration percentiles of each phase across all units."""
+    q = session.query(BuildPhaseEventBase).filter(
+        BuildPhaseEventBase.finished_at.isnot(None)
+    )
+    if successful:
+        q = q.filter(BuildPhaseEventBase.exit_status == 0)
+    if since is not None:
+        q = q.filter(BuildPhaseEventBase.started_at >= since)
+    durations = {}
+    for event in q:
+        durations.setdefault(event.phase, []).append(event.duration)
+    stats = OrderedDict()
+    for phase in sorted(durations):
+        values = sorted(durations[phase])
+        stats[phase] = OrderedDict([
+            ('count', len(values)),
+            ('p50', percentile(values, 50)),
+            ('p95', percentile(values, 95)),
+            ('max', values[-1]),
+        ])
+    return stats
@@ -1,14 +1,34 @@
 from abc import ABC
 from abc import abstractmethod
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from configparser import Error as ConfigParserError
 from shutil import copy2
 import contextlib
+import io
 import json
 import os.path
+import re
+import stat
+import threading
 import yaml
 import warnings
 
+from bcpc_build import config
+
+# libyaml's parser when PyYAML was built with it
+_YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_EXTENSIONS = {
+    '.json': 'json',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.ini': 'ini',
+}
+_INI_SECTION_RE = re.compile(r'^\[[^\[\]{}",]+\]$')
+
 
 class ConfigurationError(Exception):
     pass
@@ -24,28 +44,114 @@ class DecodeError(ValueError):
 
 def ConfigFile(name, filename):
     """Factory for <Type>ConfigFile objects."""
-    def _reorder(key):
-        key, cls = key
+    fmt, contents = load_config(filename)
+    return dict(AVAILABLE_FORMATS)[fmt](name, filename, contents=contents)
+
+
+def _guess_formats(filename, text):
+    """Formats to try parsing text as, most likely first."""
+    guessed = []
+    ext = os.path.splitext(filename)[-1].lower()
+    if ext in _EXTENSIONS:
+        guessed.append(_EXTENSIONS[ext])
+    lines = text.lstrip().splitlines()
+    first = lines[0].strip() if lines else ''
+    if _INI_SECTION_RE.match(first):
+        guessed.append('ini')
+    elif first[:1] in ('{', '['):
+        guessed.append('json')
+    elif first:
+        guessed.append('yaml')
+    # JSON is also YAML, so JSON is tried first
+    guessed.extend(fmt for fmt, _ in AVAILABLE_FORMATS)
+    return list(OrderedDict.fromkeys(guessed))
+
+
+def _parse(filename, text):
+    loaders = dict((fmt, cls.get_loader()) for fmt, cls in AVAILABLE_FORMATS)
+    for fmt in _guess_formats(filename, text):
+        try:
+            return fmt, loaders[fmt](io.StringIO(text))
+        except DecodeError:
+            continue
+    raise UnknownConfigFileFormat(filename)
 
-        ext = os.path.splitext(filename)[-1]
 
-        def ext_to_key():
-            return ext[1:] if ext.startswith('.') else ext
+def _copy(obj):
+    """Copies parsed contents; much cheaper than copy.deepcopy()."""
+    if isinstance(obj, dict):
+        return dict((k, _copy(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [_copy(v) for v in obj]
+    if isinstance(obj, set):
+        return set(obj)
+    return obj
 
-        if ext_to_key() == key:
-            return 0
-        return 1
 
-    order = sorted(AVAILABLE_FORMATS, key=_reorder)
-    for fmt, cls in order:
-        open_fn = cls.get_loader()
-        try:
-            with open(filename) as f:
-                return cls(name, filename, contents=open_fn(f))
-        except DecodeError:
-            continue
+class _ContentCache(object):
+    """Parsed configuration files, least recently used dropped first.
 
-    raise UnknownConfigFileFormat(filename)
+    Entries are keyed on path and only used while the file's
+    modification time, size and inode are unchanged.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, stamp):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != stamp:
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, stamp, value):
+        with self._lock:
+            self._entries[path] = (stamp, value)
+            self._entries.move_to_end(path)
+            while len(self._entries) > max(config.unit.config_cache_size,
+                                           0):
+                self._entries.popitem(last=False)
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = _ContentCache()
+
+
+def _stamp(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def load_config(filename):
+    """Format and contents of a configuration file.
+
+    The file is parsed once while it is unchanged; each call returns its
+    own copy of the contents. The format is taken from the extension,
+    or guessed from how the file starts.
+    """
+    path = os.path.abspath(filename)
+    value = _cache.get(path, _stamp(os.stat(path)))
+    if value is None:
+        with open(path) as f:
+            # What was read, even if the file is replaced meanwhile
+            stamp = _stamp(os.fstat(f.fileno()))
+            text = f.read()
+        value = _parse(filename, text)
+        _cache.put(path, stamp, value)
+    fmt, contents = value
+    return fmt, _copy(contents)
 
 
 def ini_load(fp):
@@ -80,11 +186,11 @@ def json_load(fp):
 def yaml_load(fp):
     """Thin wrapper around yaml.load()."""
     try:
-        obj = yaml.load(fp)
+        obj = yaml.load(fp, Loader=_YAMLLoader)
         if obj is None:
             raise DecodeError(fp)
         return obj
-    except yaml.parser.ParserError as e:
+    except yaml.YAMLError as e:
         raise DecodeError(fp) from e
 
 
@@ -104,15 +210,12 @@ class _ConfigFile(ABC):
         return self._contents
 
     def refresh(self, contents=None):
-        if contents is None:
-            # TODO(kmidzi): is copy necessary?
-            self._contents = contents.copy()
+        if contents is not None:
+            self._contents = contents
             return
 
         try:
-            with open(self.filename, 'r') as f:
-                loader = self.get_loader()
-                self._contents = loader(f)
+            self._contents = load_config(self.filename)[1]
         except Exception as e:
             raise Exception('Could not initialize contents.') from e
 
@@ -154,6 +257,9 @@ class _ConfigFile(ABC):
         with open(self.filename, 'w') as f:
             self._dump(f)
             f.flush()
+        # Rewritten in place, the file may keep its size, and its mtime
+        # if the clock has not ticked since it was parsed
+        _cache.discard(os.path.abspath(self.filename))
 
     @contextlib.contextmanager
     def flush(self):
@@ -225,6 +331,81 @@ class ConfigHandler(ABC):
         return self._configs
 
 
+class LazyConfigFiles(Mapping):
+    """ConfigFile objects by key, each parsed on first access.
+
+    The paths are only stat()ed up front; keys are those naming regular
+    files. An accessed file is parsed once and the same object returned
+    from then on, so edits through it are seen by later lookups.
+    """
+
+    def __init__(self, paths):
+        self._paths = OrderedDict()
+        for key, filename in paths:
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                # Dangling links
+                continue
+            if stat.S_ISREG(st.st_mode):
+                self._paths[key] = filename
+        self._files = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        filename = self._paths[key]
+        with self._lock:
+            conf = self._files.get(key)
+            future = self._pending.get(key)
+        if conf is not None:
+            return conf
+        if future is not None:
+            return future.result()
+        return self._load(key, filename)
+
+    def __contains__(self, key):
+        return key in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def loaded(self):
+        """Keys of the files parsed so far."""
+        with self._lock:
+            return set(self._files)
+
+    def _load(self, key, filename):
+        try:
+            conf = ConfigFile(key, filename)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        with self._lock:
+            return self._files.setdefault(key, conf)
+
+    def prefetch(self, keys=None, workers=None):
+        """Starts parsing keys, by default all, in a thread pool.
+
+        Keys not in the mapping are ignored. Returns at once; looking up
+        a key still being parsed waits for it.
+        """
+        keys = list(self._paths if keys is None else keys)
+        workers = workers or config.unit.config_prefetch_workers
+        executor = ThreadPoolExecutor(max_workers=workers)
+        with self._lock:
+            for key in keys:
+                if (key not in self._paths or key in self._files or
+                        key in self._pending):
+                    continue
+                self._pending[key] = executor.submit(
+                    self._load, key, self._paths[key])
+        executor.shutdown(wait=False)
+
+
 class ComponentConfigHandler(ConfigHandler):
     """Handles configuration of build component."""
 
@@ -236,17 +417,14 @@ class ComponentConfigHandler(ConfigHandler):
         )
 
     def _gather_config_files(self, component, parent):
-        enumerator = COMPONENT_CONFIG_FILE_PATHS.get(component, lambda _: None)
-        return {
-            key: ConfigFile(key, filename)
-            for key, filename in enumerator(parent)
-        }
+        enumerator = COMPONENT_CONFIG_FILE_PATHS.get(component, lambda _: ())
+        return LazyConfigFiles(enumerator(parent))
 
     def enumerate_nets(self):
         if self.parent is None:
             return set()
 
-        _extract_nets = _get_net_extractor(self.component, self.parent)
+        _extract_nets = _get_net_extractor(self.component, self.configs)
         yield from set(_extract_nets())
 
     @property
@@ -254,13 +432,8 @@ class ComponentConfigHandler(ConfigHandler):
         return self._config_files
 
 
-def _get_net_extractor(component, parent):
+def _get_net_extractor(component, configs):
     """Returns the relevant network configuration extractor."""
-    enumerator = COMPONENT_CONFIG_FILE_PATHS.get(component, lambda _: None)
-    configs = {
-        key: ConfigFile(key, filename)
-        for key, filename in enumerator(parent)
-    }
 
     def _extract_bcpc_nets():
         filename = 'topology/topology.yml'
@@ -302,7 +475,7 @@ def _get_net_extractor(component, parent):
         'chef-bcpc': _extract_bcpc_nets,
     }
 
-    return _mapping.get(component, lambda _: [])
+    return _mapping.get(component, lambda: [])
 
 
 def _enumerate_chef_bcpc_config_paths(parent):
@@ -1,8 +1,13 @@
+import contextlib
+import fcntl
 import shlex
 import os
 import signal
 import psutil
 import logging
+import subprocess
+import sys
+from pathlib import Path
 from subprocess import check_output
 from os.path import abspath
 
@@ -12,6 +17,8 @@ from .vbox import _init_vbox_sysprops_from_system
 
 
 __all__ = [
+    'LockBusyError',
+    'file_lock',
     'generate_netids',
     'generate_netids_from_system',
     'kill_proc_tree',
@@ -19,6 +26,7 @@ __all__ = [
     'netid_from_name',
     'proc_info',
     'set_log_level',
+    'spawn_cli',
     'useradd',
     'userdel',
 ]
@@ -98,6 +106,38 @@ def useradd(username, *args, **kwargs):
 logger = logging.getLogger(__name__)
 
 
+class LockBusyError(RuntimeError):
+    pass
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """Holds an exclusive flock on path for the duration of the context."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError as e:
+            raise LockBusyError(path) from e
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def spawn_cli(*args):
+    """Runs a bcpc-build subcommand in a detached process."""
+    cmd = [sys.executable, '-m', 'bcpc_build.cmd.main'] + list(args)
+    logger.debug('Spawning `%s`' % ' '.join(cmd))
+    return subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
 # https://psutil.readthedocs.io/en/latest/#kill-process-tree
 def kill_proc_tree(
     pid,
@@ -0,0 +1,115 @@
+"""Cheap copies of build trees."""
+from grp import getgrnam
+from pwd import getpwnam
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+_REFLINK_UNSUPPORTED = (
+    errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM,
+)
+
+
+def reflink(src, dst):
+    """Clones src to dst sharing extents (btrfs, xfs, ...)."""
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+
+def is_immutable_git_object(path):
+    """Whether path is a git object file, which git never rewrites."""
+    parts = path.split(os.sep)
+    try:
+        i = len(parts) - 1 - parts[::-1].index('objects')
+    except ValueError:
+        return False
+    return i > 0 and parts[i - 1] == '.git' and parts[-1] != 'alternates'
+
+
+class CowCopier(object):
+    """copy_function for shutil.copytree preferring shared storage.
+
+    Files are reflinked where the filesystem supports it. Otherwise git
+    object files are hardlinked, and everything else is copied. Paths
+    that were hardlinked are recorded in ``linked``: they share an inode
+    with the source, so their ownership must not be changed.
+    """
+
+    def __init__(self, hardlink=True):
+        self.hardlink = hardlink
+        self.use_reflink = True
+        self.linked = set()
+        self.stats = dict(reflinked=0, linked=0, copied=0)
+
+    def __call__(self, src, dst, *args, **kwargs):
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        if self.use_reflink:
+            try:
+                reflink(src, dst)
+                self.stats['reflinked'] += 1
+                return dst
+            except OSError as e:
+                if e.errno not in _REFLINK_UNSUPPORTED:
+                    raise
+                logger.debug('Reflinks unsupported (%s); falling back' % e)
+                self.use_reflink = False
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(dst)
+        if self.hardlink and is_immutable_git_object(src):
+            try:
+                os.link(src, dst)
+                self.linked.add(dst)
+                self.stats['linked'] += 1
+                return dst
+            except OSError as e:
+                logger.debug('Hardlink of %s failed: %s' % (src, e))
+        shutil.copy2(src, dst)
+        self.stats['copied'] += 1
+        return dst
+
+
+def clone_tree(src, dst, ignore=None, top_ignore=(), hardlink=True):
+    """Clones the contents of src into the existing directory dst.
+
+    top_ignore names entries of src itself that are not cloned. Returns
+    the CowCopier used, so callers can inspect what was linked.
+    """
+    copier = CowCopier(hardlink=hardlink)
+    for entry in os.listdir(src):
+        if entry in top_ignore:
+            continue
+        s = os.path.join(src, entry)
+        d = os.path.join(dst, entry)
+        if os.path.isdir(s) and not os.path.islink(s):
+            shutil.copytree(s, d, symlinks=True, ignore=ignore,
+                            copy_function=copier)
+        else:
+            if os.path.lexists(d):
+                os.unlink(d)
+            if os.path.islink(s):
+                os.symlink(os.readlink(s), d)
+            else:
+                copier(s, d)
+    return copier
+
+
+def chown_tree(path, user, group, skip=()):
+    """Recursively chowns path, leaving the paths in skip alone."""
+    uid = getpwnam(user).pw_uid
+    gid = getgrnam(group).gr_gid
+    os.lchown(path, uid, gid)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            p = os.path.join(root, name)
+            if p not in skip:
+                os.lchown(p, uid, gid)
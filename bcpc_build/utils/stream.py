@@ -0,0 +1,65 @@
+"""Event-driven reading of subprocess output."""
+from collections import namedtuple
+import os
+import selectors
+import time
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+READ_SIZE = 64 * 1024
+
+
+class OutputRecord(namedtuple('OutputRecord', ['timestamp', 'stream',
+                                               'line'])):
+    """One line of output, tagged with its stream and arrival time."""
+    __slots__ = ()
+
+    def __str__(self):
+        return self.line
+
+
+def iter_output(proc, encoding='utf-8'):
+    """Yields OutputRecords from proc's stdout and stderr pipes.
+
+    Both pipes are read without blocking as data arrives, so neither
+    can fill up and stall the process, and no time is spent polling
+    while it is quiet. Lines are stripped and blank lines skipped.
+    Returns once both pipes are closed; the caller reaps proc.
+    """
+    sel = selectors.DefaultSelector()
+    buffers = {}
+    for stream, pipe in ((STDOUT, proc.stdout), (STDERR, proc.stderr)):
+        if pipe is None:
+            continue
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        sel.register(fd, selectors.EVENT_READ, stream)
+        buffers[fd] = b''
+
+    def records(stream, chunk, now):
+        # chunk ends on a line boundary, so it decodes as a whole
+        for line in chunk.decode(encoding, 'replace').splitlines():
+            line = line.strip()
+            if line:
+                yield OutputRecord(now, stream, line)
+
+    try:
+        while buffers:
+            for key, _ in sel.select():
+                fd, stream = key.fd, key.data
+                try:
+                    data = os.read(fd, READ_SIZE)
+                except BlockingIOError:
+                    continue
+                now = time.time()
+                if not data:
+                    sel.unregister(fd)
+                    yield from records(stream, buffers.pop(fd), now)
+                    continue
+                data = buffers[fd] + data
+                # Hold back an incomplete last line until the rest arrives
+                complete, sep, buffers[fd] = data.rpartition(b'\n')
+                yield from records(stream, complete, now)
+    finally:
+        sel.close()
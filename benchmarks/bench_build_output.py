@@ -0,0 +1,78 @@
+"""Throughput of build output streaming.
+
+Compares the old readline()/poll() loop of _build_with_command with the
+selector-based reader in bcpc_build.utils.stream. Two workloads are run:
+a burst of lines as fast as the child can print them, and a child that
+closes its stdout but keeps running, where the old loop busy-waits.
+The selector reader also returns the stderr lines the old loop dropped.
+
+    python benchmarks/bench_build_output.py [--lines N] [--linger SECONDS]
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from bcpc_build.utils.stream import iter_output
+
+BURST = ('import sys\n'
+         'for i in range({lines}):\n'
+         '    print("TASK [role : step %d] ok: [vm1] => changed=false" % i)\n'
+         '    if i % 10 == 0:\n'
+         '        print("warning: line %d" % i, file=sys.stderr)\n')
+LINGER = ('import os, sys, time\n'
+          'print("done", flush=True)\n'
+          'os.close(sys.stdout.fileno())\n'
+          'os.close(sys.stderr.fileno())\n'
+          'time.sleep({linger})\n')
+
+
+def legacy(cmd):
+    # The loop as it was before the selector-based reader
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL,
+                            universal_newlines=True)
+    while True:
+        output = proc.stdout.readline().strip()
+        status = proc.poll()
+        if output == '' and status is not None:
+            break
+        if output:
+            yield output
+
+
+def selector(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    yield from iter_output(proc)
+    proc.wait()
+
+
+def measure(reader, cmd):
+    wall, cpu = time.perf_counter(), time.process_time()
+    count = sum(1 for _ in reader(cmd))
+    return count, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--linger', type=float, default=2.0)
+    args = parser.parse_args()
+
+    workloads = (
+        ('burst', BURST.format(lines=args.lines)),
+        ('linger', LINGER.format(linger=args.linger)),
+    )
+    print('{:8} {:9} {:>8} {:>8} {:>8} {:>10}'.format(
+        'workload', 'reader', 'lines', 'wall s', 'cpu s', 'lines/s'))
+    for name, script in workloads:
+        cmd = [sys.executable, '-c', script]
+        for reader in (legacy, selector):
+            count, wall, cpu = measure(reader, cmd)
+            print('{:8} {:9} {:>8} {:>8.2f} {:>8.2f} {:>10.0f}'.format(
+                name, reader.__name__, count, wall, cpu, count / wall))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Loading the configuration files of a chef-bcpc checkout.
+
+Loads every file configure enumerates under virtual/topology,
+chef/environments and chef/roles. The legacy loader is the ConfigFile
+factory as it was: formats tried in turn, reopening the file for each,
+with PyYAML's pure Python loader, and the file read once more by
+refresh(). The cold pass uses bcpc_build.unit.ConfigFile on an empty
+cache, the warm pass again on the unchanged files.
+
+Then what configure reads is timed from an empty cache: the topology
+through V8ConfigHandler, which parses files on access, against
+parsing every file up front as the handler used to.
+
+Without --tree a checkout is generated, with a topology of --nodes
+hosts and as many roles and environments as a large deployment has.
+
+    python benchmarks/bench_config_files.py [--tree CHECKOUT] [--nodes N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import types
+
+import yaml
+
+from bcpc_build import unit
+
+
+def legacy_config_file(name, filename):
+    ext = os.path.splitext(filename)[-1][1:]
+    order = sorted(unit.AVAILABLE_FORMATS, key=lambda f: f[0] != ext)
+    for fmt, cls in order:
+        try:
+            with open(filename) as f:
+                if fmt == 'yaml':
+                    contents = yaml.load(f, Loader=yaml.FullLoader)
+                    if contents is None:
+                        raise unit.DecodeError(f)
+                else:
+                    contents = cls.get_loader()(f)
+        except (unit.DecodeError, yaml.YAMLError):
+            continue
+        # refresh() read the file again
+        with open(filename) as f:
+            f.read()
+        return contents
+    raise unit.UnknownConfigFileFormat(filename)
+
+
+def current_config_file(name, filename):
+    return unit.ConfigFile(name, filename).contents
+
+
+def generate(root, nodes):
+    base = os.path.join(root, 'chef-bcpc')
+    topology = os.path.join(base, 'virtual', 'topology')
+    os.makedirs(topology)
+    hosts = [{
+        'host': 'r%dn%d' % (i // 16, i),
+        'group': 'worknodes' if i % 8 else 'headnodes',
+        'host_vars': {'interfaces': {
+            'transit': [{'ip': '10.%d.%d.%d/31' % (j, i // 250, i % 250),
+                         'neighbor': {'name': 'tor%d-%d' % (i // 16, j),
+                                      'asn': 4200000000 + i // 16}}
+                        for j in range(2)],
+            'service': {'ip': '10.65.%d.%d/32' % (i // 250, i % 250)},
+        }},
+        'hardware_profile': 'profile%d' % (i % 4),
+    } for i in range(nodes)]
+    with open(os.path.join(topology, 'topology.yml'), 'w') as f:
+        yaml.dump({'nodes': hosts}, f)
+    with open(os.path.join(topology, 'hardware.yml'), 'w') as f:
+        yaml.dump({'profiles': dict(('profile%d' % i, {
+            'cpus': 8 * (i + 1), 'ram_gb': 64 * (i + 1),
+            'disks': ['sd%s' % c for c in 'abcdef']}) for i in range(4))}, f)
+    for subdir, count in (('environments', 8), ('roles', 120)):
+        path = os.path.join(base, 'chef', subdir)
+        os.makedirs(path)
+        for i in range(count):
+            doc = {
+                'name': '%s%d' % (subdir[:-1], i),
+                'json_class': 'Chef::Role',
+                'default_attributes': dict(
+                    ('attribute%d' % k, {'enabled': True, 'value': k})
+                    for k in range(40 if subdir == 'roles' else 400)),
+                'run_list': ['recipe[bcpc::%d]' % k for k in range(20)],
+            }
+            with open(os.path.join(path, '%d.json' % i), 'w') as f:
+                json.dump(doc, f, indent=2)
+    return root
+
+
+def enumerate_files(build_path):
+    parent = types.SimpleNamespace(
+        bunit=types.SimpleNamespace(get_build_path=lambda: build_path))
+    return list(unit._enumerate_chef_bcpc_config_paths(parent))
+
+
+def eager_configure(build_path):
+    configs = dict((key, unit.ConfigFile(key, filename))
+                   for key, filename in enumerate_files(build_path))
+    return configs['topology/topology.yml'].contents
+
+
+def lazy_configure(build_path):
+    bunit = types.SimpleNamespace(get_build_path=lambda: build_path)
+    handler = unit.V8ConfigHandler(bunit)
+    configs = handler.configs['chef-bcpc'].configs
+    return configs['topology/topology.yml'].contents
+
+
+def measure(load, files):
+    wall, cpu = time.perf_counter(), time.process_time()
+    for key, filename in files:
+        load(key, filename)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def run(build_path):
+    files = enumerate_files(build_path)
+    print('{} files'.format(len(files)))
+    print('{:7} {:>8} {:>8}'.format('loader', 'wall s', 'cpu s'))
+    unit._cache.clear()
+    for label, load in (('legacy', legacy_config_file),
+                        ('cold', current_config_file),
+                        ('warm', current_config_file)):
+        print('{:7} {:>8.3f} {:>8.3f}'.format(label, *measure(load, files)))
+    print('{:7} {:>8} {:>8}'.format('handler', 'wall s', 'cpu s'))
+    for label, configure in (('eager', eager_configure),
+                             ('lazy', lazy_configure)):
+        unit._cache.clear()
+        wall, cpu = time.perf_counter(), time.process_time()
+        configure(build_path)
+        print('{:7} {:>8.3f} {:>8.3f}'.format(
+            label, time.perf_counter() - wall, time.process_time() - cpu))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tree', help='directory holding chef-bcpc/')
+    parser.add_argument('--nodes', type=int, default=256)
+    args = parser.parse_args()
+
+    if args.tree:
+        run(args.tree)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        run(generate(tmp, args.nodes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Concurrent build state updates against one SQLite database.
+
+Starts N processes, each flipping the build state of its own unit with
+BuildUnitAllocator.set_build_state, as parallel builders do. The legacy
+setup is a plain engine on a rollback journal with the driver's default
+lock timeout; the shared setup is the engine from bcpc_build.db.utils,
+with WAL, synchronous=NORMAL and a busy timeout.
+
+    python benchmarks/bench_db_contention.py [--procs N] [--updates K]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.db.models.build_unit import Base
+from bcpc_build.db import utils as dbutils
+
+STATES = (BuildStateEnum.building, BuildStateEnum.done)
+
+
+def legacy_engine(url):
+    # As each allocator used to create its own
+    return create_engine(url)
+
+
+def shared_engine(url):
+    return dbutils.get_engine(url)
+
+
+def worker(args):
+    setup, url, name, updates = args
+    session = sessionmaker(bind=setup(url))()
+    allocator = BuildUnitAllocator(session=session)
+    bunit = session.query(BuildUnit).filter(BuildUnit.name == name).one()
+    errors = 0
+    started = time.perf_counter()
+    for i in range(updates):
+        try:
+            allocator.set_build_state(bunit, STATES[i % 2])
+        except OperationalError:
+            # database is locked
+            session.rollback()
+            errors += 1
+    return time.perf_counter() - started, errors
+
+
+def prepare(path, procs):
+    url = 'sqlite:///%s' % path
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for i in range(procs):
+        name = 'unit%d' % i
+        session.add(BuildUnit(name=name, build_user=name,
+                              build_dir='/build/' + name, source_url='x',
+                              build_state=BuildStateEnum.configured))
+    session.commit()
+    session.close()
+    engine.dispose()
+    return url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--procs', type=int, default=16)
+    parser.add_argument('--updates', type=int, default=200)
+    args = parser.parse_args()
+
+    print('{:7} {:>6} {:>8} {:>8} {:>10}'.format(
+        'setup', 'procs', 'wall s', 'errors', 'updates/s'))
+    for setup in (legacy_engine, shared_engine):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = prepare(os.path.join(tmp, 'master.db'), args.procs)
+            jobs = [(setup, url, 'unit%d' % i, args.updates)
+                    for i in range(args.procs)]
+            started = time.perf_counter()
+            with multiprocessing.Pool(args.procs) as pool:
+                results = pool.map(worker, jobs)
+            wall = time.perf_counter() - started
+            errors = sum(e for _, e in results)
+            done = args.procs * args.updates - errors
+            print('{:7} {:>6} {:>8.2f} {:>8} {:>10.0f}'.format(
+                setup.__name__.split('_')[0], args.procs, wall, errors,
+                done / wall))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.db.models.build_unit import Base
+from bcpc_build import history
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import pytest
+
+
+def make_db():
+    """An empty in-memory database, and a session on it."""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    return engine, sessionmaker(bind=engine)()
+
+
+@pytest.fixture
+def session():
+    engine, session = make_db()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def add_unit(session, name, state=None, record=False, **columns):
+    """Adds a unit named name, with a build user of the same name.
+
+    record adds the unit's state to its history too. Other BuildUnit
+    columns may be given in columns.
+    """
+    columns.setdefault('build_user', name)
+    columns.setdefault('build_dir', '/build/' + columns['build_user'])
+    columns.setdefault('source_url', 'x')
+    bunit = BuildUnit(name=name, build_state=state, **columns)
+    session.add(bunit)
+    if record:
+        session.flush()
+        history.record(session, bunit.id, None, state)
+    session.commit()
+    return bunit
@@ -0,0 +1,79 @@
+from bcpc_build.broadcast import META
+from bcpc_build.broadcast import NotBroadcastingError
+from bcpc_build.broadcast import OutputBroadcaster
+from bcpc_build.broadcast import follow
+from bcpc_build.utils.stream import OutputRecord
+import os
+import socket
+import threading
+import time
+import pytest
+
+
+def record(i):
+    return OutputRecord(1000.0 + i, 'stdout', 'line %d' % i)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_late_joiner_gets_history(tmpdir):
+    path = tmpdir.join('unit.sock').strpath
+    with OutputBroadcaster(path, history=3) as broadcaster:
+        for i in range(5):
+            broadcaster.publish(record(i))
+        received = []
+        viewer = threading.Thread(
+            target=lambda: received.extend(follow(path)))
+        viewer.start()
+        wait_for(lambda: len(received) == 3)
+        broadcaster.publish('live')
+        wait_for(lambda: len(received) == 4)
+    viewer.join(5)
+    assert [r.line for r in received] == ['line 2', 'line 3', 'line 4',
+                                          'live']
+    assert received[0] == record(2)
+    assert not os.path.exists(path)
+
+
+def test_slow_viewer_does_not_block(tmpdir):
+    path = tmpdir.join('unit.sock').strpath
+    broadcaster = OutputBroadcaster(path, history=0,
+                                    max_pending=64 * 1024).start()
+    # Never reads, so the socket buffers fill up
+    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    slow.connect(path)
+    wait_for(lambda: len(broadcaster._subscribers) == 1)
+    started = time.time()
+    for i in range(200000):
+        broadcaster.publish(record(i))
+    assert time.time() - started < 30
+    sub = list(broadcaster._subscribers.values())[0]
+    assert sub.pending_bytes <= 64 * 1024
+    slow.setblocking(False)
+    data = b''
+    while True:
+        try:
+            chunk = slow.recv(1 << 20)
+        except BlockingIOError:
+            time.sleep(0.05)
+            continue
+        if not chunk:
+            break
+        data += chunk
+        if b'lines skipped' in data:
+            break
+    slow.close()
+    broadcaster.close()
+    markers = [l for l in data.decode().splitlines()
+               if l.split('\t')[1] == META]
+    assert markers and markers[0].endswith('lines skipped]')
+
+
+def test_follow_without_build(tmpdir):
+    with pytest.raises(NotBroadcastingError):
+        list(follow(tmpdir.join('missing.sock').strpath))
@@ -0,0 +1,133 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.db.models.build_unit import Base
+from bcpc_build.exceptions import IllegalTransitionError
+from bcpc_build.exceptions import StateConflictError
+from bcpc_build import history
+from bcpc_build import timing
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from tests.conftest import add_unit
+import pytest
+
+
+@pytest.fixture
+def Session(tmpdir):
+    """Sessions on one database file, for concurrent writers."""
+    engine = create_engine('sqlite:///%s' % tmpdir.join('master.db'))
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def test_transitions():
+    S = BuildStateEnum
+    assert S.can_transition(None, S.provisioning)
+    assert S.can_transition(S.building, S.done)
+    assert S.can_transition(S.done, S.done)
+    # Anything can fail
+    assert all(S.can_transition(s, S.failed) for s in [None] + list(S))
+    assert not S.can_transition(None, S.done)
+    assert not S.can_transition(S.done, S.pooled)
+
+
+def test_illegal_transition(Session):
+    session = Session()
+    allocator = V8BuildUnitAllocator(session=session)
+    bunit = add_unit(session, 'a', BuildStateEnum.done)
+    with pytest.raises(IllegalTransitionError):
+        allocator.set_build_state(bunit, BuildStateEnum.pooled)
+    allocator.set_build_state(bunit, BuildStateEnum.pooled, force=True)
+    session.expire_all()
+    assert bunit.build_state == BuildStateEnum.pooled
+
+
+def test_concurrent_writers(Session):
+    ours, theirs = Session(), Session()
+    bunit = add_unit(ours, 'a', BuildStateEnum.building)
+    other = theirs.query(BuildUnit).get(bunit.id)
+    V8BuildUnitAllocator(session=theirs).set_build_state(
+        other, BuildStateEnum.failed)
+    with pytest.raises(StateConflictError):
+        V8BuildUnitAllocator(session=ours).set_build_state(
+            bunit, BuildStateEnum.done)
+    # The loser sees what the winner wrote
+    assert bunit.build_state == BuildStateEnum.failed
+    events = history.unit_history(ours, bunit.id).all()
+    assert [e.to_state for e in events] == [BuildStateEnum.failed]
+
+
+def test_batched_states(Session):
+    session = Session()
+    allocator = V8BuildUnitAllocator(session=session)
+    bunit = add_unit(session, 'a', BuildStateEnum.provisioning)
+    with allocator.batched_states():
+        allocator.set_build_state(bunit, BuildStateEnum.configuring)
+        allocator.set_build_state(bunit, BuildStateEnum.configured)
+        # Not visible elsewhere until the batch commits
+        assert Session().query(BuildUnit.build_state).scalar() == (
+            BuildStateEnum.provisioning)
+    assert Session().query(BuildUnit.build_state).scalar() == (
+        BuildStateEnum.configured)
+
+    with pytest.raises(RuntimeError):
+        with allocator.batched_states():
+            allocator.set_build_state(bunit, BuildStateEnum.provisioned)
+            raise RuntimeError()
+    assert bunit.build_state == BuildStateEnum.configured
+
+
+def test_batch_covers_checkpoints_and_timings(Session):
+    session = Session()
+    allocator = V8BuildUnitAllocator(session=session)
+    bunit = add_unit(session, 'a', BuildStateEnum.provisioning)
+    checkpoints = allocator.checkpoints(bunit)
+    timer = allocator.timer(bunit)
+    commits = []
+    event.listen(session, 'after_commit', lambda s: commits.append(1))
+    with pytest.raises(RuntimeError):
+        with allocator.batched_states():
+            allocator.set_build_state(bunit, BuildStateEnum.configuring)
+            with timer.phase('configure'):
+                pass
+            checkpoints.mark('configure')
+            raise RuntimeError()
+    assert commits == []
+    assert bunit.build_state == BuildStateEnum.provisioning
+    assert not checkpoints.done('configure')
+    assert timing.unit_events(session, bunit.id).count() == 0
+
+    with allocator.batched_states():
+        allocator.set_build_state(bunit, BuildStateEnum.configuring)
+        with timer.phase('configure'):
+            pass
+        checkpoints.mark('configure')
+        allocator.set_build_state(bunit, BuildStateEnum.configured)
+    assert commits == [1]
+    other = Session()
+    assert other.query(BuildUnit.build_state).scalar() == (
+        BuildStateEnum.configured)
+    assert timing.unit_events(other, bunit.id).count() == 1
+
+
+def test_configure_not_batched(Session, monkeypatch):
+    session = Session()
+    allocator = V8BuildUnitAllocator(session=session)
+    bunit = add_unit(session, 'a')
+    seen = []
+
+    def configure(bunit, **kwargs):
+        allocator.set_build_state(bunit, BuildStateEnum.configuring)
+        # Other writers are not locked out while configure runs
+        other = Session()
+        seen.append(other.query(BuildUnit.build_state).scalar())
+        add_unit(other, 'b')
+        allocator.set_build_state(bunit, BuildStateEnum.configured)
+
+    monkeypatch.setattr(allocator, 'configure', configure)
+    monkeypatch.setattr(allocator, '_reset_config', lambda bunit: None)
+    allocator.provision(bunit, populate=False, conf=dict(configure=True))
+    assert seen == [BuildStateEnum.configuring]
+    assert bunit.build_state == BuildStateEnum.provisioned
+    assert allocator.checkpoints(bunit).done('configure')
@@ -0,0 +1,181 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.capacity import ExceedsHostError
+from bcpc_build.capacity import Footprint
+from bcpc_build.capacity import InsufficientCapacityError
+from bcpc_build.capacity import V8_NODE_DEFAULT
+from bcpc_build.capacity import default_footprint
+from bcpc_build.capacity import parse_shell_exports
+from bcpc_build.capacity import v7_footprint
+from bcpc_build.capacity import v8_footprint
+from bcpc_build.db.migration_types import BuildQueueStateEnum
+from bcpc_build.db.models.build_queue import BuildQueueEntryBase
+from bcpc_build import capacity
+from bcpc_build import config
+from tests.conftest import add_unit
+import collections
+import os
+import pytest
+import yaml
+
+HOST = 'build1.example.com'
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def footprints(monkeypatch):
+    """Footprints by unit name, one cpu per unit by default."""
+    footprints = {}
+    monkeypatch.setattr(
+        capacity, 'estimate_footprint',
+        lambda bunit, strategy=None: footprints.get(
+            bunit.name, Footprint(1, 0, 0)))
+    monkeypatch.setattr(capacity.socket, 'getfqdn', lambda: HOST)
+    return footprints
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """A host of 8 cpus, 32G of memory and 100G of disk, 16G in use."""
+    monkeypatch.setattr(config.capacity, 'cpu_overcommit', 1.0)
+    monkeypatch.setattr(config.capacity, 'mem_reserve_mb', 1024)
+    monkeypatch.setattr(config.capacity, 'disk_reserve_mb', 0)
+    mem = collections.namedtuple('mem', 'total available')
+    disk = collections.namedtuple('disk', 'total free')
+    monkeypatch.setattr(capacity.psutil, 'cpu_count', lambda: 8)
+    monkeypatch.setattr(capacity.psutil, 'virtual_memory',
+                        lambda: mem(32768 * MB, 16384 * MB))
+    monkeypatch.setattr(capacity.psutil, 'disk_usage',
+                        lambda path: disk(102400 * MB, 102400 * MB))
+
+
+class FakeUnit(object):
+    id = 'fake'
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_build_path(self):
+        return self.path
+
+
+def write_topology(path, topology, hardware):
+    base = os.path.join(path, 'chef-bcpc', 'virtual', 'topology')
+    os.makedirs(base)
+    for name, contents in (('topology.yml', topology),
+                           ('hardware.yml', hardware)):
+        with open(os.path.join(base, name), 'w') as f:
+            f.write(contents if isinstance(contents, str)
+                    else yaml.dump(contents))
+
+
+def add_entry(session, bunit, state, host=HOST):
+    """Adds a queue entry for bunit; returns bunit."""
+    session.add(BuildQueueEntryBase(unit_id=bunit.id, strategy='v8',
+                                    state=state, host=host))
+    session.commit()
+    return bunit
+
+
+def test_v7_footprint():
+    env = parse_shell_exports("""
+        export BOOTSTRAP_VM_CPUS=2
+        export BOOTSTRAP_VM_DRIVE_SIZE=100
+        export BOOTSTRAP_VM_MEM=2048
+        CLUSTER_VM_CPUS="4"
+        export CLUSTER_VM_DRIVE_SIZE=200
+        export CLUSTER_VM_MEM=3072
+        export MONITORING_NODES=1
+    """)
+    assert v7_footprint(env) == Footprint(2 + 4 * 4, 2048 + 3072 * 4,
+                                          100 + 200 * 4)
+
+
+def test_v7_default_footprint():
+    assert default_footprint('v7') == Footprint(8, 11264, 81920)
+
+
+def test_v8_footprint():
+    topology = {'nodes': [
+        {'host': 'bootstrap', 'hardware_profile': 'small'},
+        {'host': 'node1', 'hardware_profile': 'unknown'},
+    ]}
+    hardware = {'profiles': {'small': {'cpus': 1, 'ram_gb': 1.5}}}
+    assert v8_footprint(topology, hardware) == Footprint(
+        1 + V8_NODE_DEFAULT.cpus,
+        1536 + V8_NODE_DEFAULT.mem_mb,
+        V8_NODE_DEFAULT.disk_mb * 2,
+    )
+
+
+def test_count_in():
+    unit = Footprint(4, 1000, 100)
+    assert unit.count_in(Footprint(16, 2500, 1000)) == 2
+    assert unit.count_in(Footprint(16, -10, 1000)) == 0
+    assert unit.fits(Footprint(4, 1000, 100))
+    assert not unit.fits(Footprint(3, 1000, 100))
+
+
+def test_committed_footprint(session, footprints):
+    S, Q = BuildStateEnum, BuildQueueStateEnum
+    units = {}
+    for name, state, entry_state, host in (
+            # Started by this host's scheduler; building or about to
+            ('running', S.provisioned, Q.running, HOST),
+            ('building', S.building, Q.running, HOST),
+            # The scheduler reaped its entry, the build is winding down
+            ('reaped', S.building, Q.failed, HOST),
+            # Other hosts' builds
+            ('remote', S.building, Q.running, 'build2'),
+            ('done', S.done, Q.done, HOST),
+            ('excluded', S.building, Q.running, HOST)):
+        units[name] = add_entry(session, add_unit(session, name, state),
+                                entry_state, host)
+    excluded = units['excluded']
+    assert capacity.committed_footprint(
+        session, exclude=excluded.id) == Footprint(3, 0, 0)
+    assert capacity.committed_footprint(
+        session, host='build2') == Footprint(1, 0, 0)
+
+
+def test_estimate_v8_footprint(tmpdir):
+    write_topology(tmpdir.strpath, {'nodes': [
+        {'host': 'bootstrap', 'hardware_profile': 'small'},
+        {'host': 'node1', 'hardware_profile': 'large'},
+    ]}, {'profiles': {
+        'small': {'cpus': 1, 'ram_gb': 2, 'disk_gb': 10},
+        'large': {'cpus': 4, 'ram_gb': 16, 'disk_gb': 50},
+    }})
+    assert capacity.estimate_footprint(FakeUnit(tmpdir.strpath)) == (
+        Footprint(5, 18432, 61440))
+
+
+def test_estimate_falls_back_to_default(tmpdir):
+    write_topology(tmpdir.strpath, 'nodes: [', {})
+    assert capacity.estimate_footprint(FakeUnit(tmpdir.strpath)) == (
+        default_footprint('v8'))
+    assert capacity.estimate_footprint(
+        FakeUnit(tmpdir.join('missing').strpath), strategy='v7') == (
+        default_footprint('v7'))
+
+
+def test_check_admission(session, footprints, host):
+    S, Q = BuildStateEnum, BuildQueueStateEnum
+    bunit = add_unit(session, 'new', S.provisioned)
+    add_entry(session, add_unit(session, 'running', S.building),
+              Q.running)
+    footprints['running'] = Footprint(4, 8192, 10240)
+    footprints['new'] = Footprint(4, 8192, 10240)
+    # Committed builds and memory in use both count against it
+    assert capacity.check_admission(session, bunit) == Footprint(
+        4, 15360, 92160)
+
+    footprints['new'] = Footprint(4, 16384, 10240)
+    with pytest.raises(InsufficientCapacityError) as e:
+        capacity.check_admission(session, bunit)
+    assert not isinstance(e.value, ExceedsHostError)
+    assert e.value.available == Footprint(4, 15360, 92160)
+
+    footprints['new'] = Footprint(16, 8192, 10240)
+    with pytest.raises(ExceedsHostError) as e:
+        capacity.check_admission(session, bunit)
+    assert e.value.available == Footprint(8, 31744, 102400)
@@ -0,0 +1,75 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.checkpoint import Checkpoints
+from bcpc_build.exceptions import BuildError
+from tests.conftest import add_unit
+import pytest
+
+
+@pytest.fixture
+def allocator(session):
+    return V8BuildUnitAllocator(session=session)
+
+
+@pytest.fixture
+def bunit(session):
+    return add_unit(session, 'u', BuildStateEnum.failed_build,
+                    build_user='chef-bcpc.u')
+
+
+class TestCheckpoints:
+    def test_mark(self, allocator, bunit):
+        checkpoints = Checkpoints(allocator.session, bunit)
+        assert not checkpoints.done('configure')
+        checkpoints.mark('configure')
+        checkpoints.mark('configure')
+        assert checkpoints.done('configure')
+        assert checkpoints.completed() == ['configure']
+
+    def test_clear_prefix(self, allocator, bunit):
+        checkpoints = Checkpoints(allocator.session, bunit)
+        for phase in ('populate:a', 'build:create', 'build:all', 'builder'):
+            checkpoints.mark(phase)
+        checkpoints.clear('build')
+        assert checkpoints.completed() == ['populate:a', 'builder']
+        checkpoints.clear()
+        assert checkpoints.completed() == []
+
+
+class TestResumableBuild:
+    @pytest.fixture
+    def runs(self, allocator, monkeypatch):
+        runs = []
+
+        def build_with_command(bunit, cmd):
+            runs.append(cmd)
+            if 'fail' in cmd:
+                raise BuildError(cmd)
+            yield cmd
+
+        monkeypatch.setattr(allocator, '_build_with_command',
+                            build_with_command)
+        return runs
+
+    def test_resume_skips_completed_targets(self, allocator, bunit, runs):
+        targets = [('create', 'make create'), ('all', 'make fail')]
+        with pytest.raises(BuildError):
+            list(allocator._build_targets(bunit, targets))
+        assert allocator.checkpoints(bunit).completed() == ['build:create']
+
+        targets[1] = ('all', 'make all')
+        del runs[:]
+        list(allocator._build_targets(bunit, targets, resume=True))
+        assert runs == ['make all']
+
+    def test_restart_clears_build_targets(self, allocator, bunit, runs):
+        targets = [('create', 'make create')]
+        list(allocator._build_targets(bunit, targets))
+        list(allocator._build_targets(bunit, targets))
+        assert runs == ['make create'] * 2
+
+    def test_deallocate_removes_checkpoints(self, allocator, bunit):
+        checkpoints = allocator.checkpoints(bunit)
+        checkpoints.mark('configure')
+        allocator._deallocate(bunit)
+        assert checkpoints.completed() == []
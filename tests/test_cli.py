@@ -1,13 +1,32 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build import build_unit
 from bcpc_build.cmd.main import cli as main_cli
+from bcpc_build.cmd import unit as unit_cmd
 from click.testing import CliRunner
+from tests.conftest import add_unit
+from tests.conftest import make_db
 import click
+import json
 import os
+import pytest
 
 
 def output_tail(output):
     return '\n'.join(output.split('\n')[1:])
 
 
+@pytest.fixture
+def session(session, monkeypatch):
+    """Units a, b and c; b and c failed, c owned by build user x."""
+    for name, state in (('a', BuildStateEnum.done),
+                        ('b', BuildStateEnum.failed_build),
+                        ('c', BuildStateEnum.failed)):
+        add_unit(session, name, state)
+    monkeypatch.setattr(unit_cmd.utils, 'Session', lambda: session)
+    return session
+
+
 def test_available_commands():
     command_output_tail = """
 Options:
@@ -15,8 +34,10 @@ Options:
 
 Commands:
   bootstrap  Bootstraps a new build.
+  capacity   Report how many more units fit on this host.
   db         Administers the database.
   init       Initializes the bcpc-build installation.
+  pool       Manages the build unit pool.
   unit       Manages build units.
 """
     runner = CliRunner()
@@ -32,14 +53,18 @@ class TestBootstrapCommand:
   Bootstraps a new build.
 
 Options:
-  -c, --config-file FILENAME    Config file for bootstrap operation.
-  --source-url TEXT             URL for build sources.
-  --depends TEXT                Source dependency <name>=<url>
-  --strategy [v7|v8]            Build strategy.
-  --configure / --no-configure  Run the configuration phase.
-  --build / --no-build          Run the build phase.
-  --wait / --no-wait            Wait for bootstrap to complete in foreground.
-  --help                        Show this message and exit.
+  -c, --config-file FILENAME      Config file for bootstrap operation.
+  --source-url TEXT               URL for build sources.
+  --depends TEXT                  Source dependency <name>=<url>
+  --strategy [v7|v8]              Build strategy.
+  --configure / --no-configure    Run the configuration phase.
+  --build / --no-build            Run the build phase.
+  --from-template ID              Clone the new unit from an existing unit.
+  --mirror / --no-mirror          Clone sources through the local mirror cache.
+  --pool / --no-pool              Claim a pooled unit if available.
+  --wait / --no-wait              Wait for bootstrap to complete in foreground.
+  --log-level [CRITICAL|ERROR|WARNING|INFO|DEBUG|NOTSET]
+  --help                          Show this message and exit.
 """
         runner = CliRunner()
         result = runner.invoke(main_cli, ['bootstrap', '--help'])
@@ -58,6 +83,7 @@ Options:
 Commands:
   backup   Backup the database.
   console  Opens interactive console into database.
+  export   Export the build unit inventory.
   import   Import the database.
   migrate  Migrates the database.
   setup    Setups up the database.
@@ -68,6 +94,26 @@ Commands:
         assert output_tail(result.output) == command_output_tail
 
 
+class TestPoolCommand:
+    def test_usage(self):
+        command_output_tail = """
+  Manages the build unit pool.
+
+Options:
+  --help  Show this message and exit.
+
+Commands:
+  drain   Destroy pooled build units.
+  fill    Top up the pool to its size.
+  resize  Set the number of units kept in the pool.
+  status  Show pool status.
+"""
+        runner = CliRunner()
+        result = runner.invoke(main_cli, ['pool', '--help'])
+        assert result.exit_code == 0
+        assert output_tail(result.output) == command_output_tail
+
+
 class TestInitCommand:
     def test_usage(self):
         command_output_tail = """
@@ -92,19 +138,42 @@ Options:
   --help  Show this message and exit.
 
 Commands:
-  build    Initiate a build of a unit.
-  config   Manages build unit configuration.
-  destroy  Destroy build unit.
-  list     List build units.
-  modify   Modify build unit metadata
-  shell    Start a shell in the build unit.
-  show     Show build unit information.
+  attach     Follow the output of a running build.
+  build      Initiate a build of a unit.
+  clone      Clone a build unit.
+  config     Manages build unit configuration.
+  destroy    Destroy build units.
+  history    Show build state changes of a unit.
+  list       List build units.
+  logs       Show or search build logs.
+  modify     Modify build unit metadata
+  queue      Manages the build queue.
+  resume     Resume a failed build.
+  shell      Start a shell in the build unit.
+  show       Show build unit information.
+  stats      Show phase duration percentiles across units.
+  supervise  Build several units from one process.
+  timings    Show phase timings of a build unit.
 """
         runner = CliRunner()
         result = runner.invoke(main_cli, ['unit', '--help'])
         assert result.exit_code == 0
         assert output_tail(result.output) == command_output_tail
 
+    class TestUnitAttachSubcommand:
+        def test_usage(self):
+            command_output_tail = """
+  Follow the output of a running build.
+
+Options:
+  --timestamps  Prefix lines with their time and stream.
+  --help        Show this message and exit.
+"""
+            runner = CliRunner()
+            result = runner.invoke(main_cli, ['unit', 'attach', '--help'])
+            assert result.exit_code == 0
+            assert output_tail(result.output) == command_output_tail
+
     class TestUnitBuildSubcommand:
         def test_usage(self):
             command_output_tail = """
@@ -113,6 +182,8 @@ Commands:
 Options:
   --wait / --no-wait  Wait for build synchronously.
   --strategy [v7|v8]  Build strategy.  [required]
+  --priority INTEGER  Queue priority of a --no-wait build.
+  --force             Skip the host capacity check.
   --help              Show this message and exit.
 """
             runner = CliRunner()
@@ -138,6 +209,30 @@ Error: Missing option "--strategy".  Choose from v7, v8.
             assert result.exit_code == 2
             assert output_tail(result.output) == command_output_tail
 
+        def test_illegal_state(self, session):
+            unit = session.query(BuildUnit).filter_by(name='c').one()
+            unit.build_state = BuildStateEnum.pooled
+            session.commit()
+            result = CliRunner().invoke(main_cli, [
+                'unit', 'build', '--wait', '--force', '--strategy', 'v8',
+                'c'])
+            assert result.exit_code == 1
+            assert result.output == (
+                'Cannot move a build unit from pooled to building.\n'
+                'Aborted!\n')
+            assert unit.build_state == BuildStateEnum.pooled
+
+    class TestUnitCloneSubcommand:
+        def test_unclonable_state(self, session, monkeypatch):
+            monkeypatch.setattr(build_unit.dbutils, 'Session',
+                                lambda: session)
+            unit = session.query(BuildUnit).filter_by(name='c').one()
+            result = CliRunner().invoke(main_cli, ['unit', 'clone', 'c'])
+            assert result.exit_code == 1
+            assert result.output == (
+                'Error: Cannot clone unit %s in state failed\n' % unit.id)
+            assert session.query(BuildUnit).count() == 3
+
     class TestUnitConfigSubcommand:
         def test_usage(self):
             command_output_tail = """
@@ -159,10 +254,16 @@ Commands:
     class TestUnitDestroySubcommand:
         def test_usage(self):
             command_output_tail = """
-  Destroy build unit.
+  Destroy build units.
 
 Options:
-  --help  Show this message and exit.
+  --failed                      Only units in a failed state.
+  --build-state BUILDSTATEENUM  Only units in this state.
+  --build-user TEXT             Only units of this build user.
+  --older-than AGE              Only units unchanged for AGE (2d) or since a
+                                date.
+  --workers INTEGER RANGE       Number of units torn down at once.
+  --help                        Show this message and exit.
 """
             runner = CliRunner()
             result = runner.invoke(main_cli, ['unit', 'destroy', '--help'])
@@ -171,13 +272,46 @@ Options:
 
         def test_requires_id(self):
             command_output_tail = """
-Error: Missing argument "id".
+Error: Give unit ids or filters.
 """
             runner = CliRunner()
             result = runner.invoke(main_cli, ['unit', 'destroy'])
             assert result.exit_code == 2
             assert output_tail(result.output) == command_output_tail
 
+        def test_bulk(self, session, monkeypatch):
+            removed = []
+
+            def remove_user(allocator, user, pids):
+                if user == 'c':
+                    raise RuntimeError('busy')
+                removed.append(user)
+
+            cls = unit_cmd.BuildUnitAllocator
+            monkeypatch.setattr(cls, '_user_procs',
+                                staticmethod(lambda users: {}))
+            monkeypatch.setattr(cls, '_remove_user', remove_user)
+            result = CliRunner().invoke(main_cli, ['unit', 'destroy', 'a',
+                                                   '--failed'])
+            # a is not failed
+            assert result.exit_code == 0
+            assert removed == []
+
+            result = CliRunner().invoke(main_cli, ['unit', 'destroy',
+                                                   '--failed'])
+            assert result.exit_code == 1
+            assert 'error: busy' in result.output
+            assert removed == ['b']
+            assert sorted(u.name for u in session.query(BuildUnit)) == [
+                'a', 'c']
+
+        def test_unknown_id(self, session):
+            result = CliRunner().invoke(main_cli, ['unit', 'destroy', 'a',
+                                                   'nope'])
+            assert result.exit_code == 1
+            assert "No such unit with id 'nope'" in result.output
+            assert session.query(BuildUnit).count() == 3
+
     class TestUnitListSubcommand:
         def test_usage(self):
             command_output_tail = """
@@ -189,6 +323,9 @@ Options:
   --failed                      Filter all failed states
   --build-user TEXT             Filter by build user.
   --build-state BUILDSTATEENUM  Filter by build state.
+  --limit N                     List at most N units.
+  --offset N                    Skip the first N units.
+  --after NAME                  List units sorting after NAME, as next page.
   --help                        Show this message and exit.
 """
             runner = CliRunner()
@@ -196,20 +333,91 @@ Options:
             assert result.exit_code == 0
             assert output_tail(result.output) == command_output_tail
 
+        def test_pages(self, monkeypatch):
+            _, session = make_db()
+            states = [BuildStateEnum.done, BuildStateEnum.failed_build]
+            for i in (10, 2, 9, 1):
+                add_unit(session, 'chef-bcpc.%d' % i, states[i % 2])
+            add_unit(session, 'other', BuildStateEnum.failed)
+            monkeypatch.setattr(unit_cmd.utils, 'Session', lambda: session)
+
+            def names(*args):
+                result = CliRunner().invoke(
+                    main_cli, ['unit', 'list', '-f', 'value'] + list(args))
+                assert result.exit_code == 0
+                return [l.split()[1] for l in result.output.splitlines()]
+
+            assert names() == ['chef-bcpc.1', 'chef-bcpc.2', 'chef-bcpc.9',
+                               'chef-bcpc.10', 'other']
+            assert names('--limit', '2') == ['chef-bcpc.1', 'chef-bcpc.2']
+            assert names('--limit', '2', '--after', 'chef-bcpc.2') == [
+                'chef-bcpc.9', 'chef-bcpc.10']
+            assert names('--offset', '4') == ['other']
+            assert names('--failed') == ['chef-bcpc.1', 'chef-bcpc.9',
+                                         'other']
+
+    class TestUnitLogsSubcommand:
+        def test_usage(self):
+            command_output_tail = """
+  Show or search build logs.
+
+Options:
+  --help  Show this message and exit.
+
+Commands:
+  grep  Search the build logs of many units.
+  show  Show the build log of a unit.
+"""
+            runner = CliRunner()
+            result = runner.invoke(main_cli, ['unit', 'logs', '--help'])
+            assert result.exit_code == 0
+            assert output_tail(result.output) == command_output_tail
+
+        def test_show_is_default(self):
+            runner = CliRunner()
+            shown = runner.invoke(main_cli, ['unit', 'logs', 'show', '--help'])
+            result = runner.invoke(main_cli,
+                                   ['unit', 'logs', '--tail', '5', '--help'])
+            assert result.exit_code == 0
+            assert result.output == shown.output
+
     class TestUnitModifySubcommand:
         def test_usage(self):
             command_output_tail = """
   Modify build unit metadata
 
 Options:
-  --set-state BUILDSTATE  Set build unit state.
-  --help                  Show this message and exit.
+  --failed                      Only units in a failed state.
+  --build-state BUILDSTATEENUM  Only units in this state.
+  --build-user TEXT             Only units of this build user.
+  --older-than AGE              Only units unchanged for AGE (2d) or since a
+                                date.
+  --set-state BUILDSTATE        Set build unit state.
+  --force                       Allow moves the state machine does not.
+  --help                        Show this message and exit.
 """
             runner = CliRunner()
             result = runner.invoke(main_cli, ['unit', 'modify', '--help'])
             assert result.exit_code == 0
             assert output_tail(result.output) == command_output_tail
 
+        def test_bulk(self, session):
+            def states():
+                return dict(session.query(BuildUnit.name,
+                                          BuildUnit.build_state))
+
+            args = ['unit', 'modify', 'a', 'b', '--set-state', 'provisioning']
+            result = CliRunner().invoke(main_cli, args)
+            # A failed build may be provisioned again, a done one may not
+            assert result.exit_code == 1
+            assert 'Use --force' in result.output
+            assert states() == {'a': BuildStateEnum.done,
+                                'b': BuildStateEnum.provisioning,
+                                'c': BuildStateEnum.failed}
+            result = CliRunner().invoke(main_cli, args + ['--force'])
+            assert result.exit_code == 0
+            assert states()['a'] == BuildStateEnum.provisioning
+
     class TestUnitShellSubcommand:
         def test_usage(self):
             command_output_tail = """
@@ -229,10 +437,23 @@ Options:
   Show build unit information.
 
 Options:
-  --format TEXT  Display format
-  --help         Show this message and exit.
+  --failed                      Only units in a failed state.
+  --build-state BUILDSTATEENUM  Only units in this state.
+  --build-user TEXT             Only units of this build user.
+  --older-than AGE              Only units unchanged for AGE (2d) or since a
+                                date.
+  --format TEXT                 Display format
+  --help                        Show this message and exit.
 """
             runner = CliRunner()
             result = runner.invoke(main_cli, ['unit', 'show', '--help'])
             assert result.exit_code == 0
             assert output_tail(result.output) == command_output_tail
+
+        def test_several(self, session):
+            bunit = session.query(BuildUnit).filter_by(name='a').one()
+            result = CliRunner().invoke(main_cli, [
+                'unit', 'show', '--format', 'json', str(bunit.id), 'c'])
+            assert result.exit_code == 0
+            shown = json.loads(result.output)
+            assert [u['name'] for u in shown] == ['a', 'c']
@@ -0,0 +1,159 @@
+from bcpc_build import config
+from bcpc_build import unit
+import json
+import os
+import pytest
+import yaml
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    unit._cache.clear()
+    yield unit._cache
+    unit._cache.clear()
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    counts = dict(json=0, yaml=0, ini=0)
+
+    def counting(fmt, load):
+        def _load(fp):
+            counts[fmt] += 1
+            return load(fp)
+        return _load
+
+    for fmt, name in (('json', 'json_load'), ('yaml', 'yaml_load'),
+                      ('ini', 'ini_load')):
+        monkeypatch.setattr(unit, name, counting(fmt, getattr(unit, name)))
+    return counts
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_parsed_once(tmp_path, parses):
+    filename = write(tmp_path / 'topology.yml',
+                     yaml.dump({'nodes': [{'host': 'a'}]}))
+    first = unit.ConfigFile('t', filename)
+    second = unit.ConfigFile('t', filename)
+    assert isinstance(first, unit.YAMLConfigFile)
+    assert parses == dict(json=0, yaml=1, ini=0)
+    # Each gets its own copy
+    first.contents['nodes'][0]['host'] = 'b'
+    assert second.contents == {'nodes': [{'host': 'a'}]}
+
+
+def test_reparsed_when_changed(tmp_path, parses):
+    filename = write(tmp_path / 'env.json', json.dumps({'a': 1}))
+    conf = unit.ConfigFile('env', filename)
+    with conf.edit() as contents:
+        contents['a'] = 22
+    assert unit.ConfigFile('env', filename).contents == {'a': 22}
+    assert parses['json'] == 2
+
+
+def test_reloaded_after_edit(tmp_path, parses):
+    filename = write(tmp_path / 'env.json', json.dumps({'a': 1}, indent=2))
+    st = os.stat(filename)
+    conf = unit.ConfigFile('env', filename)
+    with conf.edit() as contents:
+        contents['a'] = 2
+    # Same size, and the same mtime on a coarse clock
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert unit._stamp(os.stat(filename)) == unit._stamp(st)
+    assert unit.ConfigFile('env', filename).contents == {'a': 2}
+    conf.refresh()
+    assert conf.contents == {'a': 2}
+    assert parses['json'] == 2
+
+
+@pytest.mark.parametrize('text,cls', [
+    ('{"a": 1}', unit.JSONConfigFile),
+    ('[1, 2]', unit.JSONConfigFile),
+    ('[main]\nkey = value\n', unit.INIConfigFile),
+    ('a: 1\n', unit.YAMLConfigFile),
+])
+def test_sniffed(tmp_path, parses, text, cls):
+    conf = unit.ConfigFile('c', write(tmp_path / 'config', text))
+    assert isinstance(conf, cls)
+    assert sum(parses.values()) == 1
+
+
+def test_wrong_extension(tmp_path):
+    conf = unit.ConfigFile('c', write(tmp_path / 'c.json', 'a: 1\n'))
+    assert isinstance(conf, unit.YAMLConfigFile)
+    assert conf.contents == {'a': 1}
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(unit.UnknownConfigFileFormat):
+        unit.ConfigFile('c', write(tmp_path / 'c', '{"a": [}'))
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch, cache):
+    monkeypatch.setattr(config.unit, 'config_cache_size', 2)
+    paths = [write(tmp_path / ('%d.json' % i), '{}') for i in range(3)]
+    unit.load_config(paths[0])
+    unit.load_config(paths[1])
+    unit.load_config(paths[0])
+    unit.load_config(paths[2])
+    assert len(cache) == 2
+    stamp = unit._stamp(os.stat(paths[1]))
+    assert cache.get(os.path.abspath(paths[1]), stamp) is None
+
+
+class FakeUnit(object):
+    def __init__(self, path):
+        self.path = path
+
+    def get_build_path(self):
+        return self.path
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    base = tmp_path / 'chef-bcpc'
+    (base / 'virtual' / 'topology').mkdir(parents=True)
+    (base / 'chef' / 'environments').mkdir(parents=True)
+    (base / 'chef' / 'roles').mkdir(parents=True)
+    nodes = [{'host': 'n%d' % i, 'host_vars': {'interfaces': {'transit': [
+        {'neighbor': {'name': 'tor%d' % (i % 2)}}]}}} for i in range(4)]
+    write(base / 'virtual' / 'topology' / 'topology.yml',
+          yaml.dump({'nodes': nodes}))
+    write(base / 'virtual' / 'topology' / 'hardware.yml', 'a: 1\n')
+    write(base / 'chef' / 'environments' / 'virtual.json', '{}')
+    write(base / 'chef' / 'roles' / 'broken.json', '{"a": [}')
+    os.symlink(str(tmp_path / 'gone'), str(base / 'chef' / 'roles' / 'x'))
+    return FakeUnit(str(tmp_path))
+
+
+def test_handler_parses_on_access(checkout, parses):
+    handler = unit.V8ConfigHandler(checkout)
+    configs = handler.configs['chef-bcpc'].configs
+    assert sorted(configs) == [
+        'chef/environments/virtual.json', 'chef/roles/broken.json',
+        'topology/hardware.yml', 'topology/topology.yml']
+    assert sum(parses.values()) == 0
+
+    nets = dict(handler.enumerate_nets())
+    assert sorted(nets['chef-bcpc']) == ['tor0', 'tor1']
+    topology = configs['topology/topology.yml']
+    assert topology is configs['topology/topology.yml']
+    assert configs.loaded() == {'topology/topology.yml'}
+    assert parses['yaml'] == 1
+    with pytest.raises(unit.UnknownConfigFileFormat):
+        configs['chef/roles/broken.json']
+
+
+def test_prefetch(checkout, parses):
+    configs = unit.V8ConfigHandler(checkout).configs['chef-bcpc'].configs
+    configs.prefetch(['topology/topology.yml', 'topology/hardware.yml',
+                      'topology/missing.yml'], workers=2)
+    assert configs['topology/hardware.yml'].contents == {'a': 1}
+    configs['topology/topology.yml']
+    assert configs.loaded() == {'topology/topology.yml',
+                                'topology/hardware.yml'}
+    assert parses['yaml'] == 2
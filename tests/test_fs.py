@@ -0,0 +1,145 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.utils import fs
+from grp import getgrgid
+from pwd import getpwuid
+from tests.conftest import add_unit
+import errno
+import os
+import pytest
+import shutil
+
+OBJECT = os.path.join('repo', '.git', 'objects', 'ab', 'cdef')
+ALTERNATES = os.path.join('repo', '.git', 'objects', 'info', 'alternates')
+
+
+def write(path, text=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def tree(tmpdir):
+    """A unit's home with a git checkout, logs and symlinks."""
+    src = str(tmpdir.join('src'))
+    for path in (OBJECT, ALTERNATES, os.path.join('repo', 'file'),
+                 os.path.join('repo', '.vagrant', 'id'), 'build.log'):
+        write(os.path.join(src, path), path)
+    os.symlink('repo/file', os.path.join(src, 'top-link'))
+    os.symlink('file', os.path.join(src, 'repo', 'nested-link'))
+    dst = str(tmpdir.join('dst'))
+    os.mkdir(dst)
+    return src, dst
+
+
+@pytest.fixture
+def no_reflink(monkeypatch):
+    calls = []
+
+    def reflink(src, dst):
+        calls.append(src)
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+    monkeypatch.setattr(fs, 'reflink', reflink)
+    return calls
+
+
+def same_file(a, b):
+    return os.stat(a).st_ino == os.stat(b).st_ino
+
+
+def test_falls_back_without_reflinks(tree, no_reflink):
+    src, dst = tree
+    copier = fs.clone_tree(src, dst)
+    # Tried once, then not again for the rest of the tree
+    assert len(no_reflink) == 1
+    assert not copier.use_reflink
+    assert copier.stats == dict(reflinked=0, linked=1, copied=4)
+    with open(os.path.join(dst, 'repo', 'file')) as f:
+        assert f.read() == os.path.join('repo', 'file')
+
+
+def test_hardlinks_only_git_objects(tree, no_reflink):
+    src, dst = tree
+    copier = fs.clone_tree(src, dst)
+    assert copier.linked == {os.path.join(dst, OBJECT)}
+    assert same_file(os.path.join(src, OBJECT), os.path.join(dst, OBJECT))
+    for path in (ALTERNATES, os.path.join('repo', 'file')):
+        assert not same_file(os.path.join(src, path),
+                             os.path.join(dst, path))
+
+    other = os.path.join(os.path.dirname(dst), 'other')
+    os.mkdir(other)
+    copier = fs.clone_tree(src, other, hardlink=False)
+    assert not copier.linked
+    assert not same_file(os.path.join(src, OBJECT),
+                         os.path.join(other, OBJECT))
+
+
+def test_keeps_symlinks(tree, no_reflink):
+    src, dst = tree
+    fs.clone_tree(src, dst)
+    assert os.readlink(os.path.join(dst, 'top-link')) == 'repo/file'
+    assert os.readlink(os.path.join(dst, 'repo', 'nested-link')) == 'file'
+
+
+def test_ignores(tree, no_reflink):
+    src, dst = tree
+    fs.clone_tree(src, dst, ignore=shutil.ignore_patterns('.vagrant'),
+                  top_ignore=('build.log',))
+    assert not os.path.lexists(os.path.join(dst, 'build.log'))
+    assert not os.path.lexists(os.path.join(dst, 'repo', '.vagrant'))
+    assert os.path.exists(os.path.join(dst, 'repo', 'file'))
+
+
+def test_chown_tree_skips_linked(tree, no_reflink, monkeypatch):
+    src, dst = tree
+    copier = fs.clone_tree(src, dst)
+    chowned = []
+    monkeypatch.setattr(fs.os, 'lchown',
+                        lambda path, uid, gid: chowned.append(path))
+    user = getpwuid(os.getuid()).pw_name
+    group = getgrgid(os.getgid()).gr_name
+    fs.chown_tree(dst, user, group, skip=copier.linked)
+    assert dst in chowned
+    assert os.path.join(dst, OBJECT) not in chowned
+    for path in (ALTERNATES, 'top-link', os.path.join('repo', 'nested-link')):
+        assert os.path.join(dst, path) in chowned
+
+
+@pytest.fixture
+def allocator(session, tmpdir, monkeypatch):
+    # Units live under build_home, named after their build user
+    monkeypatch.setattr(BuildUnitAllocator, 'DEFAULT_BUILD_HOME',
+                        str(tmpdir))
+    allocator = V8BuildUnitAllocator(session=session)
+    monkeypatch.setattr(allocator, 'allocate_build_user', lambda name: name)
+
+    def allocate_build_dir(build_user=None, **kwargs):
+        path = str(tmpdir.join(build_user))
+        os.mkdir(path)
+        return path
+
+    monkeypatch.setattr(allocator, 'allocate_build_dir', allocate_build_dir)
+    return allocator
+
+
+def test_clone_unit(tree, no_reflink, allocator, monkeypatch):
+    src, _ = tree
+    chowns = []
+    monkeypatch.setattr(fs, 'chown_tree',
+                        lambda path, user, group, skip: chowns.append(skip))
+    template = add_unit(allocator.session, 'template', BuildStateEnum.done,
+                        build_user='src', build_dir=src)
+
+    bunit = allocator.clone(template, name='copy',
+                            conf=dict(configure=False))
+    dst = bunit.get_build_path()
+    assert bunit.build_state == BuildStateEnum.provisioned
+    assert os.path.exists(os.path.join(dst, 'repo', 'file'))
+    # Per-unit state is not carried over
+    assert not os.path.lexists(os.path.join(dst, 'build.log'))
+    assert not os.path.lexists(os.path.join(dst, 'repo', '.vagrant'))
+    assert chowns == [{os.path.join(dst, OBJECT)}]
@@ -0,0 +1,58 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.db.models.build_state_event import BuildStateEventBase
+from bcpc_build import history
+from datetime import datetime
+from datetime import timedelta
+from tests.conftest import add_unit
+import os
+import pytest
+
+
+def test_set_build_state_records_history(session, monkeypatch):
+    allocator = V8BuildUnitAllocator(session=session)
+    bunit = add_unit(session, 'a')
+    for state in (BuildStateEnum.provisioning, BuildStateEnum.provisioned,
+                  BuildStateEnum.provisioned, BuildStateEnum.building):
+        allocator.set_build_state(bunit, state)
+    events = history.unit_history(session, bunit.id).all()
+    assert [(e.from_state, e.to_state) for e in events] == [
+        (None, BuildStateEnum.provisioning),
+        (BuildStateEnum.provisioning, BuildStateEnum.provisioned),
+        (BuildStateEnum.provisioned, BuildStateEnum.building),
+    ]
+    assert events[0].pid == os.getpid()
+
+    unit_id = bunit.id
+    allocator._deallocate(bunit)
+    # History outlives the unit
+    events = history.unit_history(session, unit_id).all()
+    assert (events[-1].from_state, events[-1].to_state) == (
+        BuildStateEnum.building, None)
+
+
+def test_time_in_state(session):
+    start = datetime(2026, 1, 1)
+    transitions = {
+        'a': [(0, BuildStateEnum.provisioning),
+              (60, BuildStateEnum.configuring),
+              (90, BuildStateEnum.configured)],
+        'b': [(0, BuildStateEnum.provisioning),
+              (120, BuildStateEnum.configuring)],
+    }
+    for name, changes in transitions.items():
+        bunit = add_unit(session, name)
+        for seconds, state in changes:
+            session.add(BuildStateEventBase(
+                unit_id=bunit.id, to_state=state,
+                timestamp=start + timedelta(seconds=seconds)))
+    session.commit()
+    stats = history.time_in_state(session)
+    # Unfinished stays are not counted
+    assert list(stats) == ['configuring', 'provisioning']
+    assert stats['provisioning']['count'] == 2
+    assert stats['provisioning']['mean'] == pytest.approx(90)
+    assert stats['provisioning']['max'] == pytest.approx(120)
+    assert stats['configuring']['total'] == pytest.approx(30)
+    since = history.time_in_state(session, since=start + timedelta(1 / 86400))
+    assert list(since) == ['configuring']
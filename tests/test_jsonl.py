@@ -0,0 +1,157 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.db.models.build_state_event import BuildStateEventBase
+from bcpc_build.db import jsonl
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from tests.conftest import add_unit
+from tests.conftest import make_db
+import io
+import pytest
+
+
+DONE = BuildStateEnum.done
+
+
+def export(engine, batch_size=None):
+    out = io.StringIO()
+    with engine.connect() as conn:
+        jsonl.export(conn, out, batch_size=batch_size)
+    return out.getvalue().splitlines()
+
+
+def import_rows(engine, lines, mode=jsonl.MERGE, on_conflict=None):
+    with engine.begin() as conn:
+        return jsonl.import_rows(conn, lines, mode=mode, batch_size=2,
+                                 on_conflict=on_conflict)
+
+
+def test_round_trip():
+    src_engine, src = make_db()
+    for i in range(5):
+        add_unit(src, 'chef-bcpc.%d' % i, DONE, record=True)
+    lines = export(src_engine, batch_size=2)
+    assert len(lines) == 10
+
+    dest_engine, dest = make_db()
+    counts = import_rows(dest_engine, lines)
+    assert counts['build_unit']['inserted'] == 5
+    assert counts['build_state_event']['inserted'] == 5
+    units = dest.query(BuildUnit).order_by(BuildUnit.sort_key).all()
+    assert [u.name for u in units] == ['chef-bcpc.%d' % i for i in range(5)]
+    assert units[0].build_state == BuildStateEnum.done
+    assert export(dest_engine) == lines
+
+    # Importing again adds nothing
+    counts = import_rows(dest_engine, lines)
+    assert counts['build_unit'] == dict(inserted=0, updated=0, skipped=5,
+                                        conflicts=0)
+    assert counts['build_state_event']['skipped'] == 5
+    assert dest.query(BuildStateEventBase).count() == 5
+
+
+def test_round_trip_timestamps():
+    src_engine, src = make_db()
+    stamps = [datetime(2026, 10, 18, 17, 21, 9),
+              datetime(2026, 10, 18, 17, 21, 9, 204583)]
+    for i, stamp in enumerate(stamps):
+        add_unit(src, 'chef-bcpc.%d' % i, DONE, record=True).created_at = stamp
+    src.commit()
+    lines = export(src_engine)
+    assert any('"2026-10-18T17:21:09"' in line for line in lines)
+
+    dest_engine, dest = make_db()
+    import_rows(dest_engine, lines)
+    units = dest.query(BuildUnit).order_by(BuildUnit.sort_key).all()
+    assert [u.created_at for u in units] == stamps
+    assert export(dest_engine) == lines
+
+
+def test_parse_datetime():
+    tz = timezone(-timedelta(hours=5, minutes=30))
+    assert jsonl._parse_datetime('2026-10-18T17:21:09-05:30') == datetime(
+        2026, 10, 18, 17, 21, 9, tzinfo=tz)
+    assert jsonl._parse_datetime(
+        '2026-10-18T17:21:09.000001+00:00') == datetime(
+        2026, 10, 18, 17, 21, 9, 1, tzinfo=timezone.utc)
+
+
+def test_upsert():
+    src_engine, src = make_db()
+    bunit = add_unit(src, 'a', DONE, record=True)
+    dest_engine, dest = make_db()
+    import_rows(dest_engine, export(src_engine))
+    bunit.build_state = BuildStateEnum.failed
+    src.commit()
+    lines = export(src_engine)
+
+    import_rows(dest_engine, lines, mode=jsonl.MERGE)
+    assert dest.query(BuildUnit).one().build_state == BuildStateEnum.done
+    counts = import_rows(dest_engine, lines, mode=jsonl.UPSERT)
+    assert counts['build_unit']['updated'] == 1
+    dest.expire_all()
+    assert dest.query(BuildUnit).one().build_state == BuildStateEnum.failed
+
+
+def test_invalid_record_rolls_back():
+    src_engine, src = make_db()
+    add_unit(src, 'a', DONE, record=True)
+    lines = export(src_engine) + ['{"table": "nope", "row": {}}']
+    dest_engine, dest = make_db()
+    with pytest.raises(jsonl.InvalidRecordError) as e:
+        import_rows(dest_engine, lines)
+    assert e.value.lineno == 3
+    assert dest.query(BuildUnit).count() == 0
+
+
+def test_hosts_sharing_names():
+    host1_engine, host1 = make_db()
+    host2_engine, host2 = make_db()
+    add_unit(host1, 'a', DONE, record=True)
+    add_unit(host2, 'a', BuildStateEnum.failed, record=True)
+    add_unit(host2, 'b', DONE, record=True)
+    dest_engine, dest = make_db()
+    import_rows(dest_engine, export(host1_engine))
+
+    conflicts = []
+    counts = import_rows(dest_engine, export(host2_engine),
+                         on_conflict=lambda t, r: conflicts.append(r))
+    assert [r['name'] for r in conflicts] == ['a']
+    assert counts['build_unit']['inserted'] == 1
+    assert counts['build_unit']['conflicts'] == 1
+    # The history of the unit left out goes with it
+    assert counts['build_state_event']['inserted'] == 1
+    assert counts['build_state_event']['conflicts'] == 1
+    units = dict(dest.query(BuildUnit.name, BuildUnit.build_state))
+    assert units == {'a': BuildStateEnum.done, 'b': BuildStateEnum.done}
+    assert dest.query(BuildStateEventBase).count() == 2
+
+
+def test_names_clash_within_import():
+    first_engine, first = make_db()
+    second_engine, second = make_db()
+    add_unit(first, 'a', DONE, record=True)
+    add_unit(second, 'a', DONE, record=True)
+    dest_engine, dest = make_db()
+    # Units come before their history, so both units share a batch
+    lines = export(first_engine)[:1] + export(second_engine)
+    counts = import_rows(dest_engine, lines, mode=jsonl.UPSERT)
+    assert counts['build_unit']['inserted'] == 1
+    assert counts['build_unit']['conflicts'] == 1
+    assert dest.query(BuildUnit).count() == 1
+
+
+def test_upsert_rename_clash():
+    src_engine, src = make_db()
+    add_unit(src, 'a', DONE, record=True)
+    bunit = add_unit(src, 'b', DONE, record=True)
+    dest_engine, dest = make_db()
+    import_rows(dest_engine, export(src_engine))
+    src.delete(src.query(BuildUnit).filter_by(name='a').one())
+    src.commit()
+    bunit.name = 'a'
+    src.commit()
+    counts = import_rows(dest_engine, export(src_engine), mode=jsonl.UPSERT)
+    assert counts['build_unit']['conflicts'] == 1
+    assert sorted(n for n, in dest.query(BuildUnit.name)) == ['a', 'b']
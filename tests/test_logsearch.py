@@ -0,0 +1,69 @@
+from bcpc_build.logsearch import SearchCache
+from bcpc_build.logsearch import SearchJob
+from bcpc_build.logstore import LogStore
+from bcpc_build.utils.stream import OutputRecord
+from bcpc_build import logsearch
+import pytest
+import time
+
+
+@pytest.fixture
+def jobs(tmpdir):
+    store = LogStore(tmpdir.join('a', 'logs').strpath)
+    with store.writer() as writer:
+        writer.frame_bytes = 64
+        for i in range(1, 101):
+            line = 'ERROR: proxy refused' if i in (7, 93) else 'ok %d' % i
+            writer.write(OutputRecord(1000.0 + i, 'stdout', line))
+    reader = store.reader()
+    plain = tmpdir.join('b.log')
+    plain.write('ok\nnot an ERROR: proxy refused\nok\nERROR: proxy refused\n')
+    return [SearchJob('a', reader.log_path, reader.index_path),
+            SearchJob('b', plain.strpath, None)]
+
+
+def results(jobs, pattern, **kwargs):
+    return {job.name: [m.lineno for m in matches]
+            for job, matches, error in logsearch.search(jobs, pattern,
+                                                        workers=2, **kwargs)}
+
+
+def test_search(jobs):
+    assert results(jobs, 'proxy refused') == {'a': [7, 93], 'b': [2, 4]}
+    assert results(jobs, 'PROXY', ignore_case=True, max_count=1) == {
+        'a': [7], 'b': [2]}
+
+
+def test_anchored_pattern(jobs):
+    assert results(jobs, '^ERROR') == {'a': [7, 93], 'b': [4]}
+
+
+def test_since(jobs):
+    assert results(jobs[:1], 'ERROR', since=1050.0) == {'a': [93]}
+
+
+def test_cache(jobs, tmpdir, monkeypatch):
+    cache = SearchCache(tmpdir.join('cache').strpath)
+    assert results(jobs, 'ERROR', cache=cache) == {'a': [7, 93],
+                                                   'b': [2, 4]}
+
+    def fail(*args):
+        raise AssertionError('not cached')
+
+    monkeypatch.setattr(logsearch, 'ProcessPoolExecutor', fail)
+    assert results(jobs, 'ERROR', cache=cache) == {'a': [7, 93],
+                                                   'b': [2, 4]}
+    # Cached matches are narrowed to each query
+    assert results(jobs, 'ERROR', since=1050.0, max_count=1,
+                   cache=cache) == {'a': [93], 'b': [2]}
+    assert results(jobs[1:], 'ERROR', since=time.time() + 60,
+                   cache=cache) == {'b': []}
+
+
+def test_cache_ignores_limits(jobs, tmpdir, monkeypatch):
+    cache = SearchCache(tmpdir.join('cache').strpath)
+    assert results(jobs, 'ERROR', since=1050.0, max_count=1,
+                   cache=cache) == {'a': [93], 'b': [2]}
+    monkeypatch.setattr(logsearch, 'ProcessPoolExecutor', None)
+    assert results(jobs, 'ERROR', cache=cache) == {'a': [7, 93],
+                                                   'b': [2, 4]}
@@ -0,0 +1,63 @@
+from bcpc_build.logstore import LogNotFoundError
+from bcpc_build.logstore import LogStore
+from bcpc_build.logstore import LogWriter
+from bcpc_build.utils.stream import OutputRecord
+import gzip
+import pytest
+
+
+@pytest.fixture
+def store(tmpdir):
+    return LogStore(tmpdir.join('logs').strpath)
+
+
+def write_lines(writer, start, stop):
+    for i in range(start, stop):
+        writer.write(OutputRecord(1000.0 + i, 'stdout', 'line %d' % i))
+
+
+def test_write_and_read(store):
+    writer = store.writer()
+    writer.frame_bytes = 100
+    write_lines(writer, 1, 51)
+    writer.close()
+    reader = store.reader()
+    assert len(reader.entries) > 1
+    assert reader.line_count == 50
+    assert [l.line for l in reader.tail(2)] == ['line 49', 'line 50']
+    assert [l.lineno for l in reader.lines(10, 12)] == [10, 11, 12]
+    assert [l.line for l in reader.since(1048.0)] == [
+        'line 48', 'line 49', 'line 50']
+    # Frames are plain gzip members
+    log_path = store._paths(1)[0]
+    with gzip.open(log_path, 'rt') as f:
+        assert len(f.read().splitlines()) == 50
+
+
+def test_generations(store, monkeypatch):
+    for _ in range(3):
+        with store.writer() as writer:
+            writer.write('hello\nworld')
+    assert store.generations() == [1, 2, 3]
+    assert store.prune(keep=2) == [1]
+    assert store.reader().line_count == 2
+    with pytest.raises(LogNotFoundError):
+        store.reader(1)
+
+
+def test_append_drops_unindexed_frame(store):
+    with store.writer() as writer:
+        write_lines(writer, 1, 4)
+    log_path, index_path = store._paths(1)
+    with open(log_path, 'ab') as f:
+        f.write(b'partial frame')
+    with store.writer(append=True) as writer:
+        write_lines(writer, 4, 6)
+    reader = store.reader()
+    assert [l.lineno for l in reader.lines()] == [1, 2, 3, 4, 5]
+    assert store.generations() == [1]
+
+
+def test_missing_logs(store):
+    with pytest.raises(LogNotFoundError):
+        store.reader()
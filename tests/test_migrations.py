@@ -0,0 +1,69 @@
+from alembic.config import Config
+from alembic import command
+from pathlib import Path
+import bcpc_build
+import pytest
+import sqlalchemy as sa
+import uuid
+
+
+@pytest.fixture
+def database(tmpdir):
+    root = Path(bcpc_build.__file__).parent.parent
+    cfg = Config(root.joinpath('alembic.ini').as_posix())
+    cfg.set_main_option('script_location',
+                        root.joinpath('alembic').as_posix())
+    url = 'sqlite:///%s' % tmpdir.join('master.db')
+    cfg.set_main_option('sqlalchemy.url', url)
+    engine = sa.create_engine(url)
+    yield cfg, engine
+    engine.dispose()
+
+
+def insert_unit(engine, id_, state):
+    engine.execute(
+        "INSERT INTO build_unit (id, build_dir, build_user, name,"
+        " source_url, build_state) VALUES (?, 'd', 'u', ?, 'x', ?)",
+        id_, 'u%d' % id_, state)
+
+
+def states(engine):
+    return [r[0] for r in engine.execute(
+        'SELECT build_state FROM build_unit ORDER BY id')]
+
+
+def test_pooled_state_round_trip(database):
+    cfg, engine = database
+    command.upgrade(cfg, '60a3f9fdb580')
+    insert_unit(engine, 1, 'failed_provision')
+    insert_unit(engine, 2, 'failed_build')
+    command.upgrade(cfg, '3b1f0d6c9a2e')
+    assert states(engine) == ['failed:provision', 'failed:build']
+
+    insert_unit(engine, 3, 'pooled')
+    command.downgrade(cfg, '60a3f9fdb580')
+    assert states(engine) == ['failed_provision', 'failed_build', 'failed']
+
+
+def test_duplicate_names_renamed(database):
+    cfg, engine = database
+    command.upgrade(cfg, 'b7f3e2a9c614')
+    long_name = 'n' * 128
+    units = [(uuid.uuid4(), name, day) for name in (long_name, 'short')
+             for day in (3, 1, 2)]
+    for id_, name, day in units:
+        engine.execute(
+            "INSERT INTO build_unit (id, build_dir, build_user, name,"
+            " source_url, build_state, created_at)"
+            " VALUES (?, 'd', 'u', ?, 'x', 'done', ?)",
+            id_.bytes, name, '2026-01-0%d 00:00:00' % day)
+    command.upgrade(cfg, '4c8d2f7a1e95')
+    names = dict((uuid.UUID(bytes=r[0]), r[1]) for r in engine.execute(
+        'SELECT id, name FROM build_unit'))
+    for id_, name, day in units:
+        if day == 1:
+            # The oldest keeps its name
+            assert names[id_] == name
+        else:
+            suffix = '-' + id_.hex[:8]
+            assert names[id_] == name[:128 - len(suffix)] + suffix
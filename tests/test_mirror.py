@@ -0,0 +1,157 @@
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build import build_unit
+from bcpc_build.mirror import GitMirrorCache
+from subprocess import CalledProcessError
+from subprocess import check_output
+import logging
+import os
+import shlex
+import threading
+import time
+import pytest
+
+
+def git(*args, cwd=None):
+    return check_output(('git',) + args, cwd=cwd).decode().strip()
+
+
+def commit(work, message):
+    with open(os.path.join(work, 'file'), 'a') as f:
+        f.write(message + '\n')
+    git('add', 'file', cwd=work)
+    git('commit', '-q', '-m', message, cwd=work)
+    git('push', '-q', 'origin', 'HEAD:refs/heads/master', cwd=work)
+    return git('rev-parse', 'HEAD', cwd=work)
+
+
+@pytest.fixture
+def origin(tmpdir, monkeypatch):
+    """A bare repository, and a work tree pushing to it."""
+    for var in ('AUTHOR', 'COMMITTER'):
+        monkeypatch.setenv('GIT_%s_NAME' % var, 'Test')
+        monkeypatch.setenv('GIT_%s_EMAIL' % var, 'test@example.com')
+    bare = str(tmpdir.join('origin.git'))
+    work = str(tmpdir.join('work'))
+    git('init', '-q', '--bare', bare)
+    git('init', '-q', work)
+    git('remote', 'add', 'origin', bare, cwd=work)
+    commit(work, 'first')
+    return bare, work
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return GitMirrorCache(str(tmpdir.join('home')))
+
+
+def mirrored(path, rev):
+    return git('-C', path, 'cat-file', '-t', rev) == 'commit'
+
+
+def test_creates_mirror(cache, origin):
+    bare, work = origin
+    path = cache.refresh(bare)
+    assert path == cache.path_for(bare)
+    assert os.path.basename(path).startswith('origin-')
+    assert path != cache.path_for(bare + '-other')
+    assert git('-C', path, 'rev-parse', '--is-bare-repository') == 'true'
+    # Unit clones borrow its objects; gc must not drop them
+    assert git('-C', path, 'config', 'gc.auto') == '0'
+    assert mirrored(path, git('rev-parse', 'HEAD', cwd=work))
+    assert cache.is_fresh(bare)
+
+
+def test_refresh(cache, origin):
+    bare, work = origin
+    path = cache.refresh(bare)
+    rev = commit(work, 'second')
+    # Fresh mirrors are not fetched again
+    cache.refresh(bare)
+    with pytest.raises(CalledProcessError):
+        mirrored(path, rev)
+    cache.refresh(bare, force=True)
+    assert mirrored(path, rev)
+
+    cache.ttl = 0
+    rev = commit(work, 'third')
+    assert not cache.is_fresh(bare)
+    cache.refresh(bare)
+    assert mirrored(path, rev)
+
+
+def test_concurrent_refreshes_fetch_once(cache, origin, monkeypatch):
+    bare, _ = origin
+    calls = []
+    run = GitMirrorCache._git
+
+    def slow_git(self, *args, **kwargs):
+        calls.append(args)
+        # Widen the window for the other refresh to race
+        time.sleep(0.1)
+        return run(self, *args, **kwargs)
+
+    monkeypatch.setattr(GitMirrorCache, '_git', slow_git)
+    threads = [threading.Thread(target=cache.refresh, args=(bare,))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [a[0] for a in calls].count('clone') == 1
+    assert not any('fetch' in a for a in calls)
+
+
+class FakeUnit(object):
+    build_user = 'builder'
+
+    def __init__(self, path, source_url):
+        self.path = path
+        self.source_url = source_url
+        self.logger = logging.getLogger(__name__)
+
+    def get_build_path(self):
+        return self.path
+
+
+def populate_cmds(tmpdir, monkeypatch, source_url, **conf):
+    cmds = []
+
+    def record(args, **kwargs):
+        cmds.append(args)
+        return b''
+
+    monkeypatch.setattr(build_unit, 'check_output', record)
+    conf.update(build_home=str(tmpdir.join('home')), src_depends={})
+    bunit = FakeUnit(str(tmpdir.join('unit')), source_url)
+    V8BuildUnitAllocator.populate(bunit, conf=conf)
+    # su -c '<git command>' <user>
+    return [shlex.split(cmd[2]) for cmd in cmds]
+
+
+def test_populate_clones_with_reference(tmpdir, monkeypatch, origin):
+    bare, _ = origin
+    cmds = populate_cmds(tmpdir, monkeypatch, bare + '/tree/master')
+    mirror = GitMirrorCache(str(tmpdir.join('home'))).path_for(bare)
+    clone, checkout = cmds
+    assert clone[clone.index('--reference') + 1] == mirror
+    assert 'safe.directory=%s' % mirror in clone
+    assert clone[-2:] == [bare, 'chef-bcpc']
+    # The revision comes from the mirror too
+    assert checkout[checkout.index('fetch') + 2:][:2] == [mirror, 'master']
+
+    # A clone referencing the mirror borrows its objects
+    dest = str(tmpdir.join('clone'))
+    git('clone', '-q', '--reference', mirror, bare, dest)
+    with open(os.path.join(dest, '.git', 'objects', 'info',
+                           'alternates')) as f:
+        assert f.read().strip() == os.path.join(mirror, 'objects')
+
+
+def test_populate_without_mirror(tmpdir, monkeypatch, origin):
+    bare, _ = origin
+    clone, = populate_cmds(tmpdir, monkeypatch, bare, mirror=False)
+    assert '--reference' not in clone
+    # Unreachable sources are cloned directly
+    clone, = populate_cmds(tmpdir, monkeypatch,
+                           str(tmpdir.join('missing.git')))
+    assert '--reference' not in clone
@@ -0,0 +1,73 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.exceptions import DuplicateNameError
+from bcpc_build.pool import BuildUnitPool
+from bcpc_build import config
+from tests.conftest import add_unit
+import pytest
+
+
+POOLED = BuildStateEnum.pooled
+SRC_URL = V8BuildUnitAllocator.DEFAULT_SRC_URL
+
+
+@pytest.fixture
+def pool(session, tmpdir, monkeypatch):
+    monkeypatch.setattr(config.pool, 'conf_file',
+                        tmpdir.join('pool.json').strpath)
+    allocator = V8BuildUnitAllocator(session=session)
+    return BuildUnitPool(allocator)
+
+
+class TestBuildUnitPool:
+    def test_claim(self, pool):
+        add_unit(pool.session, 'chef-bcpc.a', POOLED, source_url=SRC_URL)
+        add_unit(pool.session, 'chef-bcpc.b', BuildStateEnum.done,
+                 source_url=SRC_URL)
+        bunit = pool.claim(name='mine')
+        assert bunit.name == 'mine'
+        assert bunit.build_user == 'chef-bcpc.a'
+        assert bunit.build_state == BuildStateEnum.provisioning
+        assert pool.claim() is None
+
+    def test_claim_matches_source_url(self, pool):
+        add_unit(pool.session, 'chef-bcpc.a', POOLED,
+                 source_url='https://other')
+        assert pool.claim() is None
+        assert pool.claim(source_url='https://other') is not None
+
+    def test_claim_duplicate_name(self, pool):
+        add_unit(pool.session, 'chef-bcpc.a', POOLED, source_url=SRC_URL)
+        with pytest.raises(DuplicateNameError):
+            pool.claim(name='chef-bcpc.a')
+
+    def test_resize(self, pool):
+        pool.resize(3, source_url='https://other')
+        conf = BuildUnitPool.load_conf()
+        assert conf['size'] == 3
+        assert conf['source_url'] == 'https://other'
+        add_unit(pool.session, 'chef-bcpc.a', POOLED,
+                 source_url='https://other')
+        assert pool.status()['deficit'] == 2
+
+
+class TestAllocateUniqueName:
+    @pytest.fixture
+    def allocator(self, pool, monkeypatch):
+        allocator = pool.allocator
+        monkeypatch.setattr(allocator, 'allocate_build_user', lambda u: u)
+        self.removed = []
+        monkeypatch.setattr(
+            allocator, 'destroy',
+            lambda bunit, commit: self.removed.append(bunit.build_user))
+        return allocator
+
+    def test_duplicate_name(self, allocator):
+        first = allocator.allocate(source_url='x', name='mine')
+        with pytest.raises(DuplicateNameError):
+            allocator.allocate(source_url='x', name='mine')
+        # The build user created for the loser is removed again
+        assert len(self.removed) == 1
+        assert self.removed[0] != first.build_user
+        assert allocator.session.query(BuildUnit).count() == 1
@@ -0,0 +1,85 @@
+"""Runs against the PostgreSQL database at $BCPC_BUILD_TEST_PG_URL.
+
+The database is emptied first. A local instance will do:
+
+    createdb bcpc_build_test
+    BCPC_BUILD_TEST_PG_URL=postgresql:///bcpc_build_test pytest tests
+"""
+from alembic.config import Config
+from alembic import command
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnit
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.db import utils as dbutils
+from bcpc_build import history
+from datetime import datetime
+from pathlib import Path
+from tests.conftest import add_unit
+import bcpc_build
+import os
+import pytest
+import shutil
+
+URL = os.environ.get('BCPC_BUILD_TEST_PG_URL')
+
+pytestmark = pytest.mark.skipif(
+    not URL, reason='BCPC_BUILD_TEST_PG_URL is not set')
+
+
+def alembic_config():
+    ini = Path(bcpc_build.__file__).parent.parent.joinpath('alembic.ini')
+    cfg = Config(ini.as_posix())
+    cfg.set_section_option('alembic', 'sqlalchemy.url',
+                           URL.replace('%', '%%'))
+    return cfg
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(dbutils.config.db, 'url', URL)
+    monkeypatch.setattr(dbutils, '_engines', {})
+    cfg = alembic_config()
+    command.downgrade(cfg, 'base')
+    command.upgrade(cfg, 'head')
+    yield cfg
+    dbutils.get_engine().dispose()
+    command.downgrade(cfg, 'base')
+
+
+def test_migrations_round_trip(database):
+    command.downgrade(database, 'base')
+    command.upgrade(database, 'head')
+    with dbutils.get_engine().connect() as conn:
+        labels = [r[0] for r in conn.execute(
+            "SELECT unnest(enum_range(NULL::buildstateenum))::text")]
+    assert 'pooled' in labels and 'failed:build' in labels
+
+
+def test_state_history(database):
+    session = dbutils.Session()
+    allocator = BuildUnitAllocator(session=session)
+    bunit = add_unit(session, 'unit1', BuildStateEnum.provisioned)
+    allocator.set_build_state(bunit, BuildStateEnum.building)
+    allocator.set_build_state(bunit, BuildStateEnum.failed_build)
+    failed = session.query(BuildUnit).filter(
+        BuildUnit.build_state == BuildStateEnum.failed_build).all()
+    assert [u.name for u in failed] == ['unit1']
+    stats = history.time_in_state(session, datetime(1970, 1, 1))
+    assert 'building' in stats
+    session.close()
+
+
+@pytest.mark.skipif(not shutil.which('pg_dump'),
+                    reason='PostgreSQL client tools not installed')
+def test_backup_and_import(database, tmpdir):
+    session = dbutils.Session()
+    add_unit(session, 'unit1', BuildStateEnum.done)
+    path = dbutils.backup(tmpdir.join('inventory.dump').strpath,
+                          compress=True)
+    add_unit(session, 'unit2', BuildStateEnum.done)
+    session.close()
+    dbutils.get_engine().dispose()
+    dbutils.import_db(path)
+    session = dbutils.Session()
+    assert [u.name for u in session.query(BuildUnit)] == ['unit1']
+    session.close()
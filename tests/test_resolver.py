@@ -0,0 +1,66 @@
+from bcpc_build import resolver
+from sqlalchemy import event
+from tests.conftest import add_unit
+import pytest
+import uuid
+
+IDS = {
+    'chef-bcpc.1': uuid.UUID('aaaa1111-0000-0000-0000-000000000001'),
+    'chef-bcpc.2': uuid.UUID('aaaa2222-0000-0000-0000-000000000002'),
+    'chef-bcpc.10': uuid.UUID('aaaa2222-9999-0000-0000-000000000003'),
+    'beef': uuid.UUID('bbbb0000-0000-0000-0000-000000000004'),
+}
+
+
+@pytest.fixture
+def session(session):
+    for name, id in IDS.items():
+        add_unit(session, name, id=id)
+    session.queries = []
+    event.listen(session.get_bind(), 'before_cursor_execute',
+                 lambda *args: session.queries.append(args[2]))
+    return session
+
+
+def names(units):
+    return [u.name for u in units]
+
+
+def test_identifiers(session):
+    full = str(IDS['beef'])
+    assert resolver.resolve_one(session, full).name == 'beef'
+    assert resolver.resolve_one(session, 'aaaa1').name == 'chef-bcpc.1'
+    assert resolver.resolve_one(session, 'aaaa2222-9').name == (
+        'chef-bcpc.10')
+    assert resolver.resolve_one(session, 'chef-bcpc.2').name == (
+        'chef-bcpc.2')
+    # Names are preferred to id prefixes
+    assert resolver.resolve_one(session, 'beef').name == 'beef'
+
+
+def test_globs(session):
+    assert names(resolver.resolve(session, ['chef-bcpc.*'])) == [
+        'chef-bcpc.1', 'chef-bcpc.2', 'chef-bcpc.10']
+    assert names(resolver.resolve(session, ['chef-bcpc.[!1]'])) == [
+        'chef-bcpc.2']
+    assert resolver.resolve(session, ['nothing*']) == []
+    with pytest.raises(resolver.AmbiguousUnitError):
+        resolver.resolve_one(session, 'chef-bcpc.?')
+
+
+def test_errors(session):
+    with pytest.raises(resolver.AmbiguousUnitError) as e:
+        resolver.resolve(session, ['aaaa2222'])
+    assert str(IDS['chef-bcpc.2']) in e.value.message
+    with pytest.raises(resolver.UnitNotFoundError):
+        resolver.resolve(session, ['beef', 'cccc'])
+    # Too short to be a prefix
+    with pytest.raises(resolver.UnitNotFoundError):
+        resolver.resolve(session, ['aaa'])
+
+
+def test_batch(session):
+    units = resolver.resolve(session, ['beef', 'chef-bcpc.1*', 'aaaa1111'])
+    # In the order given, each unit once
+    assert names(units) == ['beef', 'chef-bcpc.1', 'chef-bcpc.10']
+    assert len(session.queries) == 1
@@ -0,0 +1,67 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.build_unit import BuildUnitAllocator
+from bcpc_build.build_unit import V8BuildUnitAllocator
+from bcpc_build.logstore import LogStore
+from bcpc_build.runner import AsyncBuildRunner
+from bcpc_build import runner as runner_mod
+from tests.conftest import add_unit
+import pytest
+import sys
+
+
+def python_cmd(script):
+    return '%s -c "%s"' % (sys.executable, script)
+
+
+@pytest.fixture(autouse=True)
+def log_store(tmpdir, monkeypatch):
+    monkeypatch.setattr(
+        BuildUnitAllocator, 'get_log_store',
+        staticmethod(lambda bunit: LogStore(tmpdir.join(bunit.name).strpath))
+    )
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    commands = {}
+    monkeypatch.setattr(V8BuildUnitAllocator, 'build_commands',
+                        lambda self, bunit: commands[bunit.name])
+    return commands
+
+
+def test_runs_builds(session, commands):
+    ok = add_unit(session, 'ok', BuildStateEnum.configured)
+    bad = add_unit(session, 'bad', BuildStateEnum.configured)
+    commands['ok'] = [
+        ('create', python_cmd("print('created')")),
+        ('all', python_cmd("import sys; print('oops', file=sys.stderr)")),
+    ]
+    commands['bad'] = [('create', python_cmd('raise SystemExit(2)'))]
+    seen = []
+    runner = AsyncBuildRunner(session=session, max_concurrent=1,
+                              echo=lambda bunit, r: seen.append(
+                                  (bunit.name, r.stream, r.line)))
+    results = runner.run([(ok, 'v8'), (bad, 'v8')])
+    assert results == {ok.id: runner_mod.DONE, bad.id: runner_mod.FAILED}
+    assert ok.build_state == BuildStateEnum.done
+    assert bad.build_state == BuildStateEnum.failed_build
+    assert ('ok', 'stdout', 'created') in seen
+    assert ('ok', 'stderr', 'oops') in seen
+
+
+def test_cancel(session, commands):
+    slow = add_unit(session, 'slow', BuildStateEnum.configured)
+    waiting = add_unit(session, 'waiting', BuildStateEnum.configured)
+    commands['slow'] = [('create', python_cmd(
+        "import time; print('started', flush=True); time.sleep(60)"))]
+    commands['waiting'] = [('create', python_cmd("print('never')"))]
+
+    def echo(bunit, record):
+        runner.cancel_all()
+
+    runner = AsyncBuildRunner(session=session, max_concurrent=1, echo=echo)
+    results = runner.run([(slow, 'v8'), (waiting, 'v8')])
+    assert results == {slow.id: runner_mod.CANCELLED,
+                       waiting.id: runner_mod.CANCELLED}
+    assert slow.build_state == BuildStateEnum.failed_build
+    assert waiting.build_state == BuildStateEnum.configured
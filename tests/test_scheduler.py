@@ -0,0 +1,184 @@
+from bcpc_build.build_unit import BuildStateEnum
+from bcpc_build.db.migration_types import BuildQueueStateEnum
+from bcpc_build.scheduler import BuildScheduler
+from bcpc_build import capacity
+from bcpc_build import config
+from bcpc_build import utils
+from tests.conftest import add_unit
+import collections
+import contextlib
+import itertools
+import pytest
+
+MB = 1024 * 1024
+
+
+class FakeProc:
+    _pids = itertools.count(100000)
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.pid = next(self._pids)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+
+@pytest.fixture
+def procs(monkeypatch):
+    started = []
+
+    def spawn(*args):
+        proc = FakeProc(*args)
+        started.append(proc)
+        return proc
+
+    monkeypatch.setattr(utils, 'spawn_cli', spawn)
+    return started
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """A host of 8 cpus, 32G of memory and 100G of disk, all free."""
+    monkeypatch.setattr(config.capacity, 'cpu_overcommit', 1.0)
+    monkeypatch.setattr(config.capacity, 'mem_reserve_mb', 0)
+    monkeypatch.setattr(config.capacity, 'disk_reserve_mb', 0)
+    mem = collections.namedtuple('mem', 'total available')
+    disk = collections.namedtuple('disk', 'total free')
+    monkeypatch.setattr(capacity.psutil, 'cpu_count', lambda: 8)
+    monkeypatch.setattr(capacity.psutil, 'virtual_memory',
+                        lambda: mem(32768 * MB, 32768 * MB))
+    monkeypatch.setattr(capacity.psutil, 'disk_usage',
+                        lambda path: disk(102400 * MB, 102400 * MB))
+    footprints = {}
+    monkeypatch.setattr(
+        capacity, 'estimate_footprint',
+        lambda bunit, strategy=None: footprints.get(
+            bunit.name, capacity.Footprint(2, 8192, 10240)))
+    return footprints
+
+
+def add_units(session, n):
+    return [add_unit(session, 'u%d' % i, BuildStateEnum.provisioned)
+            for i in range(n)]
+
+
+class TestBuildScheduler:
+    def test_priority_order(self, session):
+        units = add_units(session, 3)
+        scheduler = BuildScheduler(session=session, policy='priority')
+        entries = [scheduler.enqueue(u, 'v8') for u in units]
+        scheduler.reprioritize(entries[2].id, 10)
+        order = [e.id for e in scheduler.pending()]
+        assert order == [entries[2].id, entries[0].id, entries[1].id]
+
+        fifo = BuildScheduler(session=session, policy='fifo')
+        assert [e.id for e in fifo.pending()] == [e.id for e in entries]
+
+    def test_schedule_respects_limit(self, session, procs):
+        units = add_units(session, 3)
+        scheduler = BuildScheduler(session=session, max_concurrent=2,
+                                   admission=False)
+        entries = [scheduler.enqueue(u, 'v8') for u in units]
+        started = scheduler.schedule()
+        assert [e.id for e in started] == [entries[0].id, entries[1].id]
+        assert scheduler.schedule() == []
+
+        procs[0].returncode = 0
+        started = scheduler.schedule()
+        assert [e.id for e in started] == [entries[2].id]
+        states = [scheduler.get(e.id).state for e in entries]
+        assert states == [BuildQueueStateEnum.done,
+                          BuildQueueStateEnum.running,
+                          BuildQueueStateEnum.running]
+
+    def test_cancel_queued(self, session, procs):
+        units = add_units(session, 1)
+        scheduler = BuildScheduler(session=session)
+        entry = scheduler.enqueue(units[0], 'v8')
+        assert scheduler.cancel(entry.id)
+        assert not scheduler.cancel(entry.id)
+        assert scheduler.schedule() == []
+        assert procs == []
+
+    def test_defers_until_room(self, session, procs, host):
+        units = add_units(session, 3)
+        host['u0'] = capacity.Footprint(6, 8192, 10240)
+        scheduler = BuildScheduler(session=session, max_concurrent=3)
+        entries = [scheduler.enqueue(u, 'v8') for u in units]
+        # u2 waits until u0 finishes
+        started = scheduler.schedule()
+        assert [e.id for e in started] == [entries[0].id, entries[1].id]
+        units[0].build_state = units[1].build_state = BuildStateEnum.building
+        session.commit()
+        assert scheduler.schedule() == []
+        assert scheduler.get(entries[2].id).state == BuildQueueStateEnum.queued
+
+        procs[0].returncode = 0
+        units[0].build_state = BuildStateEnum.done
+        session.commit()
+        assert [e.id for e in scheduler.schedule()] == [entries[2].id]
+
+    def test_rejects_never_fitting(self, session, procs, host):
+        units = add_units(session, 2)
+        host['u0'] = capacity.Footprint(16, 8192, 10240)
+        scheduler = BuildScheduler(session=session)
+        entries = [scheduler.enqueue(u, 'v8') for u in units]
+        started = scheduler.schedule()
+        assert [e.id for e in started] == [entries[1].id]
+        assert scheduler.get(entries[0].id).state == BuildQueueStateEnum.failed
+
+    def test_run_rechecks_after_unlocking(self, session, monkeypatch,
+                                          tmpdir):
+        units = add_units(session, 4)
+        scheduler = BuildScheduler(session=session, admission=False)
+        # Another host's builds neither keep this scheduler polling nor
+        # are started by it
+        other = scheduler.enqueue(units[2], 'v8')
+        other.state = BuildQueueStateEnum.running
+        other.host = 'build2.example.com'
+        queued = scheduler.enqueue(units[3], 'v8')
+        queued.host = 'build2.example.com'
+        session.commit()
+        scheduler.enqueue(units[0], 'v8')
+
+        def spawn(*args):
+            proc = FakeProc(*args)
+            proc.returncode = 0
+            return proc
+
+        lock = utils.file_lock
+        late = []
+
+        @contextlib.contextmanager
+        def file_lock(path, blocking=True):
+            with lock(path, blocking=blocking):
+                yield
+                if not late:
+                    # Its spawned scheduler finds the lock still held
+                    late.append(scheduler.enqueue(units[1], 'v8'))
+
+        monkeypatch.setattr(utils, 'spawn_cli', spawn)
+        monkeypatch.setattr(utils, 'file_lock', file_lock)
+        monkeypatch.setattr(config.scheduler, 'lock_file',
+                            str(tmpdir.join('scheduler.lock')))
+        scheduler.run(interval=0)
+        assert scheduler.get(late[0].id).state == BuildQueueStateEnum.done
+        assert scheduler.get(other.id).state == BuildQueueStateEnum.running
+        assert scheduler.get(queued.id).state == BuildQueueStateEnum.queued
+
+    def test_cancel_running(self, session, procs, monkeypatch):
+        killed = []
+        monkeypatch.setattr(utils, 'kill_proc_tree', killed.append)
+        units = add_units(session, 1)
+        scheduler = BuildScheduler(session=session, admission=False)
+        entry = scheduler.enqueue(units[0], 'v8')
+        scheduler.schedule()
+        units[0].build_state = BuildStateEnum.building
+        session.commit()
+        assert scheduler.cancel(entry.id)
+        assert killed == [procs[0].pid]
+        assert units[0].build_state == BuildStateEnum.failed_build
+        assert scheduler.get(entry.id).state == (
+            BuildQueueStateEnum.cancelled)
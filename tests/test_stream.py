@@ -0,0 +1,35 @@
+from bcpc_build.build_unit import BuildLogger
+from bcpc_build.utils.stream import OutputRecord
+from bcpc_build.utils.stream import iter_output
+import io
+import subprocess
+import sys
+
+SCRIPT = '''
+import sys
+print("out 1", flush=True)
+print("err 1", file=sys.stderr, flush=True)
+print("", flush=True)
+sys.stdout.write("  out 2  ")
+'''
+
+
+def test_iter_output():
+    proc = subprocess.Popen([sys.executable, '-c', SCRIPT],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    records = list(iter_output(proc))
+    assert proc.wait() == 0
+    lines = sorted((r.stream, r.line) for r in records)
+    assert lines == [('stderr', 'err 1'), ('stdout', 'out 1'),
+                     ('stdout', 'out 2')]
+    assert all(r.timestamp > 0 for r in records)
+
+
+def test_build_logger_accepts_records():
+    out = io.StringIO()
+    seen = []
+    blogger = BuildLogger(stream=out, func=seen.append)
+    record = OutputRecord(0.0, 'stderr', 'oops')
+    blogger.echo(record)
+    assert out.getvalue() == 'oops\n'
+    assert seen == [record]
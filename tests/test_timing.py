@@ -0,0 +1,65 @@
+from bcpc_build.timing import PhaseTimer
+from bcpc_build import timing
+from tests.conftest import add_unit
+import subprocess
+import threading
+import pytest
+
+
+def test_percentile():
+    values = list(range(1, 21))
+    assert timing.percentile(values, 50) == 10
+    assert timing.percentile(values, 95) == 19
+    assert timing.percentile([3], 95) == 3
+
+
+class TestPhaseTimer:
+    def test_records_after_bind(self, session):
+        timer = PhaseTimer(session)
+        with timer.phase('allocate'):
+            pass
+        bunit = add_unit(session, 'a')
+        assert timing.unit_events(session, bunit.id).count() == 0
+        timer.bind(bunit.id)
+        events = timing.unit_events(session, bunit.id).all()
+        assert [(e.phase, e.exit_status) for e in events] == [
+            ('allocate', 0)]
+        assert events[0].duration >= 0
+
+    def test_failed_phase(self, session):
+        bunit = add_unit(session, 'a')
+        timer = PhaseTimer(session, bunit.id)
+        with pytest.raises(subprocess.CalledProcessError):
+            with timer.phase('clone:x'):
+                raise subprocess.CalledProcessError(128, 'git')
+        (event,) = timing.unit_events(session, bunit.id)
+        assert event.exit_status == 128
+
+    def test_other_threads_wait_for_flush(self, session):
+        bunit = add_unit(session, 'a')
+        timer = PhaseTimer(session, bunit.id)
+
+        def clone():
+            with timer.phase('clone:x'):
+                pass
+
+        t = threading.Thread(target=clone)
+        t.start()
+        t.join()
+        assert timing.unit_events(session, bunit.id).count() == 0
+        timer.flush()
+        assert timing.unit_events(session, bunit.id).count() == 1
+
+
+def test_phase_stats(session):
+    for i, status in enumerate((0, 0, 1)):
+        timer = PhaseTimer(session, add_unit(session, str(i)).id)
+        try:
+            with timer.phase('configure'):
+                if status:
+                    raise RuntimeError()
+        except RuntimeError:
+            pass
+    assert timing.phase_stats(session)['configure']['count'] == 2
+    assert timing.phase_stats(session, successful=False)[
+        'configure']['count'] == 3